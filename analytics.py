@@ -0,0 +1,247 @@
+import io
+import logging
+import time
+from array import array
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+COOLDOWN = 300            # секунд между комментариями одного клиента (пауза в content.js)
+TOP_N = 10                # строк в топах авторов, почт и номеров
+REPORT_PERIODS = {"24h": 86400, "7d": 7 * 86400, "30d": 30 * 86400, "365d": 365 * 86400, "all": None}
+INTERVAL_BINS = (0, 60, 120, 180, 240, 300, 360, 480, 600, 900, 1800, 3600)  # секунд, последняя корзина - дольше
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+ANALYTICS_BACKEND = "numpy" if np is not None else "python"
+
+
+# ==================== СЛОВАРНОЕ КОДИРОВАНИЕ ====================
+class StringDictionary:
+    """Строки колонки хранятся кодами; -1 - пустое значение"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, value):
+        if not value:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+# ==================== КОЛОНКИ КОММЕНТАРИЕВ ====================
+class CommentColumns:
+    """Комментарии по колонкам: время, номер и коды клиента, автора и почты.
+
+    Колонки - array.array: дописываются без копирования всего столбца и
+    без объекта на строку. snapshot() в цикле событий копирует нужный
+    период (через numpy, если он есть), а отчет по копии считается уже
+    в пуле потоков.
+    """
+
+    def __init__(self):
+        self.ts = array('q')
+        self.number = array('q')  # номер в скобках приходит от расширения и может не влезть в int32
+        self.client = array('i')
+        self.author = array('i')
+        self.email = array('i')
+        self.clients = StringDictionary()
+        self.authors = StringDictionary()
+        self.emails = StringDictionary()
+
+    def __len__(self):
+        return len(self.ts)
+
+    def add(self, ts, client, author, email, number):
+        self.ts.append(int(ts))
+        valid = isinstance(number, int) and not isinstance(number, bool) and 0 <= number < 2 ** 63
+        self.number.append(number if valid else -1)
+        self.client.append(self.clients.encode(client))
+        self.author.append(self.authors.encode(author))
+        self.email.append(self.emails.encode(email.lower() if email else None))
+
+    def rebuild(self, rows):
+        """Заполняет колонки из журнала: rows - (ts, client, msg_id, author, email, number, link)"""
+        started = time.perf_counter()
+        self.__init__()
+        seen = set()
+        for ts, client, msg_id, author, email, number, link in rows:
+            # В журнале и повторы кадров: считаем комментарий один раз, как и уведомления
+            key = (msg_id, link or '')
+            if key in seen:
+                continue
+            seen.add(key)
+            self.add(ts, client, author, email, number)
+        logger.info(f"📈 Аналитика: {len(self)} комментариев за {(time.perf_counter() - started) * 1000:.0f}мс ({ANALYTICS_BACKEND})")
+
+    def snapshot(self, period=None, now=None):
+        """Копия колонок за последние period секунд (None - за все время)"""
+        start = None if period is None else int(((now or time.time()) - period) * 1000)
+        names = (self.authors.values[:], self.emails.values[:])
+        if np is None:
+            columns = [array(column.typecode, column) for column in (self.ts, self.number, self.client, self.author, self.email)]
+            return columns, names, start
+        columns = []
+        for column, dtype in ((self.ts, np.int64), (self.number, np.int64), (self.client, np.int32),
+                              (self.author, np.int32), (self.email, np.int32)):
+            columns.append(np.frombuffer(column, dtype=dtype) if len(self) else np.zeros(0, dtype=dtype))
+        ts = columns[0]
+        if start is None:
+            columns = [column.copy() for column in columns]
+        else:
+            mask = ts >= start
+            columns = [column[mask] for column in columns]
+        return columns, names, None
+
+
+# ==================== ОТЧЕТ ====================
+def build_report(snapshot, tz_offset=None):
+    """Сводка по снимку колонок; можно вызывать из пула потоков"""
+    started = time.perf_counter()
+    columns, (authors, emails), start = snapshot
+    tz_offset = time.localtime().tm_gmtoff if tz_offset is None else tz_offset
+    if np is None:
+        report = _report_python(columns, authors, emails, start, tz_offset)
+    else:
+        report = _report_numpy(columns, authors, emails, tz_offset)
+    report["elapsed_ms"] = (time.perf_counter() - started) * 1000
+    return report
+
+
+def _report_numpy(columns, authors, emails, tz_offset):
+    ts, number, client, author, email = columns
+    report = {"total": int(len(ts))}
+    if not len(ts):
+        return report
+    report["first"], report["last"] = int(ts.min()), int(ts.max())
+    report["authors"] = _top_codes(author, authors)
+    report["emails"] = _top_codes(email, emails)
+
+    seconds = ts // 1000 + tz_offset
+    report["hours"] = np.bincount(seconds // 3600 % 24, minlength=24).tolist()
+    # 1 января 1970 - четверг, неделя начинается с понедельника
+    report["weekdays"] = np.bincount((seconds // 86400 + 3) % 7, minlength=7).tolist()
+
+    values, counts = np.unique(number[number >= 0], return_counts=True)
+    order = np.argsort(-counts, kind='stable')[:TOP_N]
+    report["numbers"] = [(int(values[i]), int(counts[i])) for i in order]
+
+    # Интервалы между соседними комментариями одного клиента
+    order = np.lexsort((ts, client))
+    same = client[order][1:] == client[order][:-1]
+    gaps = (np.diff(ts[order])[same]) / 1000
+    report["intervals"] = _interval_summary(
+        len(gaps),
+        float(np.median(gaps)) if len(gaps) else None,
+        float(np.percentile(gaps, 90)) if len(gaps) else None,
+        int((gaps < COOLDOWN).sum()),
+        int(((gaps >= COOLDOWN) & (gaps < COOLDOWN * 1.1)).sum()),
+        np.histogram(gaps, bins=INTERVAL_BINS + (np.inf,))[0].tolist(),
+    )
+    return report
+
+
+def _top_codes(codes, names):
+    present = codes[codes >= 0]
+    if not len(present):
+        return []
+    counts = np.bincount(present, minlength=len(names))
+    top = np.argsort(-counts, kind='stable')[:TOP_N]
+    return [(names[i], int(counts[i])) for i in top if counts[i]]
+
+
+def _report_python(columns, authors, emails, start, tz_offset):
+    # Без NumPy: те же цифры циклами Python, заметно медленнее на длинной истории
+    rows = [row for row in zip(*columns) if start is None or row[0] >= start]
+    report = {"total": len(rows)}
+    if not rows:
+        return report
+    ts = [row[0] for row in rows]
+    report["first"], report["last"] = min(ts), max(ts)
+    report["authors"] = [(authors[code], n) for code, n in Counter(row[3] for row in rows if row[3] >= 0).most_common(TOP_N)]
+    report["emails"] = [(emails[code], n) for code, n in Counter(row[4] for row in rows if row[4] >= 0).most_common(TOP_N)]
+
+    hours, weekdays = [0] * 24, [0] * 7
+    for value in ts:
+        seconds = value // 1000 + tz_offset
+        hours[seconds // 3600 % 24] += 1
+        weekdays[(seconds // 86400 + 3) % 7] += 1
+    report["hours"], report["weekdays"] = hours, weekdays
+    report["numbers"] = Counter(row[1] for row in rows if row[1] >= 0).most_common(TOP_N)
+
+    by_client = {}
+    for value, _, client, _, _ in rows:
+        by_client.setdefault(client, []).append(value)
+    gaps = []
+    for values in by_client.values():
+        values.sort()
+        gaps.extend((b - a) / 1000 for a, b in zip(values, values[1:]))
+    gaps.sort()
+    histogram = [0] * len(INTERVAL_BINS)
+    for gap in gaps:
+        i = len(INTERVAL_BINS) - 1
+        while INTERVAL_BINS[i] > gap:
+            i -= 1
+        histogram[i] += 1
+    report["intervals"] = _interval_summary(
+        len(gaps),
+        _percentile(gaps, 50),
+        _percentile(gaps, 90),
+        sum(1 for gap in gaps if gap < COOLDOWN),
+        sum(1 for gap in gaps if COOLDOWN <= gap < COOLDOWN * 1.1),
+        histogram,
+    )
+    return report
+
+
+def _percentile(values, q):
+    """Процентиль с линейной интерполяцией, как numpy.percentile"""
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def _interval_summary(count, median, p90, faster, near, histogram):
+    return {"count": count, "median": median, "p90": p90, "faster": faster, "near": near, "histogram": histogram}
+
+
+# ==================== ГРАФИК ====================
+def render_chart(report, title):
+    """PNG с гистограммами отчета или None, если matplotlib не установлен"""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        from matplotlib import pyplot as plt
+    except ImportError:
+        return None
+    figure, axes = plt.subplots(2, 2, figsize=(10, 7))
+    axes[0][0].bar(range(24), report["hours"])
+    axes[0][0].set_title("По часам")
+    axes[0][1].bar(WEEKDAYS, report["weekdays"])
+    axes[0][1].set_title("По дням недели")
+    numbers = sorted(report["numbers"])
+    axes[1][0].bar([str(n) for n, _ in numbers], [count for _, count in numbers])
+    axes[1][0].set_title("Номера в скобках")
+    labels = [f"{low // 60}м" for low in INTERVAL_BINS[:-1]] + [f"{INTERVAL_BINS[-1] // 60}м+"]
+    colors = ["tab:red" if low < COOLDOWN else "tab:blue" for low in INTERVAL_BINS]
+    axes[1][1].bar(labels, report["intervals"]["histogram"], color=colors)
+    axes[1][1].set_title(f"Интервалы (пауза {COOLDOWN // 60} мин)")
+    figure.suptitle(title)
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", dpi=100)
+    plt.close(figure)
+    return buffer.getvalue()
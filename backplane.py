@@ -0,0 +1,348 @@
+"""Шина между экземплярами хаба.
+
+Экземпляр control владеет Telegram, реестром клиентов и обработкой
+сообщений; экземпляры edge только держат WebSocket-соединения расширений
+и пересылают кадры в control. Связь идет через BrokerBackplane -
+клиент Broker на unix:///путь или tcp://хост:порт, кадры - JSON построчно.
+"""
+import asyncio
+import logging
+import os
+from urllib.parse import urlsplit
+
+from protocol import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+RECONNECT_DELAY = 1           # секунд между попытками подключиться к брокеру
+MAX_PENDING = 10000           # кадров копим, пока брокер недоступен
+MAX_PEER_BUFFER = 8 * 1024 * 1024  # байт в буфере отправки пира, после - отключаем его
+MAX_LINE = 16 * 1024 * 1024   # самый длинный кадр
+
+
+def parse_url(url):
+    """unix:///путь -> ('unix', путь); tcp://хост:порт -> ('tcp', хост, порт)"""
+    parts = urlsplit(url)
+    if parts.scheme == 'unix':
+        return 'unix', parts.path
+    if parts.scheme == 'tcp':
+        return 'tcp', parts.hostname or '127.0.0.1', parts.port
+    raise ValueError(f"Неподдерживаемый адрес шины: {url}")
+
+
+def parse_frame(line):
+    """Кадр шины из строки или None, если это не JSON-объект с темой-строкой"""
+    try:
+        frame = loads(line)
+    except ValueError:
+        return None
+    if not isinstance(frame, dict) or not isinstance(frame.get("topic"), str):
+        return None
+    if not isinstance(frame.get("to", ""), str):
+        return None
+    return frame
+
+
+# ==================== ИНТЕРФЕЙС ====================
+class Backplane:
+    """Публикация и подписка по темам между экземплярами.
+
+    handler(data, sender) вызывается в цикле событий. publish(..., to=id)
+    доставляет кадр только экземпляру id, без to - всем остальным.
+    """
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.handlers = {}
+        self.stats = {"published": 0, "received": 0, "dropped": 0}
+
+    def subscribe(self, topic, handler):
+        self.handlers.setdefault(topic, []).append(handler)
+
+    def _deliver(self, topic, data, sender):
+        self.stats["received"] += 1
+        for handler in self.handlers.get(topic, ()):
+            try:
+                handler(data, sender)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработчика шины {topic}: {e!r}")
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, topic, data, to=None):
+        raise NotImplementedError
+
+
+# ==================== ЧЕРЕЗ БРОКЕР ====================
+async def _open(url):
+    address = parse_url(url)
+    if address[0] == 'unix':
+        return await asyncio.open_unix_connection(address[1], limit=MAX_LINE)
+    return await asyncio.open_connection(address[1], address[2], limit=MAX_LINE)
+
+
+class BrokerBackplane(Backplane):
+    """Клиент брокера; переподключается сам, пока брокер недоступен - копит кадры"""
+
+    def __init__(self, instance, url):
+        super().__init__(instance)
+        self.url = url
+        self.writer = None
+        self.pending = []
+        self.task = None
+        self.connected = asyncio.Event()
+
+    async def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+        await self.connected.wait()
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.writer:
+            self.writer.close()
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await _open(self.url)
+            except OSError as e:
+                logger.warning(f"⚠️ Брокер шины {self.url} недоступен: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            writer.write(dumps({"topic": "hello", "from": self.instance}).encode() + b"\n")
+            for line in self.pending:
+                writer.write(line)
+            self.pending = []
+            self.writer = writer
+            self.connected.set()
+            logger.info(f"🔗 {self.instance}: подключен к шине {self.url}")
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    frame = parse_frame(line)
+                    if frame is None:
+                        # Битый кадр отбрасываем, связь с шиной не рвем
+                        self.stats["dropped"] += 1
+                        logger.warning("⚠️ Некорректный кадр шины отброшен: %.200r", line)
+                        continue
+                    self._deliver(frame["topic"], frame.get("data"), frame.get("from"))
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+                logger.warning(f"⚠️ Связь с шиной прервана: {e!r}")
+            finally:
+                self.writer = None
+                self.connected.clear()
+                writer.close()
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def publish(self, topic, data, to=None):
+        frame = {"topic": topic, "from": self.instance, "data": data}
+        if to:
+            frame["to"] = to
+        line = dumps(frame).encode() + b"\n"
+        self.stats["published"] += 1
+        if self.writer is None:
+            if len(self.pending) >= MAX_PENDING:
+                self.stats["dropped"] += 1
+                return
+            self.pending.append(line)
+            return
+        self.writer.write(line)
+        await self.writer.drain()
+
+
+class Broker:
+    """Пересылает строки-кадры между подключенными экземплярами"""
+
+    def __init__(self, url):
+        self.url = url
+        self.peers = {}
+        self.server = None
+
+    async def start(self):
+        address = parse_url(self.url)
+        if address[0] == 'unix':
+            if os.path.exists(address[1]):
+                os.unlink(address[1])
+            self.server = await asyncio.start_unix_server(self._handle, address[1], limit=MAX_LINE)
+        else:
+            self.server = await asyncio.start_server(self._handle, address[1], address[2], limit=MAX_LINE)
+        logger.info(f"🛰️ Брокер шины слушает {self.url}")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            for writer in list(self.peers.values()):
+                writer.close()
+            await self.server.wait_closed()
+
+    def _send(self, name, line):
+        writer = self.peers.get(name)
+        if writer is None:
+            return
+        if writer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+            # Пир не успевает читать: лучше отключить его, чем копить память
+            logger.warning(f"⚠️ Экземпляр {name} не читает шину, отключаем")
+            writer.close()
+            return
+        writer.write(line)
+
+    async def _handle(self, reader, writer):
+        name = None
+        try:
+            hello = loads(await reader.readline())
+            name = hello["from"]
+            old = self.peers.get(name)
+            if old is not None:
+                old.close()
+            self.peers[name] = writer
+            logger.info(f"🛰️ Экземпляр {name} подключился к шине")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                # Разбираем только адрес; сам кадр пересылается как есть
+                frame = parse_frame(line)
+                if frame is None:
+                    logger.warning("⚠️ Некорректный кадр от экземпляра %s отброшен", name)
+                    continue
+                to = frame.get("to")
+                if to:
+                    self._send(to, line)
+                else:
+                    for peer in list(self.peers):
+                        if peer != name:
+                            self._send(peer, line)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"⚠️ Ошибка связи с экземпляром {name}: {e!r}")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if name is not None and self.peers.get(name) is writer:
+                del self.peers[name]
+                down = dumps({"topic": "peer_down", "from": "broker", "data": {"instance": name}}).encode() + b"\n"
+                for peer in list(self.peers):
+                    self._send(peer, down)
+                logger.info(f"🛰️ Экземпляр {name} отключился от шины")
+            writer.close()
+
+
+# ==================== EDGE: СОЕДИНЕНИЯ РАСШИРЕНИЙ ====================
+class EdgeRelay:
+    """Держит WebSocket-соединения и пересылает их кадры экземпляру control"""
+
+    def __init__(self, backplane, control):
+        self.backplane = backplane
+        self.control = control
+        self.sockets = {}
+        backplane.subscribe("deliver", self._on_deliver)
+        backplane.subscribe("close_socket", self._on_close)
+        backplane.subscribe("peer_down", self._on_peer_down)
+
+    async def handle(self, websocket):
+        key = f"{self.backplane.instance}:{id(websocket):x}"
+        self.sockets[key] = websocket
+        reason = "error"
+        await self.backplane.publish("open", {"socket": key}, to=self.control)
+        try:
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    message = message.decode('utf-8', 'replace')
+                await self.backplane.publish("frame", {"socket": key, "raw": message}, to=self.control)
+            reason = "close"
+        except Exception as e:
+            logger.info(f"🔌 Соединение {key} оборвано: {e!r}")
+        finally:
+            self.sockets.pop(key, None)
+            await self.backplane.publish("close", {"socket": key, "reason": reason}, to=self.control)
+
+    def _on_deliver(self, data, sender):
+        websocket = self.sockets.get(data["socket"])
+        if websocket is not None:
+            asyncio.ensure_future(self._send(websocket, data["payload"]))
+
+    @staticmethod
+    async def _send(websocket, payload):
+        try:
+            await websocket.send(payload)
+        except Exception as e:
+            logger.debug(f"Кадр клиенту не доставлен: {e!r}")
+
+    def _on_close(self, data, sender):
+        websocket = self.sockets.get(data["socket"])
+        if websocket is not None:
+            asyncio.ensure_future(websocket.close())
+
+    def _on_peer_down(self, data, sender):
+        if data["instance"] == self.control:
+            # control перезапускается: клиенты переподключатся и заново представятся
+            for websocket in list(self.sockets.values()):
+                asyncio.ensure_future(websocket.close(1012, "control restart"))
+
+
+# ==================== CONTROL: УДАЛЕННЫЕ КЛИЕНТЫ ====================
+class RemoteSocket:
+    """Соединение клиента на другом экземпляре с интерфейсом websocket (send/close)"""
+
+    def __init__(self, backplane, instance, key):
+        self.backplane = backplane
+        self.instance = instance
+        self.key = key
+
+    async def send(self, payload):
+        await self.backplane.publish("deliver", {"socket": self.key, "payload": payload}, to=self.instance)
+
+    async def close(self, code=1000, reason=""):
+        await self.backplane.publish("close_socket", {"socket": self.key}, to=self.instance)
+
+
+class ControlBridge:
+    """Превращает кадры от edge в те же вызовы, что и для локальных соединений.
+
+    opened(websocket) -> conn, frame(conn, raw), closed(conn, websocket, reason)
+    """
+
+    def __init__(self, backplane, opened, frame, closed):
+        self.backplane = backplane
+        self.opened = opened
+        self.frame = frame
+        self.closed = closed
+        self.connections = {}  # ключ сокета -> (RemoteSocket, conn)
+        backplane.subscribe("open", self._on_open)
+        backplane.subscribe("frame", self._on_frame)
+        backplane.subscribe("close", self._on_close)
+        backplane.subscribe("peer_down", self._on_peer_down)
+
+    def _on_open(self, data, sender):
+        websocket = RemoteSocket(self.backplane, sender, data["socket"])
+        self.connections[data["socket"]] = (websocket, self.opened(websocket))
+
+    def _on_frame(self, data, sender):
+        entry = self.connections.get(data["socket"])
+        if entry is not None:
+            self.frame(entry[1], data["raw"])
+
+    def _on_close(self, data, sender):
+        entry = self.connections.pop(data["socket"], None)
+        if entry is not None:
+            self.closed(entry[1], entry[0], data.get("reason", "error"))
+
+    def _on_peer_down(self, data, sender):
+        # Экземпляр edge пропал вместе со всеми своими клиентами
+        for key, (websocket, conn) in list(self.connections.items()):
+            if websocket.instance == data["instance"]:
+                del self.connections[key]
+                self.closed(conn, websocket, "error")
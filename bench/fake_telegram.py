@@ -0,0 +1,181 @@
+"""Локальный фейк Telegram Bot API для тестов и бенчмарков.
+
+Запуск отдельно:  python -m bench.fake_telegram --port 8081
+Сервер хаба указывает на него через TELEGRAM_API_BASE=http://127.0.0.1:8081
+"""
+import argparse
+import asyncio
+import json
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+
+# ==================== ФЕЙК BOT API ====================
+class FakeBotAPI:
+    """Отвечает на вызовы Bot API и записывает их с временем получения.
+
+    Поддерживает то, чем пользуется хаб: sendMessage, edit*, answerCallbackQuery,
+    getMe, getUpdates (long polling из очереди updates), setWebhook и deleteWebhook.
+    retry_after > 0 заставляет следующий вызов вернуть 429.
+    """
+
+    def __init__(self, chat_id=1, latency=0.0):
+        self.chat_id = chat_id
+        self.latency = latency  # искусственная задержка ответа, секунд
+        self.calls = []         # (время, метод, параметры)
+        self.updates = asyncio.Queue()
+        self.update_id = 0
+        self.message_id = 0
+        self.retry_after = 0
+        self.server = None
+        self.writers = set()
+
+    async def start(self, host="127.0.0.1", port=0):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            for writer in list(self.writers):
+                writer.close()
+            await self.server.wait_closed()
+
+    # ---------- входящие обновления ----------
+    def command_update(self, text):
+        """Апдейт с командой от владельца чата - для getUpdates или POST на webhook"""
+        self.update_id += 1
+        self.message_id += 1
+        command = text.split()[0]
+        return {
+            "update_id": self.update_id,
+            "message": {
+                "message_id": self.message_id,
+                "date": int(time.time()),
+                "chat": {"id": self.chat_id, "type": "private"},
+                "from": {"id": self.chat_id, "is_bot": False, "first_name": "bench"},
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+            },
+        }
+
+    def callback_update(self, data, message_id=1):
+        """Апдейт с нажатием кнопки data под сообщением message_id"""
+        self.update_id += 1
+        return {
+            "update_id": self.update_id,
+            "callback_query": {
+                "id": str(self.update_id),
+                "from": {"id": self.chat_id, "is_bot": False, "first_name": "bench"},
+                "chat_instance": "bench",
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": self.chat_id, "type": "private"},
+                    "text": "bench",
+                },
+            },
+        }
+
+    def push_command(self, text):
+        """Кладет в очередь getUpdates сообщение с командой от владельца чата"""
+        self.updates.put_nowait(self.command_update(text))
+        return time.time()
+
+    def push_callback(self, data, message_id=1):
+        """Кладет в очередь getUpdates нажатие кнопки"""
+        self.updates.put_nowait(self.callback_update(data, message_id))
+        return time.time()
+
+    def calls_of(self, method):
+        return [call for call in self.calls if call[1] == method]
+
+    # ---------- HTTP ----------
+    async def _handle(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await self._dispatch(target, headers, body)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, asyncio.CancelledError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, target, headers, body):
+        url = urlsplit(target)
+        method = url.path.rsplit('/', 1)[-1]
+        params = dict(parse_qsl(url.query))
+        if body:
+            if headers.get('content-type', '').startswith('application/json'):
+                params.update(json.loads(body))
+            else:
+                params.update(parse_qsl(body.decode()))
+        self.calls.append((time.time(), method, params))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method != 'getUpdates' and self.retry_after:
+            retry_after, self.retry_after = self.retry_after, 0
+            return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                         "parameters": {"retry_after": retry_after}}
+        return 200, {"ok": True, "result": await self._result(method, params)}
+
+    async def _result(self, method, params):
+        if method == 'getMe':
+            return {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+        if method == 'getUpdates':
+            timeout = min(float(params.get('timeout', 0) or 0), 1.0)
+            updates = []
+            try:
+                updates.append(await asyncio.wait_for(self.updates.get(), timeout or 0.01))
+            except asyncio.TimeoutError:
+                return []
+            while not self.updates.empty():
+                updates.append(self.updates.get_nowait())
+            return updates
+        if method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            self.message_id += 1
+            return {
+                "message_id": int(params.get('message_id', self.message_id)),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get('chat_id', self.chat_id)), "type": "private"},
+                "text": params.get('text', ''),
+            }
+        return True
+
+
+async def _serve(host, port, chat_id):
+    api = FakeBotAPI(chat_id)
+    port = await api.start(host, port)
+    print(f"Фейк Bot API слушает http://{host}:{port}")
+    while True:
+        await asyncio.sleep(5)
+        print(f"Вызовов: {len(api.calls)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--chat-id', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(_serve(args.host, args.port, args.chat_id))
@@ -0,0 +1,328 @@
+"""Нагрузочный бенчмарк WebSocket-хаба.
+
+Запускает websocket_server.py отдельным процессом с фейком Bot API вместо
+Telegram, поднимает N клиентов с протоколом WebSocketClient из content.js
+(hello, stats, log, comment, status_update) и меряет:
+  - пропускную способность приема кадров;
+  - задержку от отправки comment до sendMessage в Telegram;
+  - задержку рассылки команды /pause до всех клиентов;
+  - рост памяти процесса сервера.
+
+    python -m bench.load --clients 20 --duration 30 --out bench/results/new.json
+    python -m bench.load --compare bench/results/old.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+from bench.fake_telegram import FakeBotAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_TS = re.compile(r"bench-ts=(\d+\.\d+)")
+
+
+# ==================== УТИЛИТЫ ====================
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+    return {"count": len(values), "p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": pick(1.0)}
+
+
+def rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Сервер не открыл порт {port} за {timeout}с")
+
+
+# ==================== КЛИЕНТ-РАСШИРЕНИЕ ====================
+class SimulatedExtension:
+    """Имитация WebSocketClient из content.js"""
+
+    def __init__(self, index, port, args):
+        self.index = index
+        self.port = port
+        self.args = args
+        self.ws = None
+        self.sent = 0
+        self.send_times = []
+        self.commands = []  # (время получения, тип)
+        self.stats = {"commented": 0, "skipped": 0, "ignored": 0, "queueLength": 0,
+                      "waitingForCooldown": False, "lastMessageId": 0, "messageCounter": 0}
+
+    async def connect(self):
+        self.ws = await websockets.connect(f"ws://127.0.0.1:{self.port}", max_size=None)
+        await self.send({"type": "hello", "clientId": f"bench-{self.index:04d}", "group": "bench"})
+        asyncio.ensure_future(self.read())
+
+    async def read(self):
+        try:
+            async for raw in self.ws:
+                data = json.loads(raw)
+                self.commands.append((time.time(), data.get("type")))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def send(self, frame):
+        started = time.perf_counter()
+        await self.ws.send(json.dumps(frame))
+        self.send_times.append(time.perf_counter() - started)
+        self.sent += 1
+
+    async def emit(self, kind):
+        stats = self.stats
+        stats["messageCounter"] += 1
+        stats["lastMessageId"] += 1
+        if kind == "stats":
+            stats["skipped" if stats["messageCounter"] % 3 else "ignored"] += 1
+            stats["queueLength"] = stats["messageCounter"] % 5
+            await self.send({"type": "stats", "data": dict(stats)})
+        elif kind == "log":
+            await self.send({"type": "log", "level": self.args.log_level,
+                             "message": f"Сообщение #{stats['lastMessageId']} обработано",
+                             "timestamp": int(time.time() * 1000)})
+        elif kind == "comment":
+            stats["commented"] += 1
+            now = time.time()
+            await self.send({"type": "comment", "data": {
+                "id": stats["lastMessageId"],
+                "text": f"[{stats['commented'] % 19 + 2}] bench-ts={now:.6f}",
+                "link": f"https://st.yandex-team.ru/BENCH-{self.index}-{stats['commented']}",
+                "number": stats["commented"] % 19 + 2,
+                "author": f"Автор {self.index % 7}",
+                "email": f"user{self.index}@example.com",
+                "timestamp": int(now * 1000),
+            }})
+            await self.emit("stats")
+        elif kind == "status_update":
+            await self.send({"type": "status_update", "paused": False})
+
+    async def run(self, kind, rate, deadline):
+        if rate <= 0:
+            return
+        interval = 1.0 / rate
+        next_at = time.monotonic() + interval * (self.index % 10) / 10
+        # Редкие кадры (stats, status_update) не должны растягивать прогон за deadline
+        while next_at < deadline:
+            await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+            if time.monotonic() >= deadline:
+                break
+            await self.emit(kind)
+            next_at += interval
+
+    async def close(self):
+        if self.ws:
+            await self.ws.close()
+
+
+# ==================== СЦЕНАРИЙ ====================
+async def run_benchmark(args):
+    api = FakeBotAPI(chat_id=1)
+    api_port = await api.start()
+    ws_port = free_port()
+    workdir = tempfile.mkdtemp(prefix="hub-bench-")
+    env = dict(
+        os.environ,
+        BOT_TOKEN="123456:bench",
+        CHAT_ID="1",
+        TELEGRAM_API_BASE=f"http://127.0.0.1:{api_port}",
+        WEBSOCKET_HOST="127.0.0.1",
+        WEBSOCKET_PORT=str(ws_port),
+        EVENT_STORE_PATH=os.path.join(workdir, "events.db"),
+    )
+    log_file = open(os.path.join(workdir, "server.log"), "w")
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "websocket_server.py")],
+                              cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    rss = []
+    try:
+        await wait_for_port(ws_port)
+        rss.append(rss_kb(server.pid))
+
+        clients = [SimulatedExtension(i, ws_port, args) for i in range(args.clients)]
+        await asyncio.gather(*(client.connect() for client in clients))
+
+        started = time.monotonic()
+        deadline = started + args.duration
+        tasks = []
+        for client in clients:
+            tasks += [
+                client.run("stats", args.stats_rate, deadline),
+                client.run("log", args.log_rate, deadline),
+                client.run("comment", args.comment_rate, deadline),
+                client.run("status_update", args.status_rate, deadline),
+            ]
+
+        async def fan_out():
+            pushes = []
+            for i in range(args.commands):
+                await asyncio.sleep(args.duration / (args.commands + 1))
+                pushes.append(api.push_command("/pause" if i % 2 == 0 else "/resume"))
+            return pushes
+
+        async def sample_memory():
+            while time.monotonic() < deadline:
+                await asyncio.sleep(min(1, max(0.0, deadline - time.monotonic())))
+                rss.append(rss_kb(server.pid))
+
+        results = await asyncio.gather(fan_out(), sample_memory(), *tasks)
+        pushes = results[0]
+        elapsed = time.monotonic() - started
+
+        # Даем очереди уведомлений дойти до фейка Telegram
+        await asyncio.sleep(args.drain)
+        rss.append(rss_kb(server.pid))
+
+        notify = []
+        for received, _, params in api.calls_of("sendMessage"):
+            match = BENCH_TS.search(params.get("text", ""))
+            if match:
+                notify.append(received - float(match.group(1)))
+
+        fanout = []
+        for pushed in pushes:
+            for client in clients:
+                arrival = next((t for t, kind in client.commands if t >= pushed and kind in ("pause", "resume")), None)
+                if arrival is not None:
+                    fanout.append(arrival - pushed)
+
+        frames = sum(client.sent for client in clients)
+        send_times = [t for client in clients for t in client.send_times]
+        comments = sum(client.stats["commented"] for client in clients)
+        await asyncio.gather(*(client.close() for client in clients))
+
+        samples = [value for value in rss if value is not None]
+        method_counts = {}
+        for _, method, _ in api.calls:
+            method_counts[method] = method_counts.get(method, 0) + 1
+        return {
+            "commit": git_commit(),
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "params": vars(args),
+            "ingest": {
+                "frames": frames,
+                "seconds": round(elapsed, 3),
+                # По заданному окну, чтобы прогоны разных коммитов были сравнимы
+                "frames_per_second": round(frames / args.duration, 1),
+                "send_latency_ms": percentiles(send_times),
+            },
+            "notify_latency_ms": dict(percentiles(notify), expected=comments),
+            "fanout_latency_ms": dict(percentiles(fanout), expected=len(pushes) * len(clients)),
+            "rss_kb": {"start": samples[0] if samples else None, "end": samples[-1] if samples else None,
+                       "max": max(samples) if samples else None},
+            "telegram_calls": method_counts,
+        }
+    finally:
+        server.terminate()
+        try:
+            server.wait(5)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        log_file.close()
+        await api.stop()
+
+
+# ==================== СРАВНЕНИЕ ====================
+COMPARED = [
+    ("ingest", "frames_per_second", True),
+    ("ingest.send_latency_ms", "p99", False),
+    ("notify_latency_ms", "p50", False),
+    ("notify_latency_ms", "p99", False),
+    ("fanout_latency_ms", "p50", False),
+    ("fanout_latency_ms", "p99", False),
+    ("rss_kb", "max", False),
+]
+
+
+def lookup(result, path):
+    for key in path.split("."):
+        result = (result or {}).get(key)
+    return result
+
+
+def compare(old, new):
+    print(f"{'метрика':40} {old.get('commit') or 'old':>12} {new.get('commit') or 'new':>12}   изменение")
+    for section, key, higher_is_better in COMPARED:
+        before = (lookup(old, section) or {}).get(key)
+        after = (lookup(new, section) or {}).get(key)
+        change = ""
+        if before and after is not None:
+            delta = (after - before) / before * 100
+            worse = delta < 0 if higher_is_better else delta > 0
+            change = f"{delta:+.1f}%{'  ⚠️' if worse and abs(delta) > 10 else ''}"
+        print(f"{section + '.' + key:40} {str(before):>12} {str(after):>12}   {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--stats-rate", type=float, default=5, help="stats в секунду на клиента")
+    parser.add_argument("--log-rate", type=float, default=20, help="log в секунду на клиента")
+    parser.add_argument("--log-level", type=int, default=1, help="уровень log-кадров (2 - отладка в Telegram)")
+    parser.add_argument("--comment-rate", type=float, default=0.05, help="comment в секунду на клиента")
+    parser.add_argument("--status-rate", type=float, default=0.1, help="status_update в секунду на клиента")
+    parser.add_argument("--commands", type=int, default=5, help="сколько раз разослать /pause|/resume")
+    parser.add_argument("--drain", type=float, default=5, help="секунд ждать хвост уведомлений")
+    parser.add_argument("--out", help="куда сохранить результат (JSON)")
+    parser.add_argument("--compare", help="сравнить с прошлым результатом (JSON)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    options = argparse.Namespace(**{k: v for k, v in vars(args).items() if k not in ("out", "compare")})
+    result = asyncio.run(run_benchmark(options))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if baseline:
+        compare(baseline, result)
+
+
+if __name__ == "__main__":
+    main()
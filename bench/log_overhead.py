@@ -0,0 +1,115 @@
+"""Бенчмарк логирования в горячем пути.
+
+Сравнивает прежнюю схему (basicConfig: синхронный StreamHandler, f-строки)
+с очередью из log_setup (LazyQueueHandler + поток записи, ленивые %-строки)
+при медленном приемнике логов - например, stdout в переполненный pipe или
+диск под нагрузкой. Для каждой схемы меряется время одного вызова logger.*
+в цикле событий и задержка пробуждения цикла, пока идет поток записей.
+
+    python -m bench.log_overhead --records 5000 --write-delay 0.0005
+"""
+import argparse
+import asyncio
+import io
+import logging
+import statistics
+import sys
+import time
+
+from log_setup import TEXT_FORMAT, setup_logging
+
+
+class SlowStream(io.TextIOBase):
+    """Приемник, каждая запись в который занимает delay секунд"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, text):
+        time.sleep(self.delay)
+        self.lines += text.count("\n")
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+async def measure(logger, records, lazy):
+    """Пишет records записей из цикла событий; (время вызова, задержки цикла) в мс"""
+    calls = []
+    lags = []
+    stop = False
+
+    async def watch_lag():
+        while not stop:
+            expected = time.perf_counter() + 0.001
+            await asyncio.sleep(0.001)
+            lags.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+    watcher = asyncio.ensure_future(watch_lag())
+    client, kind = "c0ffee00-client", "stats"
+    for i in range(records):
+        started = time.perf_counter()
+        if lazy:
+            logger.info("📊 Статистика %s обновлена: commented=%s", client, i, extra={"client": client, "type": kind})
+            logger.debug("Кадр %s обработан", kind, extra={"client": client, "type": kind})
+        else:
+            logger.info(f"📊 Статистика {client} обновлена: commented={i}")
+            logger.debug(f"Кадр {kind} обработан клиентом {client}")
+        calls.append((time.perf_counter() - started) * 1000)
+        if i % 50 == 0:
+            # Дать циклу проснуться, как между кадрами от клиентов
+            await asyncio.sleep(0)
+    stop = True
+    await watcher
+    return calls, lags
+
+
+def summary(values):
+    values = sorted(values)
+    return {
+        "p50": statistics.median(values),
+        "p99": values[int(len(values) * 0.99) - 1],
+        "max": values[-1],
+    }
+
+
+def report(name, calls, lags):
+    call, lag = summary(calls), summary(lags or [0.0])
+    print(f"{name:<28} вызов p50 {call['p50']:.4f}мс p99 {call['p99']:.4f}мс max {call['max']:.2f}мс | "
+          f"задержка цикла p99 {lag['p99']:.2f}мс max {lag['max']:.2f}мс")
+    return call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--write-delay", type=float, default=0.0005, help="секунд на одну запись в приемник")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench.hot_path")
+    root = logging.getLogger()
+
+    # Прежняя схема: обработчик пишет прямо в вызывающем потоке
+    stream = SlowStream(args.write_delay)
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    root.handlers[:] = [handler]
+    root.setLevel(logging.INFO)
+    before = report("basicConfig + f-строки", *asyncio.run(measure(logger, args.records, lazy=False)))
+
+    # Очередь и поток записи
+    stream = SlowStream(args.write_delay)
+    control = setup_logging("INFO", stream=stream)
+    after = report("очередь + ленивые %-строки", *asyncio.run(measure(logger, args.records, lazy=True)))
+    started = time.perf_counter()
+    control.stop()
+    print(f"Поток записи дописал очередь за {(time.perf_counter() - started) * 1000:.0f}мс, "
+          f"записано строк: {stream.lines}, отброшено: {control.dropped}")
+    print(f"Ускорение вызова в цикле (p50): {before['p50'] / after['p50']:.0f}x")
+    sys.exit(0 if after['p99'] < before['p50'] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Проверка нескольких экземпляров хаба на одной машине.
+
+Поднимает фейк Bot API, экземпляр control (владеет Telegram и брокером шины)
+и несколько экземпляров edge на своих портах. К каждому edge подключаются
+клиенты с протоколом content.js, после чего проверяется, что:
+  - комментарии с любого edge доходят до Telegram;
+  - /pause из Telegram доходит до клиентов на всех edge;
+  - /status видит клиентов всех экземпляров, а /stats складывает их статистику.
+
+    python -m bench.multi_instance --edges 2 --clients 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+from bench.fake_telegram import FakeBotAPI
+from bench.load import ROOT, free_port, wait_for_port
+
+
+# ==================== КЛИЕНТ ====================
+class Client:
+    def __init__(self, name, port):
+        self.name = name
+        self.port = port
+        self.ws = None
+        self.received = []
+
+    async def connect(self):
+        self.ws = await websockets.connect(f"ws://127.0.0.1:{self.port}")
+        await self.ws.send(json.dumps({"type": "hello", "clientId": self.name, "group": None}))
+        await self.ws.send(json.dumps({"type": "stats", "seq": 1, "data": {"commented": 1, "skipped": 0, "ignored": 0}}))
+        asyncio.ensure_future(self.read())
+
+    async def read(self):
+        try:
+            async for raw in self.ws:
+                data = json.loads(raw)
+                if data.get("type") == "ping":
+                    await self.ws.send(json.dumps({"type": "pong", "ts": data["ts"]}))
+                self.received.append(data.get("type"))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def comment(self, number):
+        now = time.time()
+        await self.ws.send(json.dumps({"type": "comment", "data": {
+            "id": number,
+            "text": f"[5] multi-instance {self.name}",
+            "link": f"https://st.yandex-team.ru/MULTI-{number}",
+            "number": 5,
+            "author": self.name,
+            "email": None,
+            "timestamp": int(now * 1000),
+        }}))
+
+
+async def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(0.1)
+    return predicate()
+
+
+# ==================== СЦЕНАРИЙ ====================
+async def run(args):
+    api = FakeBotAPI(chat_id=1)
+    api_port = await api.start()
+    workdir = tempfile.mkdtemp(prefix="hub-multi-")
+    base_env = dict(
+        os.environ,
+        BOT_TOKEN="123456:multi",
+        CHAT_ID="1",
+        TELEGRAM_API_BASE=f"http://127.0.0.1:{api_port}",
+        WEBSOCKET_HOST="127.0.0.1",
+        BACKPLANE_URL=f"unix://{os.path.join(workdir, 'hub.sock')}",
+        METRICS_PORT="0",
+        FLAP_GRACE="1",
+    )
+    processes = []
+
+    def spawn(name, role, port):
+        env = dict(base_env, HUB_ROLE=role, WEBSOCKET_PORT=str(port), HUB_INSTANCE=name,
+                   EVENT_STORE_PATH=os.path.join(workdir, f"{name}.db"),
+                   STATE_SNAPSHOT_PATH=os.path.join(workdir, f"{name}.json"))
+        log = open(os.path.join(workdir, f"{name}.log"), "w")
+        processes.append((subprocess.Popen([sys.executable, os.path.join(ROOT, "websocket_server.py")],
+                                           cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT), log))
+
+    failures = []
+
+    def check(ok, what):
+        print(f"{'✅' if ok else '❌'} {what}")
+        if not ok:
+            failures.append(what)
+
+    try:
+        control_port = free_port()
+        spawn("control", "control", control_port)
+        await wait_for_port(control_port)
+        edge_ports = []
+        for i in range(args.edges):
+            port = free_port()
+            spawn(f"edge-{i}", "edge", port)
+            edge_ports.append(port)
+        for port in edge_ports:
+            await wait_for_port(port)
+
+        clients = [Client(f"multi-{e}-{c}", port) for e, port in enumerate(edge_ports) for c in range(args.clients)]
+        await asyncio.gather(*(client.connect() for client in clients))
+
+        for number, client in enumerate(clients, 1):
+            await client.comment(number)
+
+        def sent_texts():
+            return [params.get("text", "") for _, _, params in api.calls_of("sendMessage")]
+
+        check(await wait_until(lambda: all(any(c.name in text for text in sent_texts()) for c in clients), 10),
+              "комментарии всех клиентов дошли до Telegram")
+
+        api.push_command("/pause")
+        check(await wait_until(lambda: all("pause" in c.received for c in clients), 10),
+              "/pause дошла до клиентов на всех edge")
+
+        api.push_command("/status")
+        check(await wait_until(lambda: any(f"Клиентов подключено:</b> {len(clients)}" in text
+                                           for text in sent_texts()), 10),
+              f"/status видит всех {len(clients)} клиентов")
+
+        api.push_command("/stats")
+        check(await wait_until(lambda: any(f"Прокомментировано:</b> {len(clients)}" in text
+                                           for text in sent_texts()), 10),
+              "статистика складывается по всем экземплярам")
+
+        for client in clients:
+            await client.ws.close()
+    finally:
+        for process, log in processes:
+            process.terminate()
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+        await api.stop()
+    print(f"Логи экземпляров: {workdir}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--edges", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=3, help="клиентов на каждый edge")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Воспроизведение записанной сессии расширений.
+
+Сервер с RECORD_PATH=capture.jsonl.gz пишет все кадры WebSocket (recorder.py).
+Здесь запись проигрывается против websocket_server в этом же процессе: вместо
+сокетов - заглушки, вместо Telegram - фейк Bot API. Кадры подаются в
+client_frame с исходными интервалами, деленными на --speed (0 - без пауз).
+Результат:
+  - время обработки кадра по типам;
+  - итоговое состояние (как в снимке state.json, без меток времени);
+  - вызовы Telegram (метод и текст);
+  - число исходящих кадров по типам в записи и при воспроизведении.
+С --compare состояние и вызовы Telegram сравниваются с прошлым прогоном -
+так проверяется, что изменение сервера не поменяло поведение. Имена
+анонимных сокетов (anon-<адрес объекта>) меняются от прогона к прогону,
+поэтому в результате они заменены на anon-1, anon-2... в порядке появления.
+
+    python -m bench.replay capture.jsonl.gz --speed 0 --out bench/results/replay.json
+    python -m bench.replay capture.jsonl.gz --speed 0 --compare bench/results/replay.json
+"""
+import argparse
+import asyncio
+import collections
+import importlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+from bench.fake_telegram import FakeBotAPI
+from bench.load import git_commit, percentiles
+from recorder import CLOSE, IN, OPEN, OUT, read_capture
+
+# Поля снимка, которые зависят от времени прогона
+VOLATILE = ("last_seen",)
+ANON = re.compile(r"anon-[0-9a-f]+")
+
+
+class ReplaySocket:
+    """Заглушка соединения: запоминает кадры, отправленные сервером"""
+
+    def __init__(self, key):
+        self.key = key
+        self.sent = []
+        self.remote_address = ("replay", key)
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+def frame_type(message):
+    try:
+        return json.loads(message).get("type") or "<none>"
+    except (TypeError, ValueError, AttributeError):
+        return "<invalid>"
+
+
+def normalize(value, anon=None):
+    """Без полей времени; anon-<адрес> -> anon-N по порядку появления (общий словарь anon на весь результат)"""
+    anon = {} if anon is None else anon
+    if isinstance(value, dict):
+        return {normalize(k, anon): normalize(v, anon) for k, v in value.items() if k not in VOLATILE}
+    if isinstance(value, list):
+        return [normalize(v, anon) for v in value]
+    if isinstance(value, str):
+        return ANON.sub(lambda m: anon.setdefault(m.group(), f"anon-{len(anon) + 1}"), value)
+    return value
+
+
+def import_server(api_port, workdir, flap_grace):
+    """websocket_server читает настройки из окружения при импорте"""
+    os.environ.update({
+        "BOT_TOKEN": "123456:replay",
+        "CHAT_ID": "1",
+        "TELEGRAM_API_BASE": f"http://127.0.0.1:{api_port}",
+        "NOTIFIER": "telegram",
+        "EVENT_STORE_PATH": os.path.join(workdir, "events.db"),
+        "STATE_SNAPSHOT_PATH": os.path.join(workdir, "state.json"),
+        "METRICS_PORT": "0",
+        "FLAP_GRACE": str(flap_grace),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    })
+    os.environ.pop("RECORD_PATH", None)
+    return importlib.import_module("websocket_server")
+
+
+async def replay(args, header, entries):
+    api = FakeBotAPI(chat_id=1)
+    api_port = await api.start()
+    with tempfile.TemporaryDirectory() as workdir:
+        hub = import_server(api_port, workdir, args.flap_grace)
+        hub.init_logging()
+        hub.state.loop = asyncio.get_running_loop()
+        hub.notifier.start()
+        hub.event_store.start()
+
+        sockets = {}
+        conns = {}
+        latency = collections.defaultdict(list)
+        started = time.monotonic()
+        for entry in entries:
+            if args.speed:
+                delay = started + entry["t"] / args.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            key = entry["c"]
+            if entry["d"] == OPEN:
+                sockets[key] = ReplaySocket(key)
+                conns[key] = hub.client_opened(sockets[key])
+            elif entry["d"] == IN and key in conns:
+                frame_started = time.perf_counter()
+                hub.client_frame(conns[key], entry["m"])
+                latency[frame_type(entry["m"])].append(time.perf_counter() - frame_started)
+            elif entry["d"] == CLOSE and key in conns:
+                hub.client_closed(conns.pop(key), sockets[key], "close")
+            # Дать циклу разослать ответы и уведомления, как между кадрами от клиентов
+            await asyncio.sleep(0)
+        replayed_in = time.monotonic() - started
+
+        # Хвост: буфер логов, схлопывание переподключений, очередь Telegram, повторы команд
+        hub.log_pipeline.flush()
+        await asyncio.sleep(args.flap_grace + args.drain)
+        deadline = time.monotonic() + args.command_timeout
+        while len(hub.commands) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        await hub.notifier.queue.join()
+        state = hub.collect_snapshot()
+        hub.event_store.close()
+        hub.log_control.stop()
+    await api.stop()
+
+    def out_types(frames):
+        return dict(sorted(collections.Counter(frame_type(m) for m in frames).items()))
+
+    return {
+        "commit": git_commit(),
+        "capture": {"started": header.get("started"), "entries": len(entries),
+                    "duration_s": round(entries[-1]["t"], 3) if entries else 0},
+        "speed": args.speed,
+        "replayed_s": round(replayed_in, 3),
+        "frame_latency_ms": {kind: percentiles(values) for kind, values in sorted(latency.items())},
+        "out_frames": {
+            "capture": out_types(e["m"] for e in entries if e["d"] == OUT),
+            "replay": out_types(m for sock in sockets.values() for m in sock.sent),
+        },
+        **normalize({
+            "state": state,
+            "telegram": [[method, params.get("text")] for _, method, params in api.calls],
+        }),
+    }
+
+
+def diff_state(old, new, path=""):
+    """Пути, по которым состояния различаются"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        result = []
+        for key in sorted(set(old) | set(new)):
+            result += diff_state(old.get(key), new.get(key), f"{path}.{key}" if path else key)
+        return result
+    return [] if old == new else [path or "<root>"]
+
+
+def compare(old, new):
+    """Печатает расхождения; True, если поведение совпало"""
+    print(f"Сравнение {old.get('commit') or 'old'} -> {new.get('commit') or 'new'}")
+    # Результаты, сохраненные до замены anon-<адрес>
+    old = dict(old, **normalize({"state": old.get("state"), "telegram": old.get("telegram", [])}))
+    state_paths = diff_state(old.get("state"), new.get("state"))
+    for path in state_paths:
+        print(f"  состояние {path}: {lookup(old['state'], path)!r} -> {lookup(new['state'], path)!r}")
+    before = collections.Counter(tuple(call) for call in old.get("telegram", []))
+    after = collections.Counter(tuple(call) for call in new.get("telegram", []))
+    for call, count in sorted((before - after).items()):
+        print(f"  - Telegram x{count}: {call[0]} {str(call[1])[:80]!r}")
+    for call, count in sorted((after - before).items()):
+        print(f"  + Telegram x{count}: {call[0]} {str(call[1])[:80]!r}")
+    for kind, value in new["frame_latency_ms"].items():
+        was = (old.get("frame_latency_ms", {}).get(kind) or {}).get("p99")
+        print(f"  {kind:20} p99 {str(was):>10} -> {value.get('p99')}мс")
+    same = not state_paths and before == after
+    print("Поведение совпадает" if same else "⚠️ Поведение изменилось")
+    return same
+
+
+def lookup(value, path):
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="файл, записанный сервером с RECORD_PATH")
+    parser.add_argument("--speed", type=float, default=1, help="ускорение: 1 - как записано, 10 - в 10 раз быстрее, 0 - без пауз")
+    parser.add_argument("--flap-grace", type=float, default=1,
+                        help="FLAP_GRACE сервера при воспроизведении; при 0 о сокете объявляется еще до hello")
+    parser.add_argument("--drain", type=float, default=1, help="секунд ждать хвост уведомлений")
+    parser.add_argument("--command-timeout", type=float, default=20, help="секунд ждать повторов неподтвержденных команд")
+    parser.add_argument("--out", help="куда сохранить результат (JSON)")
+    parser.add_argument("--compare", help="сравнить с прошлым результатом (JSON)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    header, entries = read_capture(args.capture)
+    result = asyncio.run(replay(args, header, entries))
+    summary = {k: v for k, v in result.items() if k not in ("state", "telegram")}
+    summary["telegram_calls"] = len(result["telegram"])
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if baseline:
+        sys.exit(0 if compare(baseline, result) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Бенчмарк /report на синтетической истории комментариев.
+
+Заполняет колонки аналитики комментариями нескольких клиентов за N дней
+(по одному раз в 5-15 минут в рабочие часы) и меряет, сколько занимают
+копия колонок в цикле событий и расчет отчета за каждый период.
+
+    python -m bench.report --days 365 --clients 5
+"""
+import argparse
+import random
+import sys
+import time
+
+from analytics import ANALYTICS_BACKEND, COOLDOWN, REPORT_PERIODS, CommentColumns, build_report
+
+
+def fill(columns, days, clients, now):
+    rnd = random.Random(1)
+    authors = [f"Автор {i}" for i in range(200)]
+    for client in range(clients):
+        ts = now - days * 86400
+        while ts < now:
+            ts += rnd.uniform(COOLDOWN * 0.9, COOLDOWN * 3)
+            if not 9 <= time.localtime(ts).tm_hour < 19:
+                continue
+            author = rnd.choice(authors)
+            columns.add(int(ts * 1000), f"client-{client}", author, f"{author.split()[1]}@example.com", rnd.randint(1, 9))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--clients", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=100, help="мс на отчет, больше - ошибка")
+    args = parser.parse_args()
+
+    now = time.time()
+    columns = CommentColumns()
+    fill(columns, args.days, args.clients, now)
+    print(f"Комментариев: {len(columns)}, расчет: {ANALYTICS_BACKEND}")
+
+    worst = 0
+    for period, seconds in REPORT_PERIODS.items():
+        started = time.perf_counter()
+        snapshot = columns.snapshot(seconds, now)
+        copied = (time.perf_counter() - started) * 1000
+        report = build_report(snapshot)
+        total = copied + report["elapsed_ms"]
+        worst = max(worst, total)
+        print(f"{period:>5}: {report['total']:>8} комментариев, копия {copied:6.1f}мс, отчет {report['elapsed_ms']:6.1f}мс")
+    sys.exit(0 if worst <= args.budget else 1)
+
+
+if __name__ == "__main__":
+    main()
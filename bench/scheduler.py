@@ -0,0 +1,122 @@
+"""Общий кулдаун комментариев (scheduler.py) под нагрузкой.
+
+Моделирует --clients вкладок в одном цикле событий: каждая раз в --interval
+(со случайным разбросом) присылает кандидата на новое сообщение, часть
+кандидатов приходит на сообщения, которые уже ждет другая вкладка, часть
+сообщений получает чужой комментарий. Вкладка со слотом отвечает
+slot_result через --comment-delay; с вероятностью --miss комментарий не
+получается и слот возвращается. Кулдаун уменьшен (--cooldown), чтобы за
+--duration секунд выдать много слотов.
+
+Меряет время вызова offer() и время ожидания слота, считает решения и
+проверяет главное: два засчитанных комментария никогда не ближе cooldown.
+Код выхода 1, если проверка не прошла.
+
+    python -m bench.scheduler --clients 50 --duration 10
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import random
+import sys
+import time
+
+from scheduler import GRANTED, SLACK, CommentScheduler
+
+
+def percentiles_us(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1e6, 1)
+    return {"count": len(values), "p50": pick(0.50), "p90": pick(0.90), "p99": pick(0.99), "max": pick(1.0)}
+
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    rng = random.Random(args.seed)
+    offered = {}                   # (client_id, candidate_id) -> время offer
+    waited = []
+    decisions = collections.Counter()
+    slots = []                     # (время выдачи, засчитан ли комментарий)
+    message_ids = itertools.count(1)
+    recent = collections.deque(maxlen=20)
+
+    def decide(client_id, candidate_id, decision):
+        decisions[decision] += 1
+        waited.append(loop.time() - offered.pop((client_id, candidate_id)))
+        if decision == GRANTED:
+            loop.call_later(args.comment_delay, finish, client_id, candidate_id, loop.time())
+
+    def finish(client_id, candidate_id, granted_at):
+        commented = rng.random() >= args.miss
+        slots.append((granted_at, commented))
+        scheduler.released(client_id, candidate_id, commented)
+
+    scheduler = CommentScheduler(decide, cooldown=args.cooldown, max_wait=args.max_wait)
+    offer_time = []
+
+    async def client(client_id):
+        for number in itertools.count():
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * args.interval)
+            if recent and rng.random() < args.shared:
+                message_id = rng.choice(recent)
+            else:
+                message_id = next(message_ids)
+                recent.append(message_id)
+            candidate_id = f"{message_id}-{number}"
+            offered[(client_id, candidate_id)] = loop.time()
+            started = time.perf_counter()
+            scheduler.offer(client_id, candidate_id, message_id)
+            offer_time.append(time.perf_counter() - started)
+            if rng.random() < args.foreign:
+                loop.call_later(rng.uniform(0, args.interval), scheduler.foreign, message_id)
+
+    tasks = [asyncio.ensure_future(client(f"client-{i}")) for i in range(args.clients)]
+    await asyncio.sleep(args.duration)
+    for task in tasks:
+        task.cancel()
+    await asyncio.sleep(args.comment_delay * 2)
+
+    committed = sorted(at for at, commented in slots if commented)
+    gaps = [b - a for a, b in zip(committed, committed[1:])]
+    return {
+        "clients": args.clients,
+        "cooldown_s": args.cooldown,
+        "decisions": dict(decisions),
+        "stats": scheduler.stats,
+        "waiting_at_end": len(scheduler),
+        "offer_us": percentiles_us(offer_time),
+        "wait_ms": {k: (round(v / 1000, 1) if k != "count" else v) for k, v in percentiles_us(waited).items()},
+        "commented": len(committed),
+        "min_gap_s": round(min(gaps), 4) if gaps else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10, help="секунд моделирования")
+    parser.add_argument("--interval", type=float, default=0.2, help="секунд между кандидатами одной вкладки")
+    parser.add_argument("--cooldown", type=float, default=0.1)
+    parser.add_argument("--max-wait", type=float, default=1)
+    parser.add_argument("--comment-delay", type=float, default=0.02, help="секунд от слота до slot_result")
+    parser.add_argument("--miss", type=float, default=0.1, help="доля слотов без комментария")
+    parser.add_argument("--shared", type=float, default=0.1, help="доля кандидатов на уже занятые сообщения")
+    parser.add_argument("--foreign", type=float, default=0.05, help="доля сообщений с чужим комментарием")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if result["min_gap_s"] is not None and result["min_gap_s"] < args.cooldown - SLACK:
+        print(f"❌ Комментарии ближе кулдауна: {result['min_gap_s']}с < {args.cooldown}с")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Время холодного запуска хаба: с ботом Telegram и с --headless.
+
+Запускает websocket_server.py --runs раз в каждом режиме и меряет время от
+старта процесса до момента, когда WebSocket-порт принимает соединения, и
+пиковую память. Полный режим ходит в фейк Bot API, headless - без Telegram,
+уведомления в stdout. Дополнительно меряется импорт websocket_server без
+.env и токена - так его импортируют тесты и bench/replay.py.
+
+    python -m bench.startup --runs 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.fake_telegram import FakeBotAPI
+from bench.load import ROOT, free_port, rss_kb, wait_for_port
+
+IMPORT_PROBE = (
+    "import sys, time; started = time.perf_counter(); import websocket_server; "
+    "print((time.perf_counter() - started) * 1000, 'telebot' in sys.modules)"
+)
+
+
+async def start_once(extra_args, env, workdir):
+    """(секунд до открытия порта, RSS в КБ после запуска)"""
+    port = free_port()
+    env = dict(env, WEBSOCKET_PORT=str(port))
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "websocket_server.py"), *extra_args],
+                               cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await wait_for_port(port)
+        elapsed = time.perf_counter() - started
+        return elapsed, rss_kb(process.pid)
+    finally:
+        process.terminate()
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def run(args):
+    api = FakeBotAPI(chat_id=1)
+    api_port = await api.start()
+    workdir = tempfile.mkdtemp(prefix="hub-startup-")
+    base = {key: value for key, value in os.environ.items() if key not in ("BOT_TOKEN", "CHAT_ID", "NOTIFIER", "HEADLESS")}
+    base.update(WEBSOCKET_HOST="127.0.0.1", METRICS_PORT="0",
+                EVENT_STORE_PATH=os.path.join(workdir, "events.db"),
+                STATE_SNAPSHOT_PATH=os.path.join(workdir, "state.json"))
+    modes = {
+        "telegram": ([], dict(base, BOT_TOKEN="123456:startup", CHAT_ID="1",
+                              TELEGRAM_API_BASE=f"http://127.0.0.1:{api_port}")),
+        "headless": (["--headless"], base),
+    }
+    results = {}
+    try:
+        for name, (extra_args, env) in modes.items():
+            runs = [await start_once(extra_args, env, workdir) for _ in range(args.runs)]
+            results[name] = statistics.median(t for t, _ in runs) * 1000
+            rss = [kb for _, kb in runs if kb]
+            print(f"{name:>9}: до открытия порта {results[name]:7.0f}мс (медиана из {args.runs}), "
+                  f"память {max(rss) // 1024 if rss else '?'}МБ")
+    finally:
+        await api.stop()
+
+    probe = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=ROOT, env=dict(base, LOG_LEVEL="WARNING"),
+                           capture_output=True, text=True)
+    if probe.returncode:
+        print(f"❌ websocket_server не импортируется без настроек:\n{probe.stderr}")
+        return False
+    import_ms, telebot_loaded = probe.stdout.split()[-2:]
+    print(f"   импорт: {float(import_ms):7.0f}мс без .env и токена, telebot загружен: {telebot_loaded}")
+    print(f"Ускорение запуска headless: {results['telegram'] / results['headless']:.2f}x")
+    return telebot_loaded == "False" and results["headless"] < results["telegram"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Задержка ответа на команды и кнопки: webhook против polling.
+
+Запускает websocket_server.py с фейком Bot API дважды: с BOT_UPDATES=polling
+(апдейты забираются getUpdates) и с BOT_UPDATES=webhook (апдейты приходят
+POST-запросом на локальный приемник, как их шлет Telegram). В каждом режиме
+отправляет --presses нажатий кнопки "Статус" и команд /status и меряет время
+от появления апдейта до ответа бота (answerCallbackQuery / sendMessage).
+
+Для webhook дополнительно проверяется, что запрос с неверным секретом
+получает 401 и не обрабатывается. --updates FILE отправляет на webhook
+записанные апдейты (по JSON-объекту в строке) вместо синтетических.
+
+    python -m bench.webhook --presses 50
+    python -m bench.webhook --mode webhook --updates updates.jsonl
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.fake_telegram import FakeBotAPI
+from bench.load import ROOT, free_port, percentiles, wait_for_port
+
+SECRET = "bench-secret"
+
+
+async def post(port, path, update, secret=SECRET):
+    """POST апдейта на webhook; HTTP-статус ответа"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(update).encode()
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n"
+        f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    writer.close()
+    return status
+
+
+async def answered(api, method, since, timeout=10):
+    """Время первого вызова method после since"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for called, name, _ in api.calls:
+            if name == method and called >= since:
+                return called
+        await asyncio.sleep(0.002)
+    return None
+
+
+async def run_mode(mode, args):
+    api = FakeBotAPI(chat_id=1)
+    api_port = await api.start()
+    workdir = tempfile.mkdtemp(prefix=f"hub-{mode}-")
+    ws_port, hook_port = free_port(), free_port()
+    env = dict(
+        os.environ,
+        BOT_TOKEN="123456:webhook",
+        CHAT_ID="1",
+        TELEGRAM_API_BASE=f"http://127.0.0.1:{api_port}",
+        WEBSOCKET_HOST="127.0.0.1",
+        WEBSOCKET_PORT=str(ws_port),
+        METRICS_PORT="0",
+        EVENT_STORE_PATH=os.path.join(workdir, "events.db"),
+        STATE_SNAPSHOT_PATH=os.path.join(workdir, "state.json"),
+        BOT_UPDATES=mode,
+        WEBHOOK_PORT=str(hook_port),
+        WEBHOOK_PATH="/telegram",
+        WEBHOOK_SECRET=SECRET,
+    )
+    log = open(os.path.join(workdir, "server.log"), "w")
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "websocket_server.py")],
+                               cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    failures = []
+    result = {"mode": mode}
+    try:
+        await wait_for_port(ws_port)
+        if mode == "webhook":
+            await wait_for_port(hook_port)
+            calls = len(api.calls)
+            status = await post(hook_port, "/telegram", api.command_update("/status"), secret="wrong")
+            await asyncio.sleep(0.5)
+            if status != 401 or len(api.calls) != calls:
+                failures.append(f"неверный секрет: статус {status}, вызовов после него {len(api.calls) - calls}")
+
+        async def deliver(update):
+            if mode == "webhook":
+                status = await post(hook_port, "/telegram", update)
+                if status != 200:
+                    failures.append(f"webhook ответил {status}")
+            else:
+                api.updates.put_nowait(update)
+
+        if args.updates:
+            with open(args.updates) as f:
+                updates = [json.loads(line) for line in f if line.strip()]
+            started = time.time()
+            for update in updates:
+                await deliver(update)
+            await asyncio.sleep(1)
+            result["recorded_updates"] = len(updates)
+            result["calls_after"] = len([c for c in api.calls if c[0] >= started])
+            return result, failures
+
+        for name, method, make in (
+            ("button", "answerCallbackQuery", lambda: api.callback_update("status")),
+            ("command", "sendMessage", lambda: api.command_update("/status")),
+        ):
+            latencies = []
+            for _ in range(args.presses):
+                since = time.time()
+                await deliver(make())
+                done = await answered(api, method, since)
+                if done is None:
+                    failures.append(f"{mode}: нет {method}")
+                    break
+                latencies.append(done - since)
+                await asyncio.sleep(args.pause)
+            result[name] = percentiles(latencies)
+    finally:
+        process.terminate()
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+        await api.stop()
+    return result, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("both", "polling", "webhook"), default="both")
+    parser.add_argument("--presses", type=int, default=30)
+    parser.add_argument("--pause", type=float, default=0.2, help="секунд между нажатиями")
+    parser.add_argument("--updates", help="файл с записанными апдейтами для webhook")
+    args = parser.parse_args()
+
+    modes = ("polling", "webhook") if args.mode == "both" else (args.mode,)
+    failures = []
+    for mode in modes:
+        result, errors = asyncio.run(run_mode(mode, args))
+        failures += errors
+        print(json.dumps(result, ensure_ascii=False))
+    for error in failures:
+        print(f"❌ {error}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
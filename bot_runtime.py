@@ -0,0 +1,136 @@
+import asyncio
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== АСИНХРОННЫЙ ФАСАД НАД TELEBOT ====================
+class ExecutorBot:
+    """Асинхронные методы поверх синхронного telebot.TeleBot.
+
+    await api.send_message(...) выполняет bot.send_message в пуле потоков,
+    так что обработчики пишутся одинаково для AsyncTeleBot и TeleBot.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def __getattr__(self, name):
+        method = getattr(self.bot, name)
+
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(method, *args, **kwargs))
+
+        # Кэшируем обертку, чтобы не создавать ее на каждый вызов
+        setattr(self, name, call)
+        return call
+
+
+class LazyApi:
+    """Клиент Bot API, который создается при первом обращении.
+
+    factory() импортирует telebot и создает бота - это заметная часть
+    времени запуска, и без Telegram (--headless, экземпляр edge, импорт
+    в тестах) это не нужно вовсе.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.client = None
+
+    def __getattr__(self, name):
+        if self.client is None:
+            self.client = self.factory()
+        return getattr(self.client, name)
+
+
+# ==================== ТАБЛИЦА ОБРАБОТЧИКОВ TELEGRAM ====================
+class HandlerTable:
+    """Обработчики команд и кнопок, написанные один раз как корутины.
+
+    В асинхронном режиме они регистрируются в AsyncTeleBot напрямую.
+    В режиме с потоком polling'а каждый апдейт передается в цикл событий
+    сервера, поэтому состояние всегда меняется из одного потока. В режиме
+    webhook апдейты приходят прямо в цикл, и dispatch() выбирает обработчик
+    сам, без telebot.
+    """
+
+    def __init__(self):
+        self.message = []
+        self.callback = []
+
+    def message_handler(self, **filters):
+        def decorator(func):
+            self.message.append((func, filters))
+            return func
+        return decorator
+
+    def callback_query_handler(self, **filters):
+        def decorator(func):
+            self.callback.append((func, filters))
+            return func
+        return decorator
+
+    def install_async(self, async_bot):
+        for func, filters in self.message:
+            async_bot.register_message_handler(func, **filters)
+        for func, filters in self.callback:
+            async_bot.register_callback_query_handler(func, **filters)
+
+    def install_threaded(self, bot, loop):
+        for func, filters in self.message:
+            bot.register_message_handler(self._on_loop(func, loop), **filters)
+        for func, filters in self.callback:
+            bot.register_callback_query_handler(self._on_loop(func, loop), **filters)
+
+    async def dispatch(self, update):
+        """Апдейт из webhook (telebot.types.Update) - первому подходящему обработчику, как в telebot"""
+        if update.message is not None:
+            table, item = self.message, update.message
+        elif update.callback_query is not None:
+            table, item = self.callback, update.callback_query
+        else:
+            return False
+        for func, filters in table:
+            if _matches(item, filters):
+                await func(item)
+                return True
+        return False
+
+    @staticmethod
+    def _on_loop(func, loop):
+        def handler(update):
+            future = asyncio.run_coroutine_threadsafe(func(update), loop)
+            future.add_done_callback(functools.partial(_log_failure, func.__name__))
+        return handler
+
+
+def _command(text):
+    """'/status@bot 1' -> 'status'"""
+    if not text or not text.startswith('/'):
+        return None
+    return text.split()[0].split('@')[0][1:]
+
+
+def _matches(item, filters):
+    """Фильтры commands, content_types и func в том же смысле, что у telebot"""
+    for name, value in filters.items():
+        if name == 'commands':
+            if getattr(item, 'content_type', None) != 'text' or _command(item.text) not in value:
+                return False
+        elif name == 'content_types':
+            if getattr(item, 'content_type', None) not in value:
+                return False
+        elif name == 'func':
+            if not value(item):
+                return False
+        else:
+            raise ValueError(f"Фильтр {name} не поддерживается в режиме webhook")
+    return True
+
+
+def _log_failure(name, future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"❌ Ошибка в обработчике {name}: {future.exception()!r}")
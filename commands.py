@@ -0,0 +1,131 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from protocol import dumps
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+ACK_TIMEOUT = 1.5         # секунд ждем подтверждения первой попытки
+ACK_TIMEOUT_MAX = 6       # секунд - потолок ожидания одной попытки
+MAX_ATTEMPTS = 4          # попыток отправки, после - команда не подтверждена
+RTT_ALPHA = 0.2           # вес нового замера в сглаженном времени ответа
+
+# Итоги выполнения команды
+ACKED = "ack"             # клиент применил команду
+NACKED = "nack"           # клиент отказался ее применять
+TIMEOUT = "timeout"       # подтверждения не было ни на одну попытку
+SENT = "sent"             # клиент без подтверждений: команда только записана в сокет
+FAILED = "failed"         # не удалось записать в сокет
+SUPERSEDED = "superseded"  # пока ждали, ушла новая команда того же вида
+RESULTS = (ACKED, NACKED, TIMEOUT, SENT, FAILED, SUPERSEDED)
+
+# Команды, заменяющие друг друга: pause после resume отменяет повторы resume
+COMMAND_KINDS = {"pause": "pause", "resume": "pause"}
+
+
+def command_kind(command):
+    return COMMAND_KINDS.get(command['type'], command['type'])
+
+
+# ==================== КОМАНДЫ С ПОДТВЕРЖДЕНИЕМ ====================
+class PendingCommand:
+    def __init__(self, command_id, session):
+        self.id = command_id
+        self.session = session
+        self.attempts = 0
+        self.sent_at = None
+        self.future = asyncio.get_running_loop().create_future()
+
+    def resolve(self, result, answer=None):
+        if not self.future.done():
+            self.future.set_result((result, answer))
+
+
+class CommandTracker:
+    """Команды клиентам с номером запроса, подтверждением и повторами.
+
+    Клиент, объявивший в hello поддержку acks, отвечает на команду ack или
+    nack с ее id. Без ответа команда уходит снова с удвоенным ожиданием,
+    а клиент по id не применяет повтор второй раз. Новая команда того же
+    вида отменяет повторы старой, чтобы запоздавший повтор не откатил
+    состояние. Старые клиенты получают команду один раз, как раньше.
+
+    send(session, payload, timeout) -> bool записывает кадр в сокет клиента.
+    """
+
+    def __init__(self, send, ack_timeout=ACK_TIMEOUT, max_attempts=MAX_ATTEMPTS, on_rtt=None):
+        self.send = send
+        self.ack_timeout = ack_timeout
+        self.max_attempts = max_attempts
+        # on_rtt(секунды) - для метрик
+        self.on_rtt = on_rtt
+        # Префикс времени запуска: id не повторяются после перезапуска сервера
+        self.prefix = f"{int(time.time()):x}"
+        self.counter = itertools.count(1)
+        self.pending = {}   # id -> PendingCommand
+        self.by_kind = {}   # (client_id, вид команды) -> PendingCommand
+        self.stats = dict.fromkeys(RESULTS, 0)
+        self.stats["retried"] = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    async def execute(self, session, command, send_timeout):
+        """Отправляет команду и ждет итога; (итог, ответ клиента или None)"""
+        if session.acks:
+            result, answer = await self._execute(session, command, send_timeout)
+        else:
+            result, answer = (SENT if await self.send(session, dumps(command), send_timeout) else FAILED), None
+        self.stats[result] += 1
+        return result, answer
+
+    async def _execute(self, session, command, send_timeout):
+        entry = PendingCommand(f"{self.prefix}-{next(self.counter)}", session)
+        key = (session.client_id, command_kind(command))
+        previous = self.by_kind.get(key)
+        if previous is not None:
+            previous.resolve(SUPERSEDED)
+        self.by_kind[key] = entry
+        self.pending[entry.id] = entry
+        payload = dumps(dict(command, id=entry.id))
+        timeout = self.ack_timeout
+        try:
+            while entry.attempts < self.max_attempts:
+                if entry.attempts:
+                    self.stats["retried"] += 1
+                    logger.info("🔁 Повтор команды %s клиенту %s (попытка %d)",
+                                command['type'], session.short_id, entry.attempts + 1,
+                                extra={"client": session.client_id, "command": command['type']})
+                entry.attempts += 1
+                entry.sent_at = time.monotonic()
+                # Отключенный клиент может вернуться за время ожидания - тогда повтор дойдет
+                if session.online and not await self.send(session, payload, send_timeout):
+                    return FAILED, None
+                try:
+                    return await asyncio.wait_for(asyncio.shield(entry.future), timeout)
+                except asyncio.TimeoutError:
+                    timeout = min(timeout * 2, ACK_TIMEOUT_MAX)
+            return TIMEOUT, None
+        finally:
+            del self.pending[entry.id]
+            if self.by_kind.get(key) is entry:
+                del self.by_kind[key]
+
+    def answered(self, session, result, answer):
+        """ack или nack от клиента; запоздавшие ответы на завершенные команды игнорируются"""
+        entry = self.pending.get(answer['id'])
+        if entry is None or entry.session.client_id != session.client_id:
+            return
+        if entry.attempts == 1:
+            # Время ответа меряется только без повторов: иначе неясно, на какую попытку ответ
+            rtt = time.monotonic() - entry.sent_at
+            session.command_rtt = rtt if session.command_rtt is None else (
+                RTT_ALPHA * rtt + (1 - RTT_ALPHA) * session.command_rtt
+            )
+            if self.on_rtt:
+                self.on_rtt(rtt)
+        entry.resolve(result, answer)
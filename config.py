@@ -0,0 +1,117 @@
+"""Настройки хаба.
+
+Config.from_env() только читает окружение и ничего не проверяет, поэтому
+websocket_server можно импортировать в тестах и бенчмарках без .env и без
+токена. Config.load(argv) - для запуска скриптом: читает .env, аргументы
+командной строки и проверяет, что для выбранного режима хватает настроек.
+"""
+import argparse
+import os
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
+
+
+def _int_list(value):
+    return [int(item) for item in (value or '').split(',') if item.strip()]
+
+
+def _optional_int(value):
+    return int(value) if value not in (None, '') else None
+
+
+class Config:
+    def __init__(self, env):
+        get = env.get
+        # ---------- Telegram ----------
+        self.bot_token = get('BOT_TOKEN')
+        self.chat_id = _optional_int(get('CHAT_ID'))  # chat_id владельца (можно узнать у @userinfobot)
+        # Другие чаты, которым можно подписаться на события через /start (через запятую)
+        self.subscriber_chats = _int_list(get('SUBSCRIBER_CHATS'))
+        self.telegram_api_base = get('TELEGRAM_API_BASE')  # Например, http://127.0.0.1:8081 для локального фейка Bot API
+        self.bot_runtime = get('BOT_RUNTIME', 'thread')  # thread - polling в отдельном потоке, async - в цикле событий (нужен aiohttp)
+        self.bot_updates = get('BOT_UPDATES', 'polling')  # polling - getUpdates, webhook - Telegram сам шлет апдейты на WEBHOOK_URL
+        self.webhook_url = get('WEBHOOK_URL')  # Публичный HTTPS-адрес, проксируемый на WEBHOOK_HOST:WEBHOOK_PORT; без него webhook не регистрируется
+        self.webhook_host = get('WEBHOOK_HOST', '127.0.0.1')
+        self.webhook_port = int(get('WEBHOOK_PORT', 8767))
+        self.webhook_path = get('WEBHOOK_PATH', '/telegram')
+        self.webhook_secret = get('WEBHOOK_SECRET')  # Секрет из заголовка X-Telegram-Bot-Api-Secret-Token: A-Z, a-z, 0-9, _ и -
+        self.webhook_concurrency = int(get('WEBHOOK_CONCURRENCY', 8))  # Обработчиков апдейтов одновременно
+        # Куда уходят уведомления: telegram, stdout, jsonl:путь или http://хост:порт/путь (см. notifiers.py)
+        self.notifier = get('NOTIFIER', 'telegram')
+        self.headless = get('HEADLESS', '') not in ('', '0')  # без бота Telegram: только WebSocket и уведомления в NOTIFIER
+        # ---------- Хранилища ----------
+        self.event_store_path = get('EVENT_STORE_PATH', 'events.db')  # Журнал всех событий от расширения
+        self.state_snapshot_path = get('STATE_SNAPSHOT_PATH', 'state.json')  # Снимок состояния для восстановления после перезапуска
+        self.record_path = get('RECORD_PATH')  # Запись кадров WebSocket для bench/replay.py, например capture.jsonl.gz
+        # ---------- WebSocket ----------
+        self.websocket_port = int(get('WEBSOCKET_PORT', 8765))
+        self.websocket_host = get('WEBSOCKET_HOST', "localhost")
+        self.ws_ping_interval = float(get('WS_PING_INTERVAL', 10))  # ping протокола WebSocket, секунд
+        self.ws_ping_timeout = float(get('WS_PING_TIMEOUT', 10))    # без pong за это время соединение рвется
+        self.heartbeat_interval = float(get('HEARTBEAT_INTERVAL', 15))  # прикладной ping клиентам
+        self.heartbeat_timeout = self.heartbeat_interval * 3  # молчит дольше - вытесняем
+        self.flap_grace = float(get('FLAP_GRACE', 10))  # секунд, за которые переподключения схлопываются в одно уведомление
+        self.metrics_port = int(get('METRICS_PORT', 8766))  # HTTP /metrics (Prometheus), 0 - выключить
+        # Общий кулдаун комментариев для всех вкладок: слоты выдает сервер (scheduler.py), а не каждая вкладка
+        self.comment_scheduler = get('COMMENT_SCHEDULER', '') not in ('', '0')
+        self.comment_cooldown = float(get('COMMENT_COOLDOWN', 300))  # секунд между комментариями всех клиентов
+        # ---------- Несколько экземпляров ----------
+        # control владеет Telegram и реестром, edge только держат соединения расширений
+        self.hub_role = get('HUB_ROLE', 'standalone')  # standalone | control | edge
+        self.backplane_url = get('BACKPLANE_URL')  # unix:///tmp/mf-hub.sock или tcp://127.0.0.1:8790
+        self.backplane_control = get('BACKPLANE_CONTROL', 'control')  # имя экземпляра control на шине
+        self.hub_instance = get('HUB_INSTANCE', f"edge-{self.websocket_port}" if self.hub_role == 'edge' else self.backplane_control)
+        # ---------- Логи ----------
+        self.log_level = get('LOG_LEVEL', 'INFO')
+        self.log_format = get('LOG_FORMAT', 'text')  # text | json (JSON-строки с полями client, type, latency_ms)
+        self.log_file = get('LOG_FILE')  # ротируемый файл в дополнение к stdout
+        self.log_file_max_bytes = int(get('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024))
+        self.log_file_backups = int(get('LOG_FILE_BACKUPS', 5))
+        self.log_levels = get('LOG_LEVELS')  # например: telegram_sender=WARNING,server=DEBUG
+
+    @classmethod
+    def from_env(cls, env=None):
+        return cls(os.environ if env is None else env)
+
+    @classmethod
+    def load(cls, argv=None):
+        """Настройки для запуска скриптом: .env, окружение и аргументы; SystemExit, если чего-то не хватает"""
+        parser = argparse.ArgumentParser(description="WebSocket-хаб расширения и бот Telegram")
+        parser.add_argument('--headless', action='store_true',
+                            help="без бота Telegram: только WebSocket-сервер и уведомления в --notifier (по умолчанию stdout)")
+        parser.add_argument('--notifier', help="telegram, stdout, jsonl:путь или http://хост:порт/путь")
+        args = parser.parse_args(argv)
+        if load_dotenv:
+            load_dotenv()
+        config = cls.from_env()
+        if args.headless:
+            config.headless = True
+        if args.notifier:
+            config.notifier = args.notifier
+        elif config.headless and config.notifier == 'telegram':
+            config.notifier = 'stdout'
+        for problem in config.problems():
+            parser.error(problem)
+        return config
+
+    @property
+    def uses_telegram(self):
+        """Нужен ли этому экземпляру клиент Bot API"""
+        return self.hub_role != 'edge' and (not self.headless or self.notifier == 'telegram')
+
+    def problems(self):
+        """Чего не хватает для выбранного режима"""
+        problems = []
+        if self.hub_role in ('control', 'edge') and not self.backplane_url:
+            problems.append(f"для HUB_ROLE={self.hub_role} нужен BACKPLANE_URL")
+        if self.uses_telegram:
+            if not self.bot_token:
+                problems.append("не задан BOT_TOKEN (или запускайте с --headless)")
+            if self.chat_id is None:
+                problems.append("не задан CHAT_ID (или запускайте с --headless)")
+        if not self.headless and self.bot_updates == 'webhook' and not self.webhook_secret:
+            problems.append("для BOT_UPDATES=webhook нужен WEBHOOK_SECRET")
+        return problems
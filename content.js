@@ -14,6 +14,14 @@ const RENDER_DELAYS = {
   SUBMIT: 1000
 };
 
+const CLIENT_ID_KEY = 'messageFinderClientId';
+const MAX_UNACKED_STATS = 20;  // столько дельт без подтверждения - и шлем полный снимок
+const STATS_THROTTLE = 1000;  // мс: изменения очереди и ожидания уходят на сервер не чаще
+// Текущие значения, а не накопительные счетчики: в дельте передаются как есть (values)
+const STATS_GAUGES = ['queueLength', 'waitingForCooldown', 'lastMessageId'];
+const SERVER_SILENCE_TIMEOUT = 45000;  // мс без сообщений от сервера, после которых соединение считается мертвым
+const RECENT_COMMANDS = 100;  // столько id команд помним, чтобы не применить повтор дважды
+
 const SKIP_MIN = 4;
 const SKIP_MAX = 6;
 
@@ -184,6 +192,24 @@ class WebSocketClient {
     this.reconnectAttempts = 0;
     this.maxReconnectAttempts = 10;
     this.reconnectDelay = 3000;
+    this.clientGroup = null;
+    // Копия вкладки получает и sessionStorage с clientId; instanceId отличает ее от переподключения этой же страницы
+    this.instanceId = crypto.randomUUID();
+    // Протокол статистики: полный снимок, затем дельты с номерами seq
+    this.statsSeq = 0;       // номер последнего отправленного обновления
+    this.statsAcked = 0;     // последний номер, подтвержденный сервером
+    this.statsSent = null;   // снимок, относительно которого считаются дельты
+    // Сторожевой таймер включается после первого ping от сервера (старые серверы его не шлют)
+    this.lastServerMessage = 0;
+    this.serverPings = false;
+    this.watchdog = null;
+    this.statsTimer = null;
+    // Ответы на последние команды по id: повтор команды получает тот же ответ
+    this.commandReplies = new Map();
+    // Группа клиента для адресных команд задается в storage (clientGroup)
+    browser.storage.local.get('clientGroup').then(result => {
+      this.clientGroup = result.clientGroup || null;
+    });
     this.connect();
   }
 
@@ -196,6 +222,11 @@ class WebSocketClient {
         console.log('✅ WebSocket подключен к серверу');
         console.log('📊 Отправляем начальную статистику...');
         this.reconnectAttempts = 0;
+        this.statsSent = null;
+        this.lastServerMessage = Date.now();
+        this.serverPings = false;
+        this.startWatchdog();
+        this.sendHello();
         
         // Отправляем статистику сразу после подключения
         setTimeout(() => {
@@ -207,11 +238,19 @@ class WebSocketClient {
       this.ws.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
+          this.lastServerMessage = Date.now();
+          if (data.type === 'ping') {
+            this.serverPings = true;
+            this.send({ type: 'pong', ts: data.ts });
+            return;
+          }
           console.log('📩 Получена команда от сервера:', data);
           
           if (data.type === 'connected') {
             console.log('🖐️ Сервер подтвердил подключение:', data.message);
-            this.sendStats();
+            this.sendStats(true);
+          } else if (data.id !== undefined) {
+            this.executeCommand(data);
           } else {
             this.handleCommand(data);
           }
@@ -222,6 +261,8 @@ class WebSocketClient {
       
       this.ws.onclose = (event) => {
         console.log(`🔌 WebSocket отключен. Код: ${event.code}, Причина: ${event.reason || 'нет'}`);
+        this.stopWatchdog();
+        this.messageFinder.leaveCentralCooldown();
         this.reconnect();
       };
       
@@ -245,6 +286,63 @@ class WebSocketClient {
     }
   }
 
+  startWatchdog() {
+    this.stopWatchdog();
+    this.watchdog = setInterval(() => {
+      const silent = Date.now() - this.lastServerMessage;
+      if (this.serverPings && silent > SERVER_SILENCE_TIMEOUT && this.ws) {
+        // Полуоткрытое соединение: сервер не слышно, закрываем и переподключаемся
+        console.log(`💀 Сервер молчит ${Math.round(silent / 1000)}с, переподключаемся`);
+        this.stopWatchdog();
+        this.ws.close();
+      }
+    }, 5000);
+  }
+
+  stopWatchdog() {
+    if (this.watchdog) {
+      clearInterval(this.watchdog);
+      this.watchdog = null;
+    }
+  }
+
+  send(message) {
+    if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return;
+    try {
+      this.ws.send(JSON.stringify(message));
+    } catch (e) {
+      console.error('❌ Ошибка отправки в WebSocket:', e);
+    }
+  }
+
+  getClientId() {
+    // sessionStorage живет в пределах вкладки и переживает перезагрузку страницы
+    let clientId = sessionStorage.getItem(CLIENT_ID_KEY);
+    if (!clientId) {
+      clientId = crypto.randomUUID();
+      sessionStorage.setItem(CLIENT_ID_KEY, clientId);
+    }
+    return clientId;
+  }
+
+  sendHello() {
+    if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return;
+    
+    try {
+      this.ws.send(JSON.stringify({
+        type: 'hello',
+        clientId: this.getClientId(),
+        instance: this.instanceId,
+        group: this.clientGroup,
+        acks: true,
+        scheduler: true
+      }));
+      console.log('🤝 Отправлено рукопожатие серверу');
+    } catch (e) {
+      console.error('❌ Ошибка отправки рукопожатия:', e);
+    }
+  }
+
   sendStatusUpdate() {
     if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return;
     
@@ -260,9 +358,39 @@ class WebSocketClient {
     }
     }
 
+  executeCommand(data) {
+    // Повтор уже выполненной команды не применяем второй раз, только повторяем ответ
+    let reply = this.commandReplies.get(data.id);
+    if (!reply) {
+      try {
+        reply = this.handleCommand(data)
+          ? { type: 'ack', id: data.id, state: this.commandState() }
+          : { type: 'nack', id: data.id, error: `команда ${data.type} не применена` };
+      } catch (e) {
+        reply = { type: 'nack', id: data.id, error: String(e) };
+      }
+      this.commandReplies.set(data.id, reply);
+      if (this.commandReplies.size > RECENT_COMMANDS) {
+        this.commandReplies.delete(this.commandReplies.keys().next().value);
+      }
+    }
+    this.send(reply);
+  }
+
+  commandState() {
+    const mf = this.messageFinder;
+    return {
+      paused: mf.paused,
+      logLevel: log.level,
+      commentProbability: Math.round(mf.commentProbability * 100),
+      autoPauseAfterComment: mf.autoPauseAfterComment
+    };
+  }
+
+  // Возвращает true, если команда применена
   handleCommand(data) {
     const mf = this.messageFinder;
-    if (!mf) return;
+    if (!mf) return false;
     
     switch (data.type) {
       case 'pause':
@@ -276,9 +404,7 @@ class WebSocketClient {
       case 'setLogLevel':
         if (data.level !== undefined) {
           console.log(`📊 Устанавливаем уровень логов: ${data.level}`);
-          if (mf.log && mf.log.setLevel) {
-            mf.log.setLevel(data.level);
-          }
+          log.setLevel(data.level);
         }
         break;
       case 'setProbability':
@@ -293,13 +419,54 @@ class WebSocketClient {
           mf.autoPauseAfterComment = data.value;
         }
         break;
+      case 'applySettings':
+        // Настройки, заданные из Telegram, одним сообщением после подключения
+        console.log('⚙️ Получены настройки от сервера:', data.settings);
+        if (data.settings.logLevel !== undefined) {
+          this.handleCommand({ type: 'setLogLevel', level: data.settings.logLevel });
+        }
+        if (data.settings.commentProbability !== undefined) {
+          this.handleCommand({ type: 'setProbability', value: data.settings.commentProbability });
+        }
+        if (data.settings.autoPauseAfterComment !== undefined) {
+          this.handleCommand({ type: 'setAutoPause', value: data.settings.autoPauseAfterComment });
+        }
+        break;
       case 'requestStats':
         console.log('📊 Запрос статистики от сервера');
-        this.sendStats();
+        this.sendStats(true);
+        break;
+      case 'stats_ack':
+        this.statsAcked = Math.max(this.statsAcked, data.seq);
+        break;
+      case 'resync':
+        console.log(`🔁 Сервер запросил полный снимок статистики (seq ${data.seq})`);
+        this.sendStats(true);
+        break;
+      case 'renewClientId':
+        // clientId уже занят другой открытой вкладкой (дубликат вкладки скопировал sessionStorage)
+        console.log('🪪 clientId занят другой вкладкой, создаем новый');
+        sessionStorage.setItem(CLIENT_ID_KEY, crypto.randomUUID());
+        this.sendHello();
+        this.sendStats(true);
+        break;
+      case 'scheduler':
+        // Кулдаун общий для всех вкладок: слот на комментарий выдает сервер
+        if (data.enabled) {
+          console.log(`🎟️ Общий кулдаун на сервере: ${Math.round(data.cooldown / 1000)}с`);
+          mf.centralCooldown = { cooldown: data.cooldown, maxWait: data.maxWait };
+        } else {
+          mf.leaveCentralCooldown();
+        }
+        break;
+      case 'slot':
+        mf.onSlotDecision(data);
         break;
       default:
         console.log('Неизвестная команда:', data.type);
+        return false;
     }
+    return true;
   }
 
   sendComment(commentData) {
@@ -320,7 +487,7 @@ class WebSocketClient {
     }
   }
 
-  sendStats() {
+  sendStats(full = false) {
     if (!this.ws || this.ws.readyState !== WebSocket.OPEN) {
       console.log('❌ WebSocket не подключен, статистика не отправлена');
       return;
@@ -329,18 +496,55 @@ class WebSocketClient {
     try {
       if (this.messageFinder) {
         const status = this.messageFinder.getStatus();
-        const message = JSON.stringify({
-          type: 'stats',
-          data: status.stats
-        });
-        this.ws.send(message);
-        console.log('📊 Отправлена статистика в WebSocket:', status.stats);
+        // Очередь и ожидание нужны серверу для «времени в ожидании» и тренда очереди
+        const stats = {
+          ...status.stats,
+          queueLength: status.queueLength,
+          waitingForCooldown: status.waitingForCooldown,
+          lastMessageId: status.lastMessageId,
+          messageCounter: status.messageCounter
+        };
+        // Полный снимок, если базы нет или сервер давно не подтверждал дельты
+        if (full || !this.statsSent || this.statsSeq - this.statsAcked > MAX_UNACKED_STATS) {
+          this.ws.send(JSON.stringify({
+            type: 'stats',
+            seq: ++this.statsSeq,
+            data: stats
+          }));
+          console.log('📊 Отправлен снимок статистики в WebSocket:', stats);
+        } else {
+          const delta = {};
+          const values = {};
+          for (const [name, value] of Object.entries(stats)) {
+            if (STATS_GAUGES.includes(name)) {
+              if (value !== this.statsSent[name]) values[name] = value;
+              continue;
+            }
+            const change = value - (this.statsSent[name] || 0);
+            if (change) delta[name] = change;
+          }
+          if (!Object.keys(delta).length && !Object.keys(values).length) return;
+          const message = { type: 'stats_delta', seq: ++this.statsSeq, delta: delta };
+          if (Object.keys(values).length) message.values = values;
+          this.ws.send(JSON.stringify(message));
+          console.log('📊 Отправлена дельта статистики в WebSocket:', delta, values);
+        }
+        this.statsSent = stats;
       }
     } catch (e) {
       console.error('❌ Ошибка отправки статистики:', e);
     }
   }
 
+  // Очередь, ожидание и счетчики меняются часто: одна отправка на STATS_THROTTLE
+  scheduleStats() {
+    if (this.statsTimer) return;
+    this.statsTimer = setTimeout(() => {
+      this.statsTimer = null;
+      this.sendStats();
+    }, STATS_THROTTLE);
+  }
+
   sendLog(level, message) {
     if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return;
     
@@ -390,6 +594,11 @@ class MessageFinder {
     this.messageQueue = [];
     this.indicatorObserver = null;
 
+    // Общий кулдаун на сервере: {cooldown, maxWait} в мс или null - считаем сами
+    this.centralCooldown = null;
+    this.pendingCandidate = null;
+    this.candidateCounter = 0;
+
     // Статистика
     this.stats = { commented: 0, skipped: 0, ignored: 0 };
 
@@ -560,6 +769,8 @@ class MessageFinder {
 
       await this.handleNewMessage(el);
     }
+    // Счетчики, очередь и ожидание - на сервер одной отправкой
+    this.wsClient.scheduleStats();
   }
 
   async handleNewMessage(element) {
@@ -573,6 +784,7 @@ class MessageFinder {
         this.cancelWaiting();
         log.info(`🔔 Чужой комментарий на ожидаемом сообщении #${id}, ожидание отменено`);
       }
+      this.reportForeign(id);
       this.stats.ignored++;
       return;
     }
@@ -588,6 +800,11 @@ class MessageFinder {
       return;
     }
 
+    if (this.centralCooldown && this.wsClient.ws?.readyState === WebSocket.OPEN) {
+      this.requestSlot(element, id);
+      return;
+    }
+
     if (this.waitingForCooldown) {
       const detectedTime = this.detectedTimes.get(id);
       const timePassed = Date.now() - detectedTime;
@@ -681,6 +898,8 @@ class MessageFinder {
               if (node.matches?.('.flex.flex-wrap.gap-1 button') || node.querySelector?.('.flex.flex-wrap.gap-1 button')) {
                 log.debug(`👀 Замечен чужой комментарий на сообщении #${messageId}`);
                 this.cancelWaiting();
+                this.reportForeign(messageId);
+                this.processQueue();
                 return;
               }
             }
@@ -701,15 +920,85 @@ class MessageFinder {
       this.indicatorObserver = null;
     }
     this.pendingMessage = null;
+    this.pendingCandidate = null;
     this.waitingForCooldown = false;
+    this.wsClient.scheduleStats();
     log.info('⏹️ Ожидание отменено');
   }
 
+  // ---------- Общий кулдаун ----------
+  requestSlot(element, id) {
+    const candidateId = `${id}-${++this.candidateCounter}`;
+    this.pendingMessage = element;
+    this.pendingCandidate = candidateId;
+    this.watchForCommentIndicator(element, id);
+    // Страховка: если решение сервера потерялось, очередь не должна стоять вечно
+    const { cooldown, maxWait } = this.centralCooldown;
+    this.pendingTimeout = setTimeout(() => {
+      log.info(`⌛ Нет решения сервера по сообщению #${id}`);
+      this.cancelWaiting();
+      this.processQueue();
+    }, cooldown + maxWait + 30000);
+    log.info(`🎟️ Запрошен слот на комментарий сообщения #${id}`);
+    this.wsClient.send({ type: 'candidate', candidateId, messageId: id });
+  }
+
+  async onSlotDecision(data) {
+    if (!this.pendingCandidate || data.candidateId !== this.pendingCandidate) return;
+    const element = this.pendingMessage;
+    const id = DataExtractor.getMessageId(element);
+    if (this.pendingTimeout) {
+      clearTimeout(this.pendingTimeout);
+      this.pendingTimeout = null;
+    }
+    if (this.indicatorObserver) {
+      this.indicatorObserver.disconnect();
+      this.indicatorObserver = null;
+    }
+
+    if (data.granted) {
+      let success = false;
+      if (this.paused) {
+        log.info(`⏸️ Слот на сообщение #${id} получен на паузе, возвращаем`);
+      } else if (DataExtractor.hasCommentsIndicator(element)) {
+        log.info(`🔔 Слот получен, но на сообщении #${id} уже есть комментарий`);
+        this.stats.ignored++;
+      } else {
+        success = await this.commentOnMessage(element);
+      }
+      this.wsClient.send({ type: 'slot_result', candidateId: data.candidateId, commented: success });
+    } else {
+      this.stats.ignored++;
+      log.info(`🚫 Сервер не выдал слот на сообщение #${id}: ${data.reason}`);
+    }
+
+    this.pendingMessage = null;
+    this.pendingCandidate = null;
+    await this.processQueue();
+  }
+
+  reportForeign(messageId) {
+    // Кандидаты других вкладок на это сообщение больше не нужны
+    if (this.centralCooldown) {
+      this.wsClient.send({ type: 'foreign', messageId });
+    }
+  }
+
+  leaveCentralCooldown() {
+    // Сервер недоступен или без планировщика: дальше кулдаун снова считает вкладка
+    this.centralCooldown = null;
+    if (this.pendingCandidate) {
+      this.cancelWaiting();
+      this.processQueue();
+    }
+  }
+
   async processQueue() {
     while (this.messageQueue.length > 0 && !this.pendingMessage && !this.paused) {
       const next = this.messageQueue.shift();
       await this.handleNewMessage(next);
     }
+    this.wsClient.scheduleStats();
   }
 
   sendStatusToPopup() {
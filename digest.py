@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+TELEGRAM_MESSAGE_LIMIT = 4096
+DEFAULT_WINDOW = 5        # секунд накопления событий
+DEFAULT_MAX_EVENTS = 20   # после стольких событий сводка уходит сразу
+HTML_TOKEN = re.compile(r"<[^>]*>|&#?\w+;")
+
+
+# ==================== СВОДКИ (DIGEST) ====================
+def _closing(tags):
+    return "".join(f"</{tag}>" for tag in reversed(tags))
+
+
+def truncate_html(text, limit):
+    """Обрезает HTML Telegram до limit символов с «…»: теги и сущности не рвутся, открытые теги закрываются"""
+    if len(text) <= limit:
+        return text
+    out, tags, length, position = [], [], 0, 0
+    for match in HTML_TOKEN.finditer(text):
+        plain = text[position:match.start()]
+        room = limit - 1 - length - len(_closing(tags))
+        if len(plain) > room:
+            out.append(plain[:max(0, room)])
+            break
+        out.append(plain)
+        length += len(plain)
+        token = match.group()
+        name = re.match(r"</?(\w+)", token)
+        after = tags
+        if name and token.startswith("</"):
+            after = tags[:-1] if tags and tags[-1] == name.group(1) else tags
+        elif name and not token.endswith("/>"):
+            after = tags + [name.group(1)]
+        if length + len(token) + 1 + len(_closing(after)) > limit:
+            break
+        out.append(token)
+        length += len(token)
+        tags = after
+        position = match.end()
+    else:
+        out.append(text[position:position + max(0, limit - 1 - length - len(_closing(tags)))])
+    return "".join(out) + "…" + _closing(tags)
+
+
+def split_message(header, entries, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Склеивает записи в сообщения не длиннее limit, заголовок - в первом"""
+    chunks = []
+    current = header
+    for entry in entries:
+        if len(entry) > limit - 2:
+            # Обрезка по сырому тексту могла бы оставить незакрытый <code> - Telegram ответит 400
+            entry = truncate_html(entry, limit - 2)
+        candidate = f"{current}\n\n{entry}" if current else entry
+        if len(candidate) > limit:
+            chunks.append(current)
+            current = entry
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class Digest:
+    """Копит события за окно времени и отправляет их одной сводкой.
+
+    flush_callback(chunks) получает готовые к отправке куски текста.
+    Все методы вызываются из цикла событий.
+    """
+
+    def __init__(self, flush_callback, labels, window=DEFAULT_WINDOW, max_events=DEFAULT_MAX_EVENTS):
+        self.flush_callback = flush_callback
+        self.labels = labels  # kind -> подпись для строки итогов
+        self.enabled = False
+        self.window = window
+        self.max_events = max_events
+        self.entries = []
+        self.counts = {}
+        self.started = None
+        self.timer = None
+
+    def configure(self, enabled=None, window=None, max_events=None):
+        if window is not None:
+            self.window = window
+        if max_events is not None:
+            self.max_events = max_events
+        if enabled is not None:
+            self.enabled = enabled
+            if not enabled:
+                # Не теряем уже накопленное при выключении
+                self.flush()
+        logger.info(f"📦 Сводки: {'вкл' if self.enabled else 'выкл'}, окно {self.window}с, до {self.max_events} событий")
+
+    def add(self, kind, text):
+        """Добавляет событие; возвращает False, если режим сводок выключен"""
+        if not self.enabled:
+            return False
+        if not self.entries:
+            self.started = time.monotonic()
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+        self.entries.append(text)
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        if len(self.entries) >= self.max_events:
+            self.flush()
+        return True
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started if self.started else 0
+        parts = [f"{self.labels.get(kind, kind)} — {count}" for kind, count in self.counts.items()]
+        return f"📦 <b>Сводка за {elapsed:.0f}с</b> ({len(self.entries)} событий): " + ", ".join(parts)
+
+    def flush(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        if not self.entries:
+            return
+        chunks = split_message(self.summary(), self.entries)
+        self.entries = []
+        self.counts = {}
+        self.started = None
+        self.flush_callback(chunks)
@@ -0,0 +1,208 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+BATCH_SIZE = 500          # событий в одной транзакции
+BATCH_INTERVAL = 0.5      # секунд ждем добора пачки
+MAX_PENDING = 100000      # событий в очереди на запись
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    client TEXT,
+    msg_id INTEGER,
+    author TEXT,
+    email TEXT COLLATE NOCASE,
+    number INTEGER,
+    link TEXT,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts);
+CREATE INDEX IF NOT EXISTS idx_events_type_ts ON events(type, ts);
+CREATE INDEX IF NOT EXISTS idx_events_author ON events(author);
+CREATE INDEX IF NOT EXISTS idx_events_email ON events(email);
+CREATE INDEX IF NOT EXISTS idx_events_number ON events(number);
+"""
+
+COLUMNS = "id, ts, type, client, msg_id, author, email, number, link, payload"
+
+
+# ==================== ХРАНИЛИЩЕ СОБЫТИЙ ====================
+def _as_int(value):
+    """Целое для колонки INTEGER или None; поля приходят от расширения как есть"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value if -2 ** 63 <= value < 2 ** 63 else None
+    if isinstance(value, float) and value == value and abs(value) < 2 ** 63:
+        return int(value)
+    if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+        return _as_int(int(value))
+    return None
+
+
+def _as_text(value):
+    """Строка для колонки TEXT или None; словари и списки в колонки не попадают"""
+    if isinstance(value, str):
+        return value or None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return None
+
+
+def event_row(event, client=None, raw=None, now=None):
+    """Раскладывает входящее событие расширения по индексируемым колонкам"""
+    data = event.get('data') if isinstance(event.get('data'), dict) else {}
+    ts = _as_int(data.get('timestamp')) or _as_int(event.get('timestamp')) or int((now or time.time()) * 1000)
+    return (
+        ts,
+        str(event.get('type', '')),
+        None if client is None else str(client),
+        _as_int(data.get('id')) if isinstance(data.get('id'), int) else None,
+        _as_text(data.get('author')),
+        _as_text(data.get('email')),
+        _as_int(data.get('number')),
+        _as_text(data.get('link')),
+        raw if raw is not None else json.dumps(event, ensure_ascii=False),
+    )
+
+
+class EventStore:
+    """Append-only журнал событий в SQLite (WAL).
+
+    append() только кладет событие в очередь; отдельный поток пишет пачками,
+    одной транзакцией на пачку. Чтение идет через собственное соединение
+    каждого потока и не мешает записи.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = queue.Queue(MAX_PENDING)
+        self.local = threading.local()
+        self.writer = None
+        self.dropped = 0
+        self.written = 0
+        self.rejected = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.close()
+        self.writer = threading.Thread(target=self._write_loop, name="event-store", daemon=True)
+        self.writer.start()
+        logger.info(f"🗄️ Журнал событий: {self.path}")
+
+    def close(self):
+        """Дописывает очередь и останавливает поток записи"""
+        if self.writer and self.writer.is_alive():
+            self.pending.put(None)
+            self.writer.join()
+
+    # ---------- запись ----------
+    def append(self, event, client=None, raw=None):
+        """Ставит событие в очередь на запись; raw - исходный кадр, чтобы не кодировать заново"""
+        try:
+            row = event_row(event, client, raw)
+        except (TypeError, ValueError) as e:
+            self.rejected += 1
+            logger.error(f"❌ Событие {event.get('type')} не записано в журнал: {e!r}")
+            return
+        try:
+            self.pending.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        conn = self._connect()
+        stop = False
+        while not stop:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + BATCH_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            if None in batch:
+                stop = True
+                batch = [row for row in batch if row is not None]
+            if not batch:
+                continue
+            try:
+                self._insert(conn, batch)
+            except sqlite3.Error as e:
+                # Одна плохая строка не должна стоить всей пачки: пишем по одной
+                logger.error(f"❌ Ошибка записи журнала событий: {e}, пачка пишется по одной строке")
+                for row in batch:
+                    try:
+                        self._insert(conn, [row])
+                    except sqlite3.Error as e:
+                        self.rejected += 1
+                        logger.error(f"❌ Событие {row[1]} не записано в журнал: {e}")
+        conn.close()
+
+    def _insert(self, conn, rows):
+        with conn:
+            conn.executemany(
+                "INSERT INTO events (ts, type, client, msg_id, author, email, number, link, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        self.written += len(rows)
+
+    # ---------- чтение ----------
+    def _reader(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self._connect()
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def _query(self, where="", params=(), limit=10):
+        sql = f"SELECT {COLUMNS} FROM events {where} ORDER BY ts DESC, id DESC LIMIT ?"
+        return [dict(row) for row in self._reader().execute(sql, (*params, limit))]
+
+    def last(self, limit=10, event_type=None):
+        if event_type:
+            return self._query("WHERE type = ?", (event_type,), limit)
+        return self._query(limit=limit)
+
+    def find_email(self, email, limit=10):
+        return self._query("WHERE email = ?", (email,), limit)
+
+    def find_author(self, author, limit=10):
+        return self._query("WHERE author = ?", (author,), limit)
+
+    def find_number(self, number, limit=10):
+        return self._query("WHERE number = ?", (number,), limit)
+
+    def between(self, start_ms, end_ms, event_type=None, limit=1000):
+        if event_type:
+            return self._query("WHERE type = ? AND ts BETWEEN ? AND ?", (event_type, start_ms, end_ms), limit)
+        return self._query("WHERE ts BETWEEN ? AND ?", (start_ms, end_ms), limit)
+
+    def comments(self, start_ms=0):
+        """Все комментарии с start_ms по порядку, без payload: для перестройки аналитики"""
+        return self._reader().execute(
+            "SELECT ts, client, msg_id, author, email, number, link FROM events "
+            "WHERE type = 'comment' AND ts >= ? ORDER BY ts, id",
+            (start_ms,)
+        )
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+DEFAULT_GRACE = 10  # секунд, за которые обрыв и переподключение схлопываются
+MAX_CLIENTS = 1000  # отключенные клиенты сверх этого забываются
+
+
+# ==================== ПОДАВЛЕНИЕ ДРЕБЕЗГА ПОДКЛЮЧЕНИЙ ====================
+CONNECTING = "connecting"   # новый клиент, еще не объявлен
+UP = "up"                   # объявлен подключенным
+DOWN_PENDING = "down_pending"  # оборвался, ждем переподключения
+DOWN = "down"               # объявлен отключенным
+SETTLING = "settling"       # вернулся после обрыва, ждем, что не оборвется снова
+
+
+class _Client:
+    def __init__(self, label):
+        self.label = label
+        self.state = CONNECTING
+        self.timer = None
+        self.down_since = None
+        self.flaps = 0
+        self.announced_down = False
+
+    def cancel(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+
+class FlapDebouncer:
+    """Уведомления о подключениях без дребезга.
+
+    Подключение, обрыв и переподключение одного клиента за grace секунд
+    дают одно сообщение «переподключился через Xс (N обрывов)», а не пару
+    сообщений на каждый обрыв. notify(kind, text) вызывается из цикла
+    событий; kind - connected, disconnected или reconnected.
+    """
+
+    def __init__(self, notify, grace=DEFAULT_GRACE):
+        self.notify = notify
+        self.grace = grace
+        self.clients = {}
+        self.stats = {"connected": 0, "disconnected": 0, "reconnected": 0, "flaps": 0, "suppressed": 0}
+
+    def _later(self, client, callback, key):
+        client.cancel()
+        client.timer = asyncio.get_running_loop().call_later(self.grace, callback, key)
+
+    def connected(self, key, label):
+        client = self.clients.get(key)
+        if client is None:
+            client = self.clients[key] = _Client(label)
+            self._later(client, self._announce_connected, key)
+            self._evict()
+            return
+        client.label = label
+        if client.state in (DOWN_PENDING, DOWN):
+            client.state = SETTLING
+            self._later(client, self._announce_reconnected, key)
+
+    def disconnected(self, key):
+        client = self.clients.get(key)
+        if client is None:
+            return
+        if client.state == CONNECTING:
+            # Не успел стать видимым - и сообщать не о чем
+            client.cancel()
+            del self.clients[key]
+            self.stats["suppressed"] += 1
+            return
+        if client.state not in (UP, SETTLING):
+            return
+        if client.state == UP:
+            client.down_since = time.time()
+        else:
+            self.stats["suppressed"] += 1
+        client.flaps += 1
+        self.stats["flaps"] += 1
+        if client.announced_down:
+            client.cancel()
+            client.state = DOWN
+        else:
+            client.state = DOWN_PENDING
+            self._later(client, self._announce_disconnected, key)
+
+    def forget(self, key):
+        """Убирает клиента без уведомлений (например, анонимный сокет после hello)"""
+        client = self.clients.pop(key, None)
+        if client is not None:
+            client.cancel()
+
+    def _evict(self):
+        if len(self.clients) <= MAX_CLIENTS:
+            return
+        down = sorted((c.down_since, key) for key, c in self.clients.items() if c.state == DOWN)
+        for _, key in down[:len(self.clients) - MAX_CLIENTS]:
+            del self.clients[key]
+
+    # ---------- уведомления ----------
+    def _announce_connected(self, key):
+        client = self.clients[key]
+        client.timer = None
+        client.state = UP
+        self._send("connected", f"✅ Клиент <code>{client.label}</code> подключился")
+
+    def _announce_disconnected(self, key):
+        client = self.clients[key]
+        client.timer = None
+        client.state = DOWN
+        client.announced_down = True
+        self._send("disconnected", f"❌ Клиент <code>{client.label}</code> отключился")
+
+    def _announce_reconnected(self, key):
+        client = self.clients[key]
+        client.timer = None
+        downtime = time.time() - client.down_since
+        self._send(
+            "reconnected",
+            f"🔁 Клиент <code>{client.label}</code> переподключился через {downtime:.0f}с "
+            f"(обрывов: {client.flaps})"
+        )
+        client.state = UP
+        client.down_since = None
+        client.flaps = 0
+        client.announced_down = False
+
+    def _send(self, kind, text):
+        self.stats[kind] += 1
+        logger.info(f"📣 {text}")
+        self.notify(kind, text)
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import re
+from collections import OrderedDict
+
+from telegram_sender import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+BUFFER_SIZE = 200          # разных записей в буфере одного клиента
+INGEST_RATE = 20           # логов в секунду от одного клиента
+INGEST_BURST = 100
+FORWARD_RATE = 0.2         # сообщений в секунду в Telegram от всех клиентов
+FORWARD_BURST = 5
+FLUSH_INTERVAL = 2         # секунд между выгрузками буферов
+FORWARD_LEVEL = 2          # с этого уровня логи уходят в Telegram
+
+DROP_OLDEST = 'drop_oldest'  # переполнение: вытесняем самую старую запись
+DROP_NEWEST = 'drop_newest'  # переполнение: не принимаем новую запись
+
+_VARIABLE_PARTS = re.compile(r'\d+')
+
+
+# ==================== ПРИЕМ ЛОГОВ ====================
+def fingerprint(level, message):
+    """Отпечаток записи: числа (id, счетчики, время) не различают сообщения"""
+    return level, _VARIABLE_PARTS.sub('#', message)
+
+
+class ClientLogBuffer:
+    """Ограниченный буфер логов одного клиента с дедупликацией по отпечатку"""
+
+    def __init__(self, size, policy, ingest_rate, ingest_burst):
+        self.size = size
+        self.policy = policy
+        self.bucket = TokenBucket(ingest_rate, ingest_burst)
+        self.entries = OrderedDict()  # отпечаток -> [уровень, последний текст, сколько раз]
+
+
+class LogPipeline:
+    """Логи расширений: буфер на клиента, выборка token bucket'ом, схлопывание
+    повторов в «×N» и бюджет на пересылку в Telegram.
+
+    add() только кладет запись в буфер; раз в flush_interval буферы
+    выгружаются в серверный лог, а записи уровня forward_level и выше
+    пересылаются через forward(client, level, text, count), пока хватает
+    бюджета. Все, что не поместилось, учитывается в stats.
+    Все методы вызываются из цикла событий.
+    """
+
+    def __init__(self, forward, buffer_size=BUFFER_SIZE, policy=DROP_OLDEST,
+                 ingest_rate=INGEST_RATE, ingest_burst=INGEST_BURST,
+                 forward_rate=FORWARD_RATE, forward_burst=FORWARD_BURST,
+                 flush_interval=FLUSH_INTERVAL, forward_level=FORWARD_LEVEL):
+        if policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Неизвестная политика переполнения: {policy}")
+        self.forward = forward
+        self.buffer_size = buffer_size
+        self.policy = policy
+        self.ingest_rate = ingest_rate
+        self.ingest_burst = ingest_burst
+        self.forward_bucket = TokenBucket(forward_rate, forward_burst)
+        self.flush_interval = flush_interval
+        self.forward_level = forward_level
+        self.buffers = {}
+        self.timer = None
+        self.stats = {
+            "received": 0,      # все принятые кадры log
+            "deduplicated": 0,  # схлопнуты с уже лежащей в буфере записью
+            "sampled": 0,       # отброшены token bucket'ом клиента
+            "overflow": 0,      # вытеснены или не приняты из-за полного буфера
+            "forwarded": 0,     # ушли в Telegram
+            "suppressed": 0,    # не ушли в Telegram: кончился бюджет
+        }
+
+    @property
+    def dropped(self):
+        return self.stats["sampled"] + self.stats["overflow"] + self.stats["suppressed"]
+
+    @property
+    def pending(self):
+        return sum(len(buffer.entries) for buffer in self.buffers.values())
+
+    def add(self, client, level, message):
+        """Принимает запись лога от клиента; False - если она отброшена"""
+        self.stats["received"] += 1
+        buffer = self.buffers.get(client)
+        if buffer is None:
+            buffer = self.buffers[client] = ClientLogBuffer(
+                self.buffer_size, self.policy, self.ingest_rate, self.ingest_burst
+            )
+        key = fingerprint(level, message)
+        entry = buffer.entries.get(key)
+        if entry is not None:
+            # Повтор схлопывается бесплатно и не тратит токены
+            entry[1] = message
+            entry[2] += 1
+            self.stats["deduplicated"] += 1
+            return True
+        if buffer.bucket.delay() > 0:
+            self.stats["sampled"] += 1
+            return False
+        buffer.bucket.take()
+        if len(buffer.entries) >= buffer.size:
+            self.stats["overflow"] += 1
+            if buffer.policy == DROP_NEWEST:
+                return False
+            buffer.entries.popitem(last=False)
+        buffer.entries[key] = [level, message, 1]
+        self._schedule()
+        return True
+
+    def _schedule(self):
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        """Выгружает буферы всех клиентов"""
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        buffers, self.buffers = self.buffers, {}
+        for client, buffer in buffers.items():
+            for level, message, count in buffer.entries.values():
+                suffix = f" ×{count}" if count > 1 else ""
+                logger.info("📝 [ЛОГ %s] %s: %s%s", level, client, message, suffix, extra={"client": client})
+                if level < self.forward_level:
+                    continue
+                if self.forward_bucket.delay() > 0:
+                    self.stats["suppressed"] += 1
+                    continue
+                self.forward_bucket.take()
+                self.stats["forwarded"] += 1
+                self.forward(client, level, message, count)
+            if buffer.entries:
+                # Бакет клиента переживает выгрузку, иначе выборка обнулялась бы каждые flush_interval
+                buffer.entries = OrderedDict()
+                self.buffers[client] = buffer
@@ -0,0 +1,156 @@
+"""Логирование сервера без блокировки цикла событий.
+
+Все логгеры пишут в LazyQueueHandler: запись кладется в очередь как есть,
+без форматирования. Поток QueueListener форматирует ее (текстом или
+JSON-строкой) и пишет в stdout и, если задан файл, в ротируемый файл.
+Уровни задаются по модулям и меняются на ходу через LogControl.
+
+В горячем пути пишите лениво: logger.info("... %s", value, extra={...}),
+а не f-строкой - при выключенном уровне сообщение не собирается вовсе.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+# ==================== НАСТРОЙКИ ====================
+MAX_QUEUE = 10000                 # записей ждут потока записи, сверх - отбрасываются
+DEFAULT_FILE_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_FILE_BACKUPS = 5
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Поля из extra=..., которые попадают в JSON-строку
+EXTRA_FIELDS = ("client", "type", "latency_ms", "command", "target")
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+
+# ==================== ФОРМАТЫ ====================
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна JSON-строка с полями client, type, latency_ms, если они есть"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# ==================== ОЧЕРЕДЬ ====================
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в вызывающем потоке и без ожидания места.
+
+    Стандартный prepare() собирает сообщение сразу; здесь запись уходит в
+    очередь с исходными msg и args, а собирается в потоке записи. Поэтому
+    в args передаются значения, которые потом не меняются (строки, числа).
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# ==================== УПРАВЛЕНИЕ ====================
+class LogControl:
+    """Уровни логгеров по модулям; меняются на ходу из бота.
+
+    Без handler и listener (до setup_logging) ничего не пишет и не запускает
+    поток - только управляет уровнями.
+    """
+
+    def __init__(self, handler=None, listener=None, aliases=None):
+        self.handler = handler
+        self.listener = listener
+        # Короткие имена модулей для команд: server -> __main__
+        self.aliases = aliases or {}
+
+    @property
+    def dropped(self):
+        return self.handler.dropped if self.handler else 0
+
+    @property
+    def pending(self):
+        return self.handler.queue.qsize() if self.handler else 0
+
+    def _logger(self, name):
+        name = self.aliases.get(name, name)
+        return logging.getLogger() if name in ("", "root") else logging.getLogger(name)
+
+    def set_level(self, name, level):
+        """Уровень модуля name ('root' - всех); ValueError на неизвестный уровень"""
+        level = level.upper()
+        if level not in LEVELS:
+            raise ValueError(f"неизвестный уровень {level}")
+        self._logger(name).setLevel(level)
+
+    def levels(self):
+        """{модуль: уровень} для корня и модулей с собственным уровнем"""
+        names = {name: alias for alias, name in self.aliases.items()}
+        result = {"root": logging.getLevelName(logging.getLogger().level)}
+        for name, item in sorted(logging.root.manager.loggerDict.items()):
+            if isinstance(item, logging.Logger) and item.level != logging.NOTSET:
+                result[names.get(name, name)] = logging.getLevelName(item.level)
+        return result
+
+    def stop(self):
+        """Дописывает очередь; вызывать при остановке"""
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+
+
+def setup_logging(level="INFO", fmt="text", path=None, max_bytes=DEFAULT_FILE_MAX_BYTES,
+                  backups=DEFAULT_FILE_BACKUPS, levels=None, aliases=None, stream=None, control=None):
+    """Заменяет обработчики корневого логгера очередью и запускает поток записи.
+
+    levels - "модуль=УРОВЕНЬ,модуль=УРОВЕНЬ" для отдельных модулей.
+    control - уже созданный LogControl, который нужно запустить.
+    """
+    formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(stream or sys.stdout)]
+    if path:
+        handlers.append(logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(MAX_QUEUE)
+    queue_handler = LazyQueueHandler(log_queue)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    if control is None:
+        control = LogControl(aliases=aliases)
+    control.handler, control.listener = queue_handler, listener
+    for item in (levels or "").split(','):
+        name, sep, module_level = item.partition('=')
+        if sep:
+            control.set_level(name.strip(), module_level.strip())
+    return control
+
+
+def elapsed_ms(started):
+    """Миллисекунды с момента started (time.perf_counter()) для поля latency_ms"""
+    return round((time.perf_counter() - started) * 1000, 2)
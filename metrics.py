@@ -0,0 +1,154 @@
+import asyncio
+import bisect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LOOP_LAG_INTERVAL = 0.5  # секунд между замерами задержки цикла
+
+
+# ==================== МЕТРИКИ ====================
+def _format_labels(labelnames, values, extra=""):
+    pairs = [
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in zip(labelnames, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=(), callback=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        # callback() -> число или {(значения меток): число}; читается только при выдаче /metrics
+        self.callback = callback
+        self.values = {}
+
+    def samples(self):
+        values = self.callback() if self.callback else self.values
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {float(value)}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, value=1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            # [счетчики по корзинам..., +Inf, сумма]
+            entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def samples(self):
+        for labels, entry in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), entry):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {entry[-1]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+# ==================== ЗАДЕРЖКА ЦИКЛА СОБЫТИЙ ====================
+async def monitor_loop_lag(gauge, histogram, interval=LOOP_LAG_INTERVAL):
+    """Меряет, насколько позже запланированного просыпается цикл"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+        gauge.set(lag)
+        histogram.observe(lag)
+
+
+# ==================== HTTP /metrics ====================
+class MetricsServer:
+    """Минимальный HTTP-сервер в том же цикле: GET /metrics в формате Prometheus"""
+
+    def __init__(self, registry, host, port):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"📈 Метрики: http://{self.host}:{self.port}/metrics")
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,192 @@
+import asyncio
+import html
+import json
+import logging
+import re
+import sys
+import time
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+MAX_QUEUE = 1000          # уведомлений ждут записи, сверх - отбрасываются
+MAX_BATCH = 100           # уведомлений за одну запись в поток или файл
+HTTP_TIMEOUT = 5          # секунд на один POST
+TAG = re.compile(r"<[^>]+>")
+
+
+# ==================== ИНТЕРФЕЙС ====================
+class Notifier:
+    """Куда уходят уведомления о событиях расширений.
+
+    send_message(chat_id, text, **kwargs) ставит уведомление в очередь, не
+    блокируя, из цикла событий или из любого потока. call() - остальные
+    вызовы Bot API (правка клавиатуры и т.п.); они имеют смысл только в
+    Telegram, остальные приемники их пропускают. TelegramSender из
+    telegram_sender.py реализует этот же интерфейс.
+    """
+
+    name = "none"
+
+    def __init__(self, max_queue=MAX_QUEUE):
+        self.max_queue = max_queue
+        self.queue = None
+        self.loop = None
+        self.worker = None
+        self.stats = {"sent": 0, "failed": 0, "dropped": 0}
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(self.max_queue)
+        self.worker = self.loop.create_task(self._run())
+        logger.info(f"📮 Уведомления: {self.name}")
+
+    async def stop(self):
+        if self.worker:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+
+    def send_message(self, chat_id, text, **kwargs):
+        entry = {"ts": round(time.time(), 3), "chat_id": chat_id, "text": text}
+        if self.loop is None:
+            self.stats["dropped"] += 1
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._put(entry)
+        else:
+            self.loop.call_soon_threadsafe(self._put, entry)
+
+    def call(self, method, chat_id, *args, **kwargs):
+        pass
+
+    def _put(self, entry):
+        try:
+            self.queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < MAX_BATCH and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.deliver(batch)
+                self.stats["sent"] += len(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += len(batch)
+                logger.error(f"❌ Не удалось доставить уведомления ({self.name}): {e!r}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def deliver(self, batch):
+        """Доставляет пачку уведомлений; исключение - вся пачка не доставлена"""
+        raise NotImplementedError
+
+
+def plain_text(text):
+    """HTML-разметка Telegram -> обычный текст"""
+    return html.unescape(TAG.sub("", text))
+
+
+# ==================== ПРИЕМНИКИ ====================
+class StdoutNotifier(Notifier):
+    """Уведомления обычным текстом в stdout; запись идет в потоке, чтобы не ждать pipe"""
+
+    name = "stdout"
+
+    def __init__(self, stream=None, **kwargs):
+        super().__init__(**kwargs)
+        self.stream = stream or sys.stdout
+
+    async def deliver(self, batch):
+        lines = "".join(
+            f"[{time.strftime('%H:%M:%S', time.localtime(entry['ts']))}] {plain_text(entry['text'])}\n"
+            for entry in batch
+        )
+        await asyncio.to_thread(self._write, lines)
+
+    def _write(self, lines):
+        self.stream.write(lines)
+        self.stream.flush()
+
+
+class JsonLinesNotifier(Notifier):
+    """Уведомления JSON-строками {"ts", "chat_id", "text"} в файл (дописывается)"""
+
+    name = "jsonl"
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.name = f"jsonl:{path}"
+
+    async def deliver(self, batch):
+        lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch)
+        await asyncio.to_thread(self._write, lines)
+
+    def _write(self, lines):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+class HttpNotifier(Notifier):
+    """Каждое уведомление - POST с JSON {"ts", "chat_id", "text"} на локальный http:// адрес"""
+
+    name = "http"
+
+    def __init__(self, url, **kwargs):
+        super().__init__(**kwargs)
+        parts = urlsplit(url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise ValueError(f"Нужен адрес вида http://хост:порт/путь, а не {url}")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self.name = url
+
+    async def deliver(self, batch):
+        for entry in batch:
+            await asyncio.wait_for(self._post(json.dumps(entry, ensure_ascii=False).encode()), HTTP_TIMEOUT)
+
+    async def _post(self, body):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(
+                f"POST {self.path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+            status_line = (await reader.readline()).decode('latin-1').split()
+            if len(status_line) < 2 or not status_line[1].startswith('2'):
+                raise ConnectionError(f"ответ {' '.join(status_line[1:]) or 'пустой'}")
+        finally:
+            writer.close()
+
+
+def build_notifier(spec):
+    """Приемник без Telegram по строке: stdout, jsonl:путь или http://хост:порт/путь"""
+    if spec == "stdout":
+        return StdoutNotifier()
+    if spec.startswith("jsonl:"):
+        return JsonLinesNotifier(spec[len("jsonl:"):])
+    if spec.startswith("http://"):
+        return HttpNotifier(spec)
+    raise ValueError(f"Неизвестный приемник уведомлений: {spec}")
@@ -0,0 +1,137 @@
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== JSON-КОДЕК ====================
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    JSON_BACKEND = "orjson"
+    DecodeError = orjson.JSONDecodeError
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+else:
+    JSON_BACKEND = "json"
+    DecodeError = json.JSONDecodeError
+    loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False)
+
+
+# ==================== СХЕМЫ СООБЩЕНИЙ ====================
+OPTIONAL = object()
+
+
+class Schema:
+    """Легкая схема: {поле: тип | (типы) | Schema}, optional(...) - необязательное поле.
+
+    Компилируется один раз в список проверок, без рекурсивного обхода
+    определения на каждом сообщении.
+    """
+
+    def __init__(self, fields):
+        self.checks = []
+        for name, spec in fields.items():
+            required = True
+            if isinstance(spec, tuple) and spec and spec[0] is OPTIONAL:
+                required, spec = False, spec[1]
+            if isinstance(spec, dict):
+                spec = Schema(spec)
+            if isinstance(spec, Schema):
+                self.checks.append((name, dict, required, spec))
+            else:
+                self.checks.append((name, spec, required, None))
+
+    def validate(self, data):
+        """None, если сообщение подходит, иначе описание ошибки"""
+        if not isinstance(data, dict):
+            return "ожидался объект"
+        for name, types, required, nested in self.checks:
+            value = data.get(name, OPTIONAL)
+            if value is OPTIONAL:
+                if required:
+                    return f"нет поля {name}"
+                continue
+            if not isinstance(value, types):
+                return f"поле {name}: неверный тип {type(value).__name__}"
+            if nested is not None:
+                error = nested.validate(value)
+                if error:
+                    return f"{name}.{error}"
+        return None
+
+
+def optional(spec):
+    return (OPTIONAL, spec)
+
+
+# ==================== ТАБЛИЦА ОБРАБОТЧИКОВ ====================
+class MessageRouter:
+    """Разбор входящих кадров и диспетчеризация по data['type'].
+
+    Новый тип сообщения - это один обработчик, зарегистрированный через
+    @router.handler('type', schema). Обработчик получает (conn, data).
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.received = {}
+        self.malformed = {}
+        self.unknown = 0
+        self.decode_errors = 0
+
+    def handler(self, message_type, schema=None):
+        compiled = schema if isinstance(schema, Schema) or schema is None else Schema(schema)
+
+        def decorator(func):
+            self.handlers[message_type] = (func, compiled)
+            self.received.setdefault(message_type, 0)
+            self.malformed.setdefault(message_type, 0)
+            return func
+        return decorator
+
+    def decode(self, raw):
+        """Разбирает кадр; None, если это не JSON-объект с полем type"""
+        try:
+            data = loads(raw)
+        except (DecodeError, ValueError):
+            self.decode_errors += 1
+            logger.error("❌ Ошибка парсинга JSON")
+            return None
+        if not isinstance(data, dict) or not isinstance(data.get('type'), str):
+            self.decode_errors += 1
+            logger.error("❌ Сообщение без поля type")
+            return None
+        return data
+
+    def resolve(self, data):
+        """Обработчик кадра, прошедшего схему; None - неизвестный тип или кадр не по схеме"""
+        message_type = data['type']
+        entry = self.handlers.get(message_type)
+        if entry is None:
+            self.unknown += 1
+            logger.warning("⚠️ Неизвестный тип сообщения: %s", message_type, extra={"type": message_type})
+            return None
+        func, schema = entry
+        self.received[message_type] += 1
+        if schema is not None:
+            error = schema.validate(data)
+            if error:
+                self.malformed[message_type] += 1
+                logger.error("❌ Некорректное сообщение %s: %s", message_type, error, extra={"type": message_type})
+                return None
+        return func
+
+    @property
+    def malformed_total(self):
+        return sum(self.malformed.values()) + self.decode_errors
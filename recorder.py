@@ -0,0 +1,110 @@
+import gzip
+import logging
+import queue
+import threading
+import time
+import zlib
+
+from protocol import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+MAX_PENDING = 100000      # кадров ждут записи, сверх - отбрасываются
+FLUSH_INTERVAL = 1        # секунд тишины, после которых сжатый блок сбрасывается на диск
+RECORD_FORMAT = 1
+
+# Направления записей
+OPEN = "open"             # расширение подключилось
+IN = "in"                 # кадр от расширения
+OUT = "out"               # кадр расширению
+CLOSE = "close"           # соединение закрыто
+
+
+# ==================== ЗАПИСЬ КАДРОВ ====================
+def connection_key(websocket):
+    return f"{id(websocket):x}"
+
+
+class FrameRecorder:
+    """Пишет кадры WebSocket в сжатый файл JSON-строк для воспроизведения.
+
+    Первая строка - заголовок {"format", "started"}, дальше по строке на
+    событие: {"t": секунды от начала, "d": направление, "c": соединение,
+    "m": кадр}. record() только кладет запись в очередь, сжатие и запись
+    идут в отдельном потоке.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = queue.Queue(MAX_PENDING)
+        self.started = time.monotonic()
+        self.writer = None
+        self.recorded = 0
+        self.dropped = 0
+
+    def start(self):
+        self.started = time.monotonic()
+        self.writer = threading.Thread(target=self._write_loop, name="frame-recorder", daemon=True)
+        self.writer.start()
+        logger.info(f"⏺️ Запись кадров WebSocket: {self.path}")
+
+    def close(self):
+        """Дописывает очередь и закрывает файл"""
+        if self.writer and self.writer.is_alive():
+            self.pending.put(None)
+            self.writer.join()
+
+    def record(self, direction, websocket, message=None):
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', 'replace')
+        try:
+            self.pending.put_nowait((time.monotonic() - self.started, direction, connection_key(websocket), message))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self):
+        with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+            f.write(dumps({"format": RECORD_FORMAT, "started": time.time()}) + "\n")
+            dirty = True
+            while True:
+                try:
+                    item = self.pending.get(timeout=FLUSH_INTERVAL)
+                except queue.Empty:
+                    if dirty:
+                        # Затишье: сбрасываем сжатый блок, чтобы запись пережила падение сервера
+                        f.flush()
+                        dirty = False
+                    continue
+                if item is None:
+                    break
+                t, direction, key, message = item
+                entry = {"t": round(t, 6), "d": direction, "c": key}
+                if message is not None:
+                    entry["m"] = message
+                f.write(dumps(entry) + "\n")
+                self.recorded += 1
+                dirty = True
+
+
+def read_capture(path):
+    """Заголовок и список записей из файла FrameRecorder.
+
+    Файл сервера, убитого без закрытия записи, обрывается без конца
+    gzip-потока: все сброшенные на диск строки читаются, хвост отбрасывается.
+    """
+    entries = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = loads(f.readline())
+        if header.get('format') != RECORD_FORMAT:
+            raise ValueError(f"Неизвестный формат записи {path}: {header.get('format')}")
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # строка оборвана посередине
+                if line.strip():
+                    entries.append(loads(line))
+        except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+            logger.warning(f"⚠️ Запись {path} оборвана ({e}), прочитано записей: {len(entries)}")
+    return header, entries
@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+
+
+# ==================== НАСТРОЙКИ ====================
+RENDER_TTL = 5                  # секунд живет отрисовка, зависящая от времени
+MAX_TRACKED_MESSAGES = 500      # сколько сообщений чата помним
+
+
+# ==================== КЭШ ОТРИСОВКИ ====================
+class RenderCache:
+    """Мемоизация экранов и хэши того, что сейчас показано в сообщениях чата.
+
+    memo() - для отрисовок, зависящих только от ключа (клавиатуры);
+    render() - для экранов, зависящих от версии состояния и времени.
+    changed()/remember() позволяют не вызывать edit_message_*, если
+    текст и клавиатура сообщения уже такие же.
+    """
+
+    def __init__(self, ttl=RENDER_TTL, max_messages=MAX_TRACKED_MESSAGES):
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.memos = {}
+        self.renders = {}
+        self.messages = OrderedDict()  # (chat_id, message_id) -> [хэш текста, хэш клавиатуры]
+        self.hits = 0
+        self.misses = 0
+        self.skipped_edits = 0
+
+    def memo(self, key, builder):
+        value = self.memos.get(key)
+        if value is None:
+            value = self.memos[key] = builder()
+        return value
+
+    def render(self, key, version, builder, now=None):
+        now = time.monotonic() if now is None else now
+        cached = self.renders.get(key)
+        if cached is not None and cached[0] == version and cached[1] > now:
+            self.hits += 1
+            return cached[2]
+        self.misses += 1
+        value = builder()
+        self.renders[key] = (version, now + self.ttl, value)
+        return value
+
+    # ---------- что показано в чате ----------
+    def changed(self, chat_id, message_id, text=None, markup=None):
+        """True, если сообщение нужно редактировать (или мы его не знаем)"""
+        shown = self.messages.get((chat_id, message_id))
+        if shown is None:
+            return True
+        if text is not None and shown[0] != hash(text):
+            return True
+        if markup is not None and shown[1] != hash(markup):
+            return True
+        self.skipped_edits += 1
+        return False
+
+    def remember(self, chat_id, message_id, text=None, markup=None):
+        key = (chat_id, message_id)
+        shown = self.messages.get(key)
+        if shown is None:
+            shown = self.messages[key] = [None, None]
+        else:
+            self.messages.move_to_end(key)
+        if text is not None:
+            shown[0] = hash(text)
+        if markup is not None:
+            shown[1] = hash(markup)
+        while len(self.messages) > self.max_messages:
+            self.messages.popitem(last=False)
@@ -0,0 +1,181 @@
+import asyncio
+import collections
+import heapq
+import itertools
+
+
+# ==================== НАСТРОЙКИ ====================
+COOLDOWN = 300            # секунд между комментариями всех клиентов вместе (COMMENT_COOLDOWN в content.js)
+MAX_WAIT = 300            # секунд кандидат ждет слота, потом отказ
+MAX_PENDING = 1000        # кандидатов в ожидании, сверх - отказ сразу
+TAKEN_CAPACITY = 1000     # сколько последних занятых сообщений помним
+SLACK = 0.001             # таймер цикла может сработать чуть раньше срока
+
+# Решения по кандидатам
+GRANTED = "granted"       # слот выдан: можно комментировать
+TAKEN = "taken"           # сообщение уже получило слот или его ждет другая вкладка
+FOREIGN = "foreign"       # на сообщении появился чужой комментарий
+EXPIRED = "expired"       # слот не освободился за max_wait
+BUSY = "busy"             # очередь кандидатов переполнена
+DECISIONS = (GRANTED, TAKEN, FOREIGN, EXPIRED, BUSY)
+
+
+# ==================== ОБЩИЙ КУЛДАУН ====================
+class Candidate:
+    __slots__ = ("client_id", "candidate_id", "message_id", "expires_at", "done", "previous_slot", "slot_end")
+
+    def __init__(self, client_id, candidate_id, message_id, expires_at):
+        self.client_id = client_id
+        self.candidate_id = candidate_id
+        self.message_id = message_id
+        self.expires_at = expires_at
+        self.done = False
+        self.previous_slot = None  # next_slot до выдачи слота этому кандидату
+        self.slot_end = None       # next_slot после выдачи
+
+
+class CommentScheduler:
+    """Один кулдаун комментариев на все подключенные вкладки и машины.
+
+    Вкладка, решившая прокомментировать сообщение (счетчик пропусков и
+    вероятность остаются в content.js), присылает кандидата. Если слот
+    свободен, он выдается сразу; иначе кандидат ждет в очереди, и при
+    освобождении слота его получает самый ранний живой кандидат. Сроки
+    ожидания лежат в куче, сработавшие кандидаты помечаются done и
+    выбрасываются лениво, так что решение стоит O(log n), а таймер в цикле
+    событий один - на ближайшее событие. Чужой комментарий на сообщении
+    снимает его кандидата, а комментарий клиента без планировщика просто
+    занимает слот.
+
+    decide(client_id, candidate_id, решение) отправляет решение вкладке.
+    """
+
+    def __init__(self, decide, cooldown=COOLDOWN, max_wait=MAX_WAIT, max_pending=MAX_PENDING):
+        self.decide = decide
+        self.cooldown = cooldown
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.next_slot = 0.0               # loop.time(), раньше которого слот не выдается
+        self.queue = collections.deque()   # кандидаты в порядке прихода
+        self.expiry = []                   # куча (срок, номер, кандидат)
+        self.waiting = {}                  # message_id -> ждущий кандидат
+        self.granted = {}                  # (client_id, candidate_id) -> кандидат со слотом
+        self.taken = collections.OrderedDict()  # message_id -> True, если слот выдан планировщиком
+        self.counter = itertools.count()
+        self.timer = None
+        self.stats = dict.fromkeys(DECISIONS, 0)
+        self.stats.update(released=0, external=0)
+
+    def __len__(self):
+        return len(self.waiting)
+
+    @staticmethod
+    def _now():
+        return asyncio.get_running_loop().time()
+
+    # ---------- события от вкладок ----------
+    def offer(self, client_id, candidate_id, message_id):
+        """Кандидат на комментарий; решение приходит через decide() - сразу или позже"""
+        if message_id in self.taken or message_id in self.waiting:
+            return self._decide(Candidate(client_id, candidate_id, message_id, 0), TAKEN)
+        if len(self.waiting) >= self.max_pending:
+            return self._decide(Candidate(client_id, candidate_id, message_id, 0), BUSY)
+        now = self._now()
+        candidate = Candidate(client_id, candidate_id, message_id, now + self.max_wait)
+        if now >= self.next_slot and not self.waiting:
+            return self._grant(candidate, now)
+        self.waiting[message_id] = candidate
+        self.queue.append(candidate)
+        heapq.heappush(self.expiry, (candidate.expires_at, next(self.counter), candidate))
+        self._schedule()
+
+    def released(self, client_id, candidate_id, commented):
+        """Итог выданного слота: без комментария слот возвращается, если его еще никто не занял"""
+        candidate = self.granted.pop((client_id, candidate_id), None)
+        if candidate is None:
+            return
+        self.stats["released"] += 1
+        if not commented and self.next_slot == candidate.slot_end:
+            self.next_slot = candidate.previous_slot
+            self._schedule()
+
+    def foreign(self, message_id):
+        """На сообщении появился чужой комментарий: его кандидат больше не нужен"""
+        candidate = self.waiting.pop(message_id, None)
+        self._remember(message_id, False)
+        if candidate is not None:
+            self._decide(candidate, FOREIGN)
+            self._schedule()
+
+    def commented(self, message_id):
+        """Комментарий от клиента; если слот выдавали не мы - клиент без планировщика, слот занят им"""
+        if self.taken.get(message_id):
+            return
+        self.stats["external"] += 1
+        self._remember(message_id, False)
+        self.next_slot = max(self.next_slot, self._now() + self.cooldown)
+        candidate = self.waiting.pop(message_id, None)
+        if candidate is not None:
+            self._decide(candidate, TAKEN)
+        self._schedule()
+
+    def forget(self, client_id):
+        """Клиент отключился: его кандидаты снимаются без решения (вкладка сама отменила ожидание)"""
+        for message_id, candidate in list(self.waiting.items()):
+            if candidate.client_id == client_id:
+                candidate.done = True
+                del self.waiting[message_id]
+        for key in [key for key in self.granted if key[0] == client_id]:
+            del self.granted[key]
+        self._schedule()
+
+    # ---------- слоты и таймер ----------
+    def _grant(self, candidate, now):
+        candidate.previous_slot = self.next_slot
+        self.next_slot = candidate.slot_end = now + self.cooldown
+        self.granted[(candidate.client_id, candidate.candidate_id)] = candidate
+        self._remember(candidate.message_id, True)
+        self._decide(candidate, GRANTED)
+
+    def _decide(self, candidate, decision):
+        candidate.done = True
+        self.stats[decision] += 1
+        self.decide(candidate.client_id, candidate.candidate_id, decision)
+
+    def _remember(self, message_id, granted):
+        self.taken[message_id] = granted or self.taken.get(message_id, False)
+        self.taken.move_to_end(message_id)
+        while len(self.taken) > TAKEN_CAPACITY:
+            self.taken.popitem(last=False)
+
+    def _first_waiting(self):
+        while self.queue and self.queue[0].done:
+            self.queue.popleft()
+        return self.queue[0] if self.queue else None
+
+    def _schedule(self):
+        """Один таймер на ближайшее событие: освобождение слота или истечение срока"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.expiry and self.expiry[0][2].done:
+            heapq.heappop(self.expiry)
+        if self._first_waiting() is None:
+            return
+        when = min(self.next_slot, self.expiry[0][0])
+        self.timer = asyncio.get_running_loop().call_at(when, self._tick)
+
+    def _tick(self):
+        self.timer = None
+        now = self._now() + SLACK
+        while self.expiry and (self.expiry[0][2].done or self.expiry[0][0] <= now):
+            _, _, candidate = heapq.heappop(self.expiry)
+            if not candidate.done:
+                del self.waiting[candidate.message_id]
+                self._decide(candidate, EXPIRED)
+        if now >= self.next_slot:
+            candidate = self._first_waiting()
+            if candidate is not None:
+                del self.waiting[candidate.message_id]
+                self._grant(candidate, now)
+        self._schedule()
@@ -0,0 +1,50 @@
+import time
+from collections import OrderedDict
+
+
+# ==================== НАСТРОЙКИ ====================
+CAPACITY = 10000          # ключей в памяти, самые старые вытесняются
+TTL = 24 * 3600           # секунд помним ключ
+
+
+# ==================== ИДЕМПОТЕНТНОСТЬ ====================
+class SeenCache:
+    """LRU с TTL для ключей уже обработанных событий.
+
+    check(key) отмечает ключ и говорит, встречался ли он раньше. Память
+    ограничена capacity; load() заполняет кэш после перезапуска, например
+    из журнала событий.
+    """
+
+    def __init__(self, capacity=CAPACITY, ttl=TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.keys = OrderedDict()  # ключ -> когда истекает (time.time())
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def check(self, key, now=None):
+        """True, если ключ уже был и не истек; иначе запоминает его"""
+        now = time.time() if now is None else now
+        expires = self.keys.get(key)
+        if expires is not None and expires > now:
+            self.keys.move_to_end(key)
+            self.hits += 1
+            return True
+        self._add(key, now + self.ttl)
+        return False
+
+    def load(self, items, now=None):
+        """Заполняет кэш парами (ключ, когда событие было, time.time())"""
+        now = time.time() if now is None else now
+        for key, seen_at in sorted(items, key=lambda item: item[1]):
+            if seen_at + self.ttl > now:
+                self._add(key, seen_at + self.ttl)
+
+    def _add(self, key, expires):
+        self.keys[key] = expires
+        self.keys.move_to_end(key)
+        while len(self.keys) > self.capacity:
+            self.keys.popitem(last=False)
@@ -0,0 +1,283 @@
+import math
+import time
+
+from stats_series import counter_deltas
+
+
+# ==================== НАСТРОЙКИ ====================
+MAX_OFFLINE_SESSIONS = 100   # сколько отключенных клиентов помним
+SHORT_ID_LENGTH = 8
+LAST_SEEN_STEP = 60          # секунд: точность last_seen в снимке состояния
+
+STATS_TEMPLATE = {
+    "commented": 0,
+    "skipped": 0,
+    "ignored": 0,
+    "queueLength": 0,
+    "waitingForCooldown": False,
+    "lastMessageId": 0,
+    "messageCounter": 0
+}
+SUMMED = ("commented", "skipped", "ignored", "queueLength", "messageCounter")
+NUMERIC = SUMMED + ("lastMessageId",)
+
+
+def as_count(value):
+    """Целое значение счетчика или None, если прислано не число"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return int(value)
+
+
+def clean_stats(stats, previous):
+    """Копия stats с целыми счетчиками; нечисловое поле остается прежним из previous"""
+    clean = dict(stats)
+    for name in NUMERIC:
+        if name in clean:
+            value = as_count(clean[name])
+            clean[name] = value if value is not None else previous.get(name, 0)
+    return clean
+
+
+# ==================== РЕЕСТР КЛИЕНТОВ ====================
+class ClientSession:
+    """Одно расширение (вкладка или машина), опознанное по clientId"""
+
+    def __init__(self, client_id, websocket=None, group=None):
+        self.client_id = client_id
+        self.short_id = client_id[:SHORT_ID_LENGTH]
+        self.websocket = websocket
+        self.group = group
+        self.stats = dict(STATS_TEMPLATE)
+        self.has_stats = False
+        self.stats_seq = None  # номер последнего примененного обновления статистики
+        self.settings = {}
+        self.paused = False
+        self.connected_at = time.time()
+        self.last_seen = self.connected_at
+        self.pending_sends = 0  # команд в процессе отправки этому клиенту
+        self.rtt = None  # секунд на прикладной ping/pong; None - клиент его не поддерживает
+        self.acks = False  # клиент подтверждает команды (ack/nack)
+        self.command_rtt = None  # сглаженное время от команды до подтверждения, секунд
+        self.applied = None  # состояние, которое клиент сообщил в последнем ack
+        self.instance = None  # случайный id загрузки страницы из hello
+
+    @property
+    def online(self):
+        return self.websocket is not None
+
+    def touch(self):
+        self.last_seen = time.time()
+
+
+class SessionRegistry:
+    """Клиенты по clientId, короткому id, сокету и группе.
+
+    Сводная статистика пересчитывается инкрементально по разнице
+    старого и нового снимка клиента, поэтому обработка сообщения не
+    зависит от числа подключенных клиентов.
+    """
+
+    def __init__(self, aggregate):
+        self.by_id = {}
+        self.by_short = {}
+        self.by_socket = {}
+        self.groups = {}
+        # Сводная статистика по всем известным клиентам (обычно state.stats)
+        self.aggregate = aggregate
+        self.waiting_count = 0
+
+    def __len__(self):
+        return len(self.by_socket)
+
+    @property
+    def connected(self):
+        return list(self.by_socket.values())
+
+    # ---------- жизненный цикл ----------
+    def connect(self, websocket, client_id=None, group=None):
+        """Регистрирует сокет; до рукопожатия клиент анонимный"""
+        client_id = client_id or f"anon-{id(websocket):x}"
+        session = self.by_id.get(client_id)
+        if session is None:
+            session = ClientSession(client_id, websocket)
+            self.by_id[client_id] = session
+            self.by_short[session.short_id] = session
+            self._evict_offline()
+        else:
+            # Переподключение: старый сокет больше не считается клиентом
+            if session.websocket is not None:
+                self.by_socket.pop(session.websocket, None)
+            session.websocket = websocket
+            session.connected_at = time.time()
+        if group is not None and group != session.group:
+            self._set_group(session, group)
+        session.touch()
+        self.by_socket[websocket] = session
+        return session
+
+    def identify(self, session, client_id, group=None):
+        """Рукопожатие hello: переносит анонимный сокет на постоянный clientId"""
+        websocket = session.websocket
+        if session.client_id != client_id:
+            self._forget(session)
+        return self.connect(websocket, client_id, group)
+
+    def disconnect(self, session, websocket=None):
+        """Отключает клиента; повторный вызов безопасен"""
+        websocket = websocket or session.websocket
+        if self.by_socket.get(websocket) is session:
+            del self.by_socket[websocket]
+        if session.websocket is websocket:
+            session.websocket = None
+            # После переподключения дельты принимаются только поверх свежего снимка
+            session.stats_seq = None
+            if session.client_id.startswith("anon-"):
+                self._forget(session)
+            else:
+                # Счетчики отключенного клиента остаются в сводке, очередь и ожидание - нет
+                self._apply_stats(session, dict(session.stats, queueLength=0, waitingForCooldown=False))
+
+    def _forget(self, session):
+        if self.by_id.get(session.client_id) is session:
+            del self.by_id[session.client_id]
+        if self.by_short.get(session.short_id) is session:
+            del self.by_short[session.short_id]
+        if session.websocket is not None:
+            self.by_socket.pop(session.websocket, None)
+        self._set_group(session, None)
+        self._apply_stats(session, dict(STATS_TEMPLATE))
+
+    def _evict_offline(self):
+        if len(self.by_id) - len(self.by_socket) <= MAX_OFFLINE_SESSIONS:
+            return
+        offline = [s for s in self.by_id.values() if not s.online]
+        offline.sort(key=lambda s: s.last_seen)
+        for session in offline[:len(offline) - MAX_OFFLINE_SESSIONS]:
+            self._forget(session)
+
+    def _set_group(self, session, group):
+        if session.group is not None:
+            members = self.groups.get(session.group)
+            if members is not None:
+                members.discard(session.client_id)
+                if not members:
+                    del self.groups[session.group]
+        session.group = group
+        if group is not None:
+            self.groups.setdefault(group, set()).add(session.client_id)
+
+    # ---------- снимки ----------
+    def export(self):
+        """Опознанные клиенты для снимка состояния.
+
+        Очередь и ожидание при восстановлении все равно обнуляются, а
+        last_seen огрублен до LAST_SEEN_STEP: кадр, который меняет только
+        их, не меняет байты снимка, и Snapshotter не переписывает файл.
+        """
+        return [
+            {
+                "client_id": s.client_id,
+                "group": s.group,
+                "stats": dict(s.stats, queueLength=0, waitingForCooldown=False),
+                "has_stats": s.has_stats,
+                "settings": s.settings,
+                "paused": s.paused,
+                "last_seen": s.last_seen - s.last_seen % LAST_SEEN_STEP,
+            }
+            for s in self.by_id.values() if not s.client_id.startswith("anon-")
+        ]
+
+    def restore(self, items):
+        """Восстанавливает клиентов из снимка как отключенных, вместе со сводкой"""
+        for item in items:
+            session = self.by_id.get(item["client_id"])
+            if session is None:
+                session = ClientSession(item["client_id"])
+                self.by_id[session.client_id] = session
+                self.by_short[session.short_id] = session
+            self._set_group(session, item.get("group"))
+            session.has_stats = item.get("has_stats", False)
+            session.settings = item.get("settings") or {}
+            session.paused = item.get("paused", False)
+            session.last_seen = item.get("last_seen", session.last_seen)
+            # Отключенный клиент: очередь и ожидание не переносим
+            stats = clean_stats(dict(STATS_TEMPLATE, **item.get("stats", {})), STATS_TEMPLATE)
+            stats.update(queueLength=0, waitingForCooldown=False)
+            self._apply_stats(session, stats)
+        self._evict_offline()
+
+    # ---------- статистика ----------
+    def update_stats(self, session, stats, seq=None):
+        """Обновляет снимок клиента и сводку; возвращает приращения счетчиков"""
+        new = dict(session.stats)
+        new.update(clean_stats(stats, session.stats))
+        # Первый снимок клиента - точка отсчета, а не прирост
+        deltas = counter_deltas(session.stats if session.has_stats else None, new)
+        self._apply_stats(session, new)
+        session.has_stats = True
+        if seq is not None:
+            # Полный снимок - новая точка отсчета для дельт
+            session.stats_seq = seq
+        session.touch()
+        return deltas
+
+    def apply_stats_delta(self, session, seq, delta, values=None):
+        """Применяет дельту номер seq к снимку клиента.
+
+        Возвращает приращения счетчиков ({} для повтора уже примененного
+        номера) или None, если обновление пропущено и нужен полный снимок.
+        """
+        if session.stats_seq is None or seq > session.stats_seq + 1:
+            return None
+        if seq <= session.stats_seq:
+            return {}
+        new = dict(session.stats)
+        for name, change in delta.items():
+            change = as_count(change)
+            if change is None:
+                # Кадр отбрасывается целиком, клиент пришлет полный снимок
+                return None
+            new[name] = (as_count(new.get(name, 0)) or 0) + change
+        if values:
+            new.update(clean_stats(values, session.stats))
+        deltas = counter_deltas(session.stats, new)
+        self._apply_stats(session, new)
+        session.stats_seq = seq
+        session.touch()
+        return deltas
+
+    def _apply_stats(self, session, new):
+        # Сначала все приращения, потом изменения: сводка и снимок клиента меняются только вместе
+        old = session.stats
+        changes = {name: int(new.get(name, 0)) - int(old.get(name, 0)) for name in SUMMED}
+        last_message_id = int(new.get("lastMessageId", 0))
+        for name, change in changes.items():
+            self.aggregate[name] += change
+        self.waiting_count += bool(new.get("waitingForCooldown")) - bool(old.get("waitingForCooldown"))
+        self.aggregate["waitingForCooldown"] = self.waiting_count > 0
+        self.aggregate["lastMessageId"] = max(self.aggregate["lastMessageId"], last_message_id)
+        session.stats = new
+
+    # ---------- адресация ----------
+    def resolve(self, target=None):
+        """Сессии по адресу: None/'all' - все, '@группа', clientId или короткий id"""
+        if target in (None, "", "all"):
+            return self.connected
+        if target.startswith("@"):
+            members = self.groups.get(target[1:], ())
+            sessions = (self.by_id[client_id] for client_id in members)
+        else:
+            session = self.by_id.get(target) or self.by_short.get(target)
+            sessions = (session,) if session else ()
+        return [s for s in sessions if s.online]
+
+
+class Connection:
+    """WebSocket-соединение и сессия клиента, к которой оно сейчас привязано"""
+
+    def __init__(self, websocket, session):
+        self.websocket = websocket
+        self.session = session
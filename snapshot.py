@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+import time
+
+from protocol import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+SNAPSHOT_INTERVAL = 2  # секунд между проверками, изменилось ли состояние
+SNAPSHOT_FORMAT = 1
+
+
+# ==================== СНИМКИ СОСТОЯНИЯ ====================
+def write_atomic(path, data):
+    """Пишет во временный файл рядом и подменяет им path: файл всегда целый"""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Snapshotter:
+    """Сохраняет состояние сервера в файл и восстанавливает его при запуске.
+
+    collect() возвращает словарь состояния, version() - счетчик изменений.
+    Раз в interval секунд снимок собирается, только если version() сдвинулся,
+    и пишется на диск (в пуле потоков), только если байты отличаются от
+    последнего записанного.
+    """
+
+    def __init__(self, path, collect, version, interval=SNAPSHOT_INTERVAL):
+        self.path = path
+        self.collect = collect
+        self.version = version
+        self.interval = interval
+        self.saved_version = None
+        self.saved_data = None
+        self.writes = 0
+        self.task = None
+
+    def load(self):
+        """Читает снимок; None, если его нет или он поврежден"""
+        started = time.perf_counter()
+        try:
+            with open(self.path, 'rb') as f:
+                snapshot = loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"❌ Снимок состояния {self.path} не прочитан: {e!r}")
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT:
+            logger.error(f"❌ Снимок состояния {self.path} в неизвестном формате")
+            return None
+        logger.info(f"💾 Снимок состояния прочитан за {(time.perf_counter() - started) * 1000:.1f}мс")
+        return snapshot
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save()
+            except Exception as e:
+                logger.error(f"❌ Ошибка сохранения снимка состояния: {e!r}")
+
+    def _prepare(self):
+        version = self.version()
+        if version == self.saved_version:
+            return version, None
+        data = dumps(dict(self.collect(), format=SNAPSHOT_FORMAT)).encode()
+        if data == self.saved_data:
+            self.saved_version = version
+            return version, None
+        return version, data
+
+    async def save(self):
+        version, data = self._prepare()
+        if data is None:
+            return
+        await asyncio.to_thread(write_atomic, self.path, data)
+        self._saved(version, data)
+
+    def save_now(self):
+        """Синхронная запись при остановке сервера"""
+        version, data = self._prepare()
+        if data is not None:
+            write_atomic(self.path, data)
+            self._saved(version, data)
+
+    def _saved(self, version, data):
+        self.saved_version = version
+        self.saved_data = data
+        self.writes += 1
@@ -0,0 +1,143 @@
+import time
+from array import array
+
+
+# ==================== НАСТРОЙКИ ====================
+SNAPSHOT_CAPACITY = 1024      # последних снимков статистики
+MINUTE_SLOTS = 180            # 3 часа поминутно
+HOUR_SLOTS = 24 * 7           # неделя по часам
+
+COUNTERS = ("commented", "skipped", "ignored")
+WINDOWS = {"15m": 15 * 60, "1h": 3600, "6h": 6 * 3600, "24h": 24 * 3600, "7d": 7 * 24 * 3600}
+
+
+# ==================== ВРЕМЕННЫЕ РЯДЫ СТАТИСТИКИ ====================
+def counter_deltas(prev, current):
+    """Приращения накопительных счетчиков между двумя снимками stats"""
+    deltas = {}
+    for name in COUNTERS:
+        value = int(current.get(name, 0))
+        previous = int(prev.get(name, 0)) if prev else value
+        # Счетчик уменьшился - расширение перезапустилось, считаем с нуля
+        deltas[name] = value - previous if value >= previous else value
+    return deltas
+
+
+class SnapshotRing:
+    """Кольцевой буфер снимков на массивах фиксированного размера"""
+
+    def __init__(self, capacity=SNAPSHOT_CAPACITY):
+        self.capacity = capacity
+        self.ts = array('d', [0.0] * capacity)
+        self.queue = array('l', [0] * capacity)
+        self.size = 0
+        self.head = 0  # куда пишем следующий снимок
+
+    def append(self, ts, queue_length):
+        self.ts[self.head] = ts
+        self.queue[self.head] = queue_length
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def since(self, start):
+        """(ts, queue) снимков не старше start, от старых к новым"""
+        result = []
+        for i in range(self.size):
+            idx = (self.head - 1 - i) % self.capacity
+            if self.ts[idx] < start:
+                break
+            result.append((self.ts[idx], self.queue[idx]))
+        result.reverse()
+        return result
+
+
+class Rollup:
+    """Агрегаты по корзинам фиксированной длины (минута, час), кольцом"""
+
+    def __init__(self, period, slots):
+        self.period = period
+        self.slots = slots
+        self.bucket = array('q', [-1] * slots)
+        self.counters = {name: array('q', [0] * slots) for name in COUNTERS}
+        self.cooldown = array('d', [0.0] * slots)
+
+    def _slot(self, ts):
+        bucket = int(ts // self.period)
+        idx = bucket % self.slots
+        if self.bucket[idx] != bucket:
+            self.bucket[idx] = bucket
+            for values in self.counters.values():
+                values[idx] = 0
+            self.cooldown[idx] = 0.0
+        return idx
+
+    def add(self, ts, deltas, cooldown_seconds):
+        idx = self._slot(ts)
+        for name, delta in deltas.items():
+            self.counters[name][idx] += delta
+        self.cooldown[idx] += cooldown_seconds
+
+    def totals(self, now, window):
+        """Суммы за последние window секунд (с точностью до корзины)"""
+        last = int(now // self.period)
+        first = last - max(1, min(self.slots, int(-(-window // self.period)))) + 1
+        result = {name: 0 for name in COUNTERS}
+        cooldown = 0.0
+        for idx in range(self.slots):
+            if first <= self.bucket[idx] <= last:
+                for name in COUNTERS:
+                    result[name] += self.counters[name][idx]
+                cooldown += self.cooldown[idx]
+        result["cooldown"] = cooldown
+        return result
+
+
+class StatsSeries:
+    """Скорости по окнам из приращений счетчиков.
+
+    Снимки из расширения - накопительные счетчики, поэтому вызывающий код
+    передает разницу с предыдущим снимком (counter_deltas), а она
+    раскладывается по поминутным и почасовым корзинам. Память фиксирована
+    и не зависит от аптайма.
+    """
+
+    def __init__(self):
+        self.snapshots = SnapshotRing()
+        self.minutes = Rollup(60, MINUTE_SLOTS)
+        self.hours = Rollup(3600, HOUR_SLOTS)
+        self.waiting = False
+        self.last_ts = None
+        self.started = time.time()
+
+    def record(self, deltas, waiting, queue_length, now=None):
+        """Учитывает приращения счетчиков и текущее состояние ожидания/очереди"""
+        now = time.time() if now is None else now
+        cooldown = max(0.0, now - self.last_ts) if self.waiting else 0.0
+        self.minutes.add(now, deltas, cooldown)
+        self.hours.add(now, deltas, cooldown)
+        self.snapshots.append(now, int(queue_length))
+        self.waiting = bool(waiting)
+        self.last_ts = now
+
+    def window_report(self, window, now=None):
+        """Скорости и соотношения за окно в секундах"""
+        now = time.time() if now is None else now
+        rollup = self.minutes if window <= self.minutes.period * self.minutes.slots else self.hours
+        totals = rollup.totals(now, window)
+        # Окно не может быть длиннее времени наблюдения
+        span = max(1.0, min(window, now - self.started))
+        if self.waiting:
+            totals["cooldown"] += max(0.0, now - self.last_ts)
+        queue = self.snapshots.since(now - window)
+        return {
+            "window": window,
+            "commented": totals["commented"],
+            "skipped": totals["skipped"],
+            "ignored": totals["ignored"],
+            "commented_per_hour": totals["commented"] * 3600 / span,
+            "skip_ratio": totals["skipped"] / max(1, totals["skipped"] + totals["ignored"]),
+            "cooldown_share": min(1.0, totals["cooldown"] / span),
+            "queue_first": queue[0][1] if queue else None,
+            "queue_last": queue[-1][1] if queue else None,
+            "queue_max": max((q for _, q in queue), default=None),
+        }
@@ -0,0 +1,267 @@
+import bisect
+import fnmatch
+import logging
+import re
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+EVENT_TYPES = ("comment", "debug", "connection", "status")
+FILTER_FIELDS = {
+    "authors": "авторы",
+    "domains": "домены почты",
+    "numbers": "номера",
+    "links": "задачи",
+    "types": "типы событий",
+}
+GLOB_CHARS = set("*?[")
+
+
+# ==================== РАЗБОР ФИЛЬТРОВ ====================
+def task_key(link):
+    """https://st.example.com/QUEUE-12?focus=1 -> QUEUE-12"""
+    path = urlsplit(link).path if '://' in link else link
+    return path.rstrip('/').rsplit('/', 1)[-1].upper()
+
+
+def email_domains(email):
+    """a@mail.example.com -> mail.example.com, example.com, com"""
+    if not email or '@' not in email:
+        return ()
+    labels = email.rpartition('@')[2].lower().split('.')
+    return tuple('.'.join(labels[i:]) for i in range(len(labels)))
+
+
+def parse_range(text):
+    """'5' -> (5, 5), '1-5' -> (1, 5)"""
+    low, sep, high = text.strip('[]').partition('-')
+    low = int(low)
+    high = int(high) if sep else low
+    if high < low:
+        raise ValueError(f"пустой диапазон {text}")
+    return [low, high]
+
+
+def parse_filter(field, values):
+    """Проверяет и нормализует значения фильтра; ValueError, если они неверны"""
+    if field == "authors":
+        return sorted({value.lower() for value in values})
+    if field == "domains":
+        return sorted({value.lower().lstrip('@') for value in values})
+    if field == "numbers":
+        return sorted(parse_range(value) for value in values)
+    if field == "links":
+        return sorted({task_key(value) for value in values})
+    if field == "types":
+        unknown = set(values) - set(EVENT_TYPES)
+        if unknown:
+            raise ValueError(f"неизвестные типы: {', '.join(sorted(unknown))}")
+        return sorted(set(values))
+    raise ValueError(f"неизвестное поле {field}")
+
+
+# ==================== ИНДЕКС ====================
+# Каждому подписчику соответствует бит. По каждому полю индекс хранит маску
+# подписчиков без ограничения и маски по значениям; совпадение с событием -
+# AND масок по полям. Стоимость не зависит от числа подписчиков и правил:
+# несколько словарных поисков и операций над целыми числами.
+class _ValueIndex:
+    def __init__(self):
+        self.free = 0
+        self.values = {}
+
+    def add(self, bit, values):
+        if not values:
+            self.free |= bit
+        for value in values:
+            self.values[value] = self.values.get(value, 0) | bit
+
+    def lookup(self, *keys):
+        mask = self.free
+        for key in keys:
+            mask |= self.values.get(key, 0)
+        return mask
+
+
+class _RangeIndex:
+    """Диапазоны номеров, разрезанные на непересекающиеся отрезки с масками"""
+
+    def __init__(self):
+        self.free = 0
+        self.ranges = []
+        self.points = []
+        self.segments = []
+
+    def add(self, bit, ranges):
+        if not ranges:
+            self.free |= bit
+        for low, high in ranges:
+            self.ranges.append((low, high, bit))
+
+    def build(self):
+        self.points = sorted({low for low, _, _ in self.ranges} | {high + 1 for _, high, _ in self.ranges})
+        self.segments = [0] * len(self.points)
+        for low, high, bit in self.ranges:
+            for i in range(bisect.bisect_left(self.points, low), bisect.bisect_left(self.points, high + 1)):
+                self.segments[i] |= bit
+
+    def lookup(self, number):
+        if number is None:
+            return self.free
+        i = bisect.bisect_right(self.points, number) - 1
+        return self.free | (self.segments[i] if i >= 0 else 0)
+
+
+class _LinkIndex:
+    """QUEUE и QUEUE-* - по очереди, QUEUE-12 - по ключу, прочие шаблоны - по одному на шаблон"""
+
+    def __init__(self):
+        self.keys = _ValueIndex()
+        self.patterns = {}
+        self.globs = []
+
+    def add(self, bit, patterns):
+        plain = []
+        for pattern in patterns:
+            if pattern.endswith('-*') and not GLOB_CHARS & set(pattern[:-2]):
+                plain.append(pattern[:-2])
+            elif GLOB_CHARS & set(pattern):
+                self.patterns[pattern] = self.patterns.get(pattern, 0) | bit
+            else:
+                plain.append(pattern)
+        if plain or not patterns:
+            self.keys.add(bit, plain)
+
+    def build(self):
+        self.globs = [(re.compile(fnmatch.translate(pattern)), mask) for pattern, mask in self.patterns.items()]
+
+    def lookup(self, link):
+        if not link:
+            return self.keys.free
+        key = task_key(link)
+        mask = self.keys.lookup(key, key.partition('-')[0])
+        for regex, glob_mask in self.globs:
+            if regex.match(key):
+                mask |= glob_mask
+        return mask
+
+
+class _Index:
+    def __init__(self, subscribers):
+        self.chats = [subscriber.chat_id for subscriber in subscribers]
+        self.types = _ValueIndex()
+        self.authors = _ValueIndex()
+        self.domains = _ValueIndex()
+        self.numbers = _RangeIndex()
+        self.links = _LinkIndex()
+        for i, subscriber in enumerate(subscribers):
+            bit = 1 << i
+            filters = subscriber.filters
+            self.types.add(bit, filters.get("types", ()))
+            self.authors.add(bit, filters.get("authors", ()))
+            self.domains.add(bit, filters.get("domains", ()))
+            self.numbers.add(bit, filters.get("numbers", ()))
+            self.links.add(bit, filters.get("links", ()))
+        self.numbers.build()
+        self.links.build()
+
+    def chats_of(self, mask):
+        chats = []
+        while mask:
+            low = mask & -mask
+            chats.append(self.chats[low.bit_length() - 1])
+            mask ^= low
+        return chats
+
+
+# ==================== ПОДПИСЧИКИ ====================
+class Subscriber:
+    def __init__(self, chat_id, filters=None):
+        self.chat_id = chat_id
+        self.filters = filters or {}
+
+
+class SubscriberRegistry:
+    """Чаты, получающие события, и их фильтры.
+
+    Подписаться может только владелец или чат из списка authorized.
+    Пустой фильтр по полю пропускает все; фильтры по автору, почте,
+    номеру и задаче действуют только на комментарии. Индекс
+    перестраивается лениво, при первом событии после изменения.
+    """
+
+    def __init__(self, owner, authorized=()):
+        self.owner = owner
+        self.authorized = set(authorized) | {owner}
+        self.subscribers = {owner: Subscriber(owner)}
+        self.index = None
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    def __contains__(self, chat_id):
+        return chat_id in self.subscribers
+
+    def is_authorized(self, chat_id):
+        return chat_id in self.authorized
+
+    def subscribe(self, chat_id):
+        """Подписывает разрешенный чат; False, если он уже подписан или не разрешен"""
+        if chat_id in self.subscribers or not self.is_authorized(chat_id):
+            return False
+        self.subscribers[chat_id] = Subscriber(chat_id)
+        self.index = None
+        logger.info(f"📬 Чат {chat_id} подписался на события")
+        return True
+
+    def unsubscribe(self, chat_id):
+        if self.subscribers.pop(chat_id, None) is None:
+            return False
+        self.index = None
+        logger.info(f"📭 Чат {chat_id} отписался от событий")
+        return True
+
+    def set_filter(self, chat_id, field, values):
+        """Задает фильтр чата по полю; пустой список снимает его"""
+        subscriber = self.subscribers[chat_id]
+        values = parse_filter(field, values)
+        if values:
+            subscriber.filters[field] = values
+        else:
+            subscriber.filters.pop(field, None)
+        self.index = None
+
+    def clear_filters(self, chat_id):
+        self.subscribers[chat_id].filters = {}
+        self.index = None
+
+    def filters(self, chat_id):
+        return self.subscribers[chat_id].filters
+
+    # ---------- сопоставление ----------
+    def match(self, kind, comment=None):
+        """Чаты, которым положено событие kind (comment - данные комментария)"""
+        index = self.index
+        if index is None:
+            index = self.index = _Index(list(self.subscribers.values()))
+        mask = index.types.lookup(kind)
+        if comment is not None and mask:
+            mask &= index.authors.lookup((comment.get('author') or '').lower())
+            mask &= index.domains.lookup(*email_domains(comment.get('email')))
+            mask &= index.numbers.lookup(comment.get('number'))
+            mask &= index.links.lookup(comment.get('link'))
+        return index.chats_of(mask)
+
+    # ---------- снимок состояния ----------
+    def export(self):
+        return [{"chat_id": s.chat_id, "filters": s.filters} for s in self.subscribers.values()]
+
+    def restore(self, items):
+        """Подписки из снимка; чаты, у которых отозвали доступ, отбрасываются"""
+        self.subscribers = {
+            item["chat_id"]: Subscriber(item["chat_id"], item.get("filters") or {})
+            for item in items if self.is_authorized(item["chat_id"])
+        }
+        self.index = None
@@ -0,0 +1,214 @@
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+GLOBAL_RATE = 30          # сообщений в секунду на бота (лимит Telegram)
+PER_CHAT_RATE = 1         # сообщений в секунду в один чат
+PER_CHAT_BURST = 3        # допустимый всплеск в один чат
+MAX_QUEUE = 1000          # сколько вызовов держим в очереди
+WORKERS = 4               # вызовов в разные чаты одновременно
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0        # секунд, удваивается с каждой попыткой
+BACKOFF_MAX = 30.0
+
+
+# ==================== TOKEN BUCKET ====================
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now=None):
+        """Сколько секунд ждать до появления токена (0 - токен есть)"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now=None):
+        """Забирает токен; вызывать после того, как delay() вернул 0"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= 1
+
+
+# ==================== ОЧЕРЕДЬ ОТПРАВКИ В TELEGRAM ====================
+class TelegramSender:
+    """Асинхронная очередь исходящих вызовов Bot API с лимитами и повторами.
+
+    Вызовы ставятся в очередь без блокировки (из цикла или из любого потока),
+    отдельный воркер выполняет их через асинхронный api (AsyncTeleBot или
+    ExecutorBot), соблюдая глобальный и почтовый (per-chat) лимиты,
+    retry_after из ответа 429 и экспоненциальный backoff для сетевых ошибок.
+    У каждого чата своя очередь, воркеры берут чаты из очереди готовых:
+    несколько воркеров шлют в разные чаты параллельно, а в один чат -
+    строго по очереди. Пачка вызовов в один чат занимает один воркер,
+    так что рассылка подписчикам не ждет медленный или занятой чат.
+    """
+
+    def __init__(self, api, global_rate=GLOBAL_RATE, per_chat_rate=PER_CHAT_RATE,
+                 per_chat_burst=PER_CHAT_BURST, max_queue=MAX_QUEUE, max_retries=MAX_RETRIES, on_call=None,
+                 workers=WORKERS):
+        self.api = api
+        # on_call(method, секунды, ошибка или None) - для метрик
+        self.on_call = on_call
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.chat_buckets = {}
+        # chat_id -> deque вызовов; чат есть здесь, пока он в ready или в работе
+        self.chat_queues = {}
+        self.pending = 0
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.ready = None
+        self.loop = None
+        self.workers_count = workers
+        self.workers = []
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "dropped": 0, "rate_limited": 0}
+
+    @property
+    def queue_depth(self):
+        return self.pending
+
+    def start(self):
+        """Запускает воркер в текущем цикле событий"""
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Queue()
+        self.workers = [self.loop.create_task(self._run()) for _ in range(self.workers_count)]
+        logger.info("📮 Очередь отправки в Telegram запущена")
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        for worker in self.workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+
+    # ---------- постановка в очередь ----------
+    def call(self, method, chat_id, *args, **kwargs):
+        """Ставит вызов api.<method>(chat_id, *args, **kwargs) в очередь, не блокируя"""
+        item = (method, chat_id, args, kwargs, 0)
+        if self.loop is None:
+            logger.warning("⚠️ Очередь Telegram не запущена, вызов %s отброшен", method)
+            self.stats["dropped"] += 1
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._put(item)
+        else:
+            self.loop.call_soon_threadsafe(self._put, item)
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.call('send_message', chat_id, text, **kwargs)
+
+    def _put(self, item):
+        if self.pending >= self.max_queue:
+            self.stats["dropped"] += 1
+            logger.warning("⚠️ Очередь Telegram переполнена, вызов %s отброшен", item[0])
+            return
+        chat_id = item[1]
+        self.pending += 1
+        calls = self.chat_queues.get(chat_id)
+        if calls is None:
+            # Чат не ждет в ready и не в работе - ставим его в очередь готовых
+            self.chat_queues[chat_id] = collections.deque([item])
+            self.ready.put_nowait(chat_id)
+        else:
+            calls.append(item)
+
+    # ---------- воркер ----------
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    async def _wait_for_tokens(self, chat_id):
+        chat_bucket = self._chat_bucket(chat_id)
+        while True:
+            wait = max(self.global_bucket.delay(), chat_bucket.delay())
+            if wait <= 0:
+                self.global_bucket.take()
+                chat_bucket.take()
+                return
+            await asyncio.sleep(wait)
+
+    async def _run(self):
+        while True:
+            # Чат в ready не больше одного раза, поэтому вызовы в один чат
+            # выполняются одним воркером в порядке постановки в очередь
+            chat_id = await self.ready.get()
+            calls = self.chat_queues[chat_id]
+            item = calls.popleft()
+            self.pending -= 1
+            try:
+                await self._process(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("❌ Сбой воркера очереди Telegram: %r", e)
+            finally:
+                # Следующий вызов чата - в конец ready, чтобы другие чаты не ждали пачку
+                if calls:
+                    self.ready.put_nowait(chat_id)
+                else:
+                    del self.chat_queues[chat_id]
+
+    async def _process(self, item):
+        method, chat_id, args, kwargs, attempt = item
+        while True:
+            await self._wait_for_tokens(chat_id)
+            started = time.perf_counter()
+            try:
+                result = await getattr(self.api, method)(chat_id, *args, **kwargs)
+                self.stats["sent"] += 1
+                if self.on_call:
+                    self.on_call(method, time.perf_counter() - started, None)
+                return result
+            except Exception as e:
+                if self.on_call:
+                    self.on_call(method, time.perf_counter() - started, e)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    self.stats["failed"] += 1
+                    if "message is not modified" not in str(e):
+                        logger.error("❌ Ошибка вызова Telegram %s: %s", method, e)
+                    return None
+                attempt += 1
+                self.stats["retried"] += 1
+                logger.warning("⏳ Повтор %s через %.1fс (попытка %d): %s", method, delay, attempt, e)
+                await asyncio.sleep(delay)
+
+    def _retry_delay(self, error, attempt):
+        """Задержка перед повтором или None, если повторять не нужно"""
+        if attempt >= self.max_retries:
+            return None
+        code = getattr(error, 'error_code', None)
+        if code == 429:
+            self.stats["rate_limited"] += 1
+            params = (getattr(error, 'result_json', None) or {}).get('parameters') or {}
+            return float(params.get('retry_after', BACKOFF_BASE))
+        if code is not None and 400 <= code < 500:
+            # Ошибка запроса: повтор ничего не изменит
+            return None
+        return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
@@ -0,0 +1,113 @@
+import asyncio
+import hmac
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== НАСТРОЙКИ ====================
+CONCURRENCY = 8           # обработчиков апдейтов одновременно
+MAX_PENDING = 256         # апдейтов ждут обработчика, сверх - 503, и Telegram повторит позже
+MAX_BODY = 1024 * 1024    # байт в теле запроса
+READ_TIMEOUT = 10         # секунд на заголовки и тело запроса
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+               405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+# ==================== ПРИЕМ АПДЕЙТОВ ====================
+class WebhookServer:
+    """HTTP-приемник апдейтов Telegram в цикле событий сервера.
+
+    Telegram присылает апдейт POST-запросом с секретом в заголовке
+    X-Telegram-Bot-Api-Secret-Token. Запрос с неверным секретом получает
+    401. Принятый апдейт сразу получает 200 и обрабатывается в отдельной
+    задаче: не больше concurrency обработчиков одновременно, остальные ждут
+    в порядке прихода. Если ждущих больше max_pending, ответ 503, и Telegram
+    пришлет апдейт снова позже.
+
+    dispatch(update) - корутина, update - разобранный JSON апдейта.
+    """
+
+    def __init__(self, dispatch, host, port, path, secret, concurrency=CONCURRENCY, max_pending=MAX_PENDING):
+        if not secret:
+            raise ValueError("Для webhook нужен секрет")
+        self.dispatch = dispatch
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret = secret.encode()
+        self.slots = asyncio.Semaphore(concurrency)
+        self.max_pending = max_pending
+        self.in_flight = 0
+        self.server = None
+        self.stats = {"accepted": 0, "rejected": 0, "overloaded": 0, "failed": 0}
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"🪝 Webhook Telegram: http://{self.host}:{self.port}{self.path}")
+        return self.port
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            status = await asyncio.wait_for(self._request(reader), READ_TIMEOUT)
+            writer.write(
+                f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode()
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _request(self, reader):
+        parts = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if len(parts) < 2 or parts[1].split('?')[0] != self.path:
+            return 404
+        if parts[0] != 'POST':
+            return 405
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, '').encode('latin-1'), self.secret):
+            self.stats["rejected"] += 1
+            logger.warning("🚫 Webhook: запрос с неверным секретом")
+            return 401
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY:
+            return 413
+        try:
+            update = json.loads(await reader.readexactly(length))
+        except ValueError:
+            return 400
+        if not isinstance(update, dict):
+            return 400
+        if self.in_flight >= self.max_pending:
+            self.stats["overloaded"] += 1
+            return 503
+        self.in_flight += 1
+        self.stats["accepted"] += 1
+        asyncio.ensure_future(self._process(update))
+        return 200
+
+    async def _process(self, update):
+        try:
+            async with self.slots:
+                await self.dispatch(update)
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error("❌ Ошибка обработки апдейта %s: %r", update.get('update_id'), e)
+        finally:
+            self.in_flight -= 1
@@ -1,38 +1,65 @@
 import asyncio
+import html
 import json
 import logging
-import os
-import sys
+import signal
 import threading
+import time
 from datetime import datetime
 
-import telebot
 import websockets
-from dotenv import load_dotenv
-from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
-
-load_dotenv()
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
 
+from analytics import ANALYTICS_BACKEND, COOLDOWN, REPORT_PERIODS, WEEKDAYS, CommentColumns, build_report, render_chart
+from backplane import Broker, BrokerBackplane, ControlBridge, EdgeRelay
+from bot_runtime import ExecutorBot, HandlerTable, LazyApi
+from commands import ACKED, FAILED, NACKED, SENT, CommandTracker
+from config import Config
+from digest import Digest
+from event_store import EventStore
+from flaps import FlapDebouncer
+from log_pipeline import LogPipeline
+from log_setup import LEVELS, LogControl, elapsed_ms, setup_logging
+from metrics import MetricsRegistry, MetricsServer, monitor_loop_lag
+from notifiers import build_notifier
+from protocol import JSON_BACKEND, MessageRouter, dumps, optional
+from recorder import CLOSE, IN, OPEN, OUT, FrameRecorder
+from render_cache import RenderCache
+from scheduler import GRANTED, CommentScheduler
+from seen_cache import SeenCache
+from sessions import Connection, SessionRegistry
+from snapshot import Snapshotter
+from stats_series import WINDOWS, StatsSeries
+from subscribers import EVENT_TYPES, FILTER_FIELDS, SubscriberRegistry
+from telegram_sender import TelegramSender
+from webhook import WebhookServer
 
 # ==================== НАСТРОЙКИ ====================
-TELEGRAM_TOKEN = os.getenv('BOT_TOKEN')  # Замените на токен вашего бота
-YOUR_CHAT_ID = int(os.getenv('CHAT_ID'))  # Замените на ваш chat_id (можно узнать у @userinfobot)
-WEBSOCKET_PORT = 8765
-WEBSOCKET_HOST = "localhost"
+# Запуск скриптом читает .env и аргументы командной строки, импорт - только окружение (см. config.py)
+config = Config.load() if __name__ == "__main__" else Config.from_env()
+COMMAND_SEND_TIMEOUT = 5  # секунд на отправку команды одному клиенту
+WS_CLOSE_TIMEOUT = 2  # секунд ждем закрытия полуоткрытого сокета
 
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    stream=sys.stdout
-)
+# Логирование запускает main() через init_logging(): импорт модуля не трогает корневой логгер
+log_control = LogControl(aliases={"server": __name__})
 logger = logging.getLogger(__name__)
 
+def init_logging():
+    """Запись логов в отдельном потоке: цикл событий только кладет записи в очередь"""
+    setup_logging(
+        level=config.log_level,
+        fmt=config.log_format,
+        path=config.log_file,
+        max_bytes=config.log_file_max_bytes,
+        backups=config.log_file_backups,
+        levels=config.log_levels,
+        control=log_control,
+    )
+
 # ==================== ХРАНИЛИЩЕ СОСТОЯНИЯ ====================
 class State:
     def __init__(self):
-        self.connected_clients = set()
         self.stats = {
             "commented": 0,
             "skipped": 0,
@@ -49,62 +76,222 @@ class State:
         }
         self.last_comment = None
         self.extension_paused = False  # Текущий статус паузы расширения
+        self.loop = None  # Цикл событий WebSocket-сервера (для команд из потока бота)
+        self.version = 0  # Растет при каждом изменении, которое видно на экранах бота
+        self.configured = set()  # Настройки, явно заданные из Telegram (а не значения по умолчанию)
+    
+    def changed(self):
+        self.version += 1
+    
+    def set_setting(self, name, value):
+        """Глобальная настройка, заданная из Telegram: ее получают все новые подключения"""
+        self.settings[name] = value
+        self.configured.add(name)
+        self.changed()
 
 state = State()
+# Подключенные расширения; state.stats - их сводная статистика
+registry = SessionRegistry(state.stats)
+stats_series = StatsSeries()
+event_store = EventStore(config.event_store_path)
+# Уже объявленные комментарии (id, link): повторы после переподключений не уходят в Telegram
+comment_keys = SeenCache()
+# Запись кадров для воспроизведения (bench/replay.py), если задан config.record_path
+recorder = FrameRecorder(config.record_path) if config.record_path else None
+# Комментарии по колонкам для /report; перестраиваются из журнала при запуске
+analytics = CommentColumns()
+# Кому рассылать события: владелец и подписавшиеся разрешенные чаты со своими фильтрами
+subscribers = SubscriberRegistry(config.chat_id, config.subscriber_chats)
+
+# ==================== МЕТРИКИ ====================
+metrics = MetricsRegistry()
+loop_lag = metrics.gauge("hub_event_loop_lag_seconds", "Последняя задержка пробуждения цикла событий")
+loop_lag_histogram = metrics.histogram(
+    "hub_event_loop_lag_histogram_seconds", "Распределение задержки цикла событий",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+handler_duration = metrics.histogram("hub_handler_duration_seconds", "Время обработки сообщения расширения", ["type"])
+telegram_call_duration = metrics.histogram("hub_telegram_call_seconds", "Длительность вызовов Bot API", ["method"])
+telegram_errors = metrics.counter("hub_telegram_errors_total", "Ошибки вызовов Bot API", ["method", "code"])
+disconnect_detection = metrics.histogram(
+    "hub_disconnect_detection_seconds", "От последнего кадра клиента до обнаружения обрыва", ["reason"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+fanout_duration = metrics.histogram("hub_command_fanout_seconds", "Время рассылки команды клиентам", ["command"])
+command_rtt = metrics.histogram("hub_command_rtt_seconds", "Время от команды до подтверждения клиентом")
+slot_decision_duration = metrics.histogram(
+    "hub_comment_slot_decision_seconds", "Время решения по кандидату на комментарий",
+    buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01)
+)
+webhook_duration = metrics.histogram("hub_webhook_update_seconds", "Время обработки апдейта из webhook", ["kind"])
+metrics.counter("hub_commands_total", "Итоги команд клиентам: подтверждены, отклонены, без ответа, повторы", ["result"],
+                callback=lambda: {(k,): v for k, v in commands.stats.items()})
+metrics.counter("hub_messages_received_total", "Принятые сообщения по типам", ["type"],
+                callback=lambda: {(t,): n for t, n in router.received.items()})
+metrics.counter("hub_messages_malformed_total", "Сообщения, не прошедшие схему", ["type"],
+                callback=lambda: {**{(t,): n for t, n in router.malformed.items()},
+                                  ("<json>",): router.decode_errors, ("<unknown>",): router.unknown})
+metrics.gauge("hub_connected_clients", "Подключенные расширения", callback=lambda: len(registry))
+metrics.gauge("hub_telegram_queue_depth", "Уведомлений в очереди отправки (Telegram или NOTIFIER)", callback=lambda: notifier.queue_depth)
+metrics.counter("hub_telegram_calls_total", "Итоги очереди отправки в Telegram", ["result"],
+                callback=lambda: {(k,): v for k, v in notifier.stats.items()})
+metrics.counter("hub_render_cache_total", "Кэш экранов бота: попадания, промахи, пропущенные правки", ["result"],
+                callback=lambda: {("hit",): render_cache.hits, ("miss",): render_cache.misses,
+                                  ("skipped_edit",): render_cache.skipped_edits})
+metrics.counter("hub_extension_logs_total", "Логи расширений: принято, схлопнуто, отброшено, переслано", ["result"],
+                callback=lambda: {(k,): v for k, v in log_pipeline.stats.items()})
+metrics.counter("hub_comment_duplicates_total", "Повторные комментарии, не отправленные в Telegram",
+                callback=lambda: comment_keys.hits)
+metrics.counter("hub_connection_notifications_total", "Уведомления о подключениях по видам", ["kind"],
+                callback=lambda: {(k,): flaps.stats[k] for k in ("connected", "disconnected", "reconnected")})
+metrics.counter("hub_connection_flaps_total", "Обрывы соединений клиентов", callback=lambda: flaps.stats["flaps"])
+metrics.counter("hub_connection_notifications_suppressed_total", "Уведомления, схлопнутые подавлением дребезга",
+                callback=lambda: flaps.stats["suppressed"])
+metrics.gauge("hub_event_store_pending", "Событий ждут записи в журнал", callback=lambda: event_store.pending.qsize())
+
+def observe_telegram_call(method, seconds, error):
+    telegram_call_duration.observe(seconds, method)
+    if error is not None:
+        telegram_errors.inc(method, getattr(error, 'error_code', None) or type(error).__name__)
 
 # ==================== ИНИЦИАЛИЗАЦИЯ БОТА ====================
-bot = telebot.TeleBot(TELEGRAM_TOKEN, parse_mode='HTML')
+def create_api():
+    """Клиент Bot API выбранного режима; telebot импортируется только при первом обращении к api"""
+    if config.bot_runtime == 'async':
+        from telebot import asyncio_helper
+        from telebot.async_telebot import AsyncTeleBot
+        
+        if config.telegram_api_base:
+            asyncio_helper.API_URL = config.telegram_api_base.rstrip('/') + "/bot{0}/{1}"
+        return AsyncTeleBot(config.bot_token, parse_mode='HTML')
+    import telebot
+    from telebot import apihelper
+    
+    if config.telegram_api_base:
+        apihelper.API_URL = config.telegram_api_base.rstrip('/') + "/bot{0}/{1}"
+    # ExecutorBot.bot - сам TeleBot, его polling идет в отдельном потоке
+    return ExecutorBot(telebot.TeleBot(config.bot_token, parse_mode='HTML'))
+
+# api - асинхронный клиент Bot API, которым пользуются все обработчики; создается при первом вызове
+api = LazyApi(create_api)
+
+handlers = HandlerTable()
+message_handler = handlers.message_handler
+callback_query_handler = handlers.callback_query_handler
+
+def create_notifier():
+    """Приемник уведомлений из config.notifier: Telegram или stdout, файл, HTTP (notifiers.py)"""
+    if config.notifier == 'telegram':
+        # Уведомления из цикла WebSocket идут через очередь, чтобы не ждать HTTPS-запросов
+        return TelegramSender(api, on_call=observe_telegram_call)
+    return build_notifier(config.notifier)
+
+notifier = create_notifier()
 
 # ==================== ПОСТОЯННАЯ КЛАВИАТУРА ====================
+# Клавиатуры хранятся уже сериализованными в JSON: telebot передает строку как есть
+render_cache = RenderCache()
+
+SETTINGS_TEXT = (
+    "⚙️ <b>Настройки</b>\n\nИспользуйте кнопки для изменения.\n"
+    "Для точной настройки используйте команды:\n/log, /prob, /autopause, /digest"
+)
+START_TEXT = "👋 <b>Message Finder Bot</b>\n\nВыберите действие:"
+
+def _inline_keyboard(buttons, row_width):
+    """JSON InlineKeyboardMarkup из пар (текст, callback_data) - то же, что InlineKeyboardMarkup.to_json()"""
+    rows = [
+        [{"text": text, "callback_data": data} for text, data in buttons[i:i + row_width]]
+        for i in range(0, len(buttons), row_width)
+    ]
+    return json.dumps({"inline_keyboard": rows})
+
+def _build_main_keyboard(paused):
+    return _inline_keyboard([
+        ("📊 Статистика", "stats"),
+        # Статус кнопки паузы зависит от текущего состояния
+        ("⏸️ Пауза" if not paused else "▶️ Возобновить", "toggle_pause"),
+        ("🔄 Статус", "status"),
+        ("⚙️ Настройки", "settings"),
+    ], row_width=2)
+
+def _build_settings_keyboard(log_level, probability, autopause):
+    return _inline_keyboard([
+        (f"📊 Уровень логов: {log_level}", "cycle_log"),
+        (f"🎲 Вероятность: {probability}%", "cycle_prob"),
+        (f"⏸️ Автопауза: {'вкл' if autopause else 'выкл'}", "toggle_autopause"),
+        ("◀️ Назад", "back_to_start"),
+    ], row_width=1)
+
 def get_main_keyboard():
     """Возвращает постоянную клавиатуру с актуальным статусом"""
-    keyboard = InlineKeyboardMarkup(row_width=2)
-    
-    # Статус кнопки паузы зависит от текущего состояния
-    pause_button = InlineKeyboardButton(
-        "⏸️ Пауза" if not state.extension_paused else "▶️ Возобновить",
-        callback_data="toggle_pause"
-    )
-    
-    keyboard.add(
-        InlineKeyboardButton("📊 Статистика", callback_data="stats"),
-        pause_button,
-        InlineKeyboardButton("🔄 Статус", callback_data="status"),
-        InlineKeyboardButton("⚙️ Настройки", callback_data="settings")
-    )
-    return keyboard
+    paused = state.extension_paused
+    return render_cache.memo(("main", paused), lambda: _build_main_keyboard(paused))
+
+def keyboard_for(chat_id):
+    """Кнопки управления видит только владелец, подписчики получают одни события"""
+    return get_main_keyboard() if chat_id == config.chat_id else None
 
-def update_main_keyboard(chat_id, message_id=None):
-    """Обновляет клавиатуру во всех сообщениях или в конкретном"""
+def get_settings_keyboard():
+    """Клавиатура экрана настроек с текущими значениями"""
+    key = (state.settings['logLevel'], state.settings['commentProbability'], state.settings['autoPauseAfterComment'])
+    return render_cache.memo(("settings",) + key, lambda: _build_settings_keyboard(*key))
+
+async def edit_screen(chat_id, message_id, text, keyboard):
+    """Редактирует сообщение, только если текст или клавиатура изменились; True - если редактировали"""
+    if not render_cache.changed(chat_id, message_id, text, keyboard):
+        return False
     try:
-        if message_id:
-            # Сначала получаем текущее сообщение
-            try:
-                bot.edit_message_reply_markup(
-                    chat_id,
-                    message_id,
-                    reply_markup=get_main_keyboard()
-                )
-            except Exception as e:
-                if "message is not modified" not in str(e):
-                    logger.error(f"Ошибка обновления клавиатуры: {e}")
+        await api.edit_message_text(text, chat_id, message_id, reply_markup=keyboard)
+    except Exception as e:
+        if "message is not modified" not in str(e):
+            raise
+    render_cache.remember(chat_id, message_id, text, keyboard)
+    return True
+
+async def edit_keyboard(chat_id, message_id, keyboard):
+    """Меняет только клавиатуру сообщения, если она отличается от показанной"""
+    if not render_cache.changed(chat_id, message_id, markup=keyboard):
+        return False
+    try:
+        await api.edit_message_reply_markup(chat_id, message_id, reply_markup=keyboard)
+    except Exception as e:
+        if "message is not modified" not in str(e):
+            raise
+    render_cache.remember(chat_id, message_id, markup=keyboard)
+    return True
+
+async def send_screen(chat_id, text, keyboard=None):
+    """Отправляет сообщение и запоминает, что в нем показано"""
+    keyboard = keyboard or get_main_keyboard()
+    msg = await api.send_message(chat_id, text, reply_markup=keyboard)
+    render_cache.remember(chat_id, msg.message_id, text, keyboard)
+    return msg
+
+async def update_main_keyboard(chat_id, message_id=None):
+    """Обновляет клавиатуру в главном сообщении"""
+    if not message_id:
+        return
+    try:
+        await edit_keyboard(chat_id, message_id, get_main_keyboard())
     except Exception as e:
         logger.error(f"Ошибка обновления клавиатуры: {e}")
 
-# ==================== ФОРМАТИРОВАНИЕ СООБЩЕНИЙ ====================
+# ==================== ФОРМАТИРОВАНИЕ ====================
 def format_comment(data):
     """Форматирует данные комментария для отправки в Telegram"""
-    text = data.get('text', '')
-    link = data.get('link', '')
-    number = data.get('number', '?')
-    author = data.get('author', 'Неизвестно')
-    email = data.get('email', '')
+    # Все поля приходят со страницы: экранируем, чтобы не сломать HTML сообщения
+    text = html.escape(str(data.get('text', '')))
+    link = str(data.get('link', ''))
+    number = html.escape(str(data.get('number', '?')))
+    author = html.escape(str(data.get('author', 'Неизвестно')))
+    email = html.escape(str(data.get('email', '')))
     timestamp = datetime.fromtimestamp(data.get('timestamp', 0) / 1000).strftime('%Y-%m-%d %H:%M:%S')
     
-    task_id = link.split('/')[-1] if link else 'Неизвестно'
+    task_id = html.escape(link.split('/')[-1]) if link else 'Неизвестно'
     
     message = f"✅ <b>Прокомментировано сообщение</b>\n\n"
-    message += f"<b>Задача:</b> <a href='{link}'>{task_id}</a>\n"
+    message += f"<b>Задача:</b> <a href='{html.escape(link)}'>{task_id}</a>\n"
     message += f"<b>Номер в скобках:</b> [{number}]\n"
     message += f"<b>Автор сообщения:</b> {author}\n"
     message += f"<b>Email:</b> {email}\n"
@@ -113,8 +300,32 @@ def format_comment(data):
     
     return message
 
-def format_stats():
-    """Форматирует статистику для отправки в Telegram"""
+def format_comment_short(data):
+    """Короткая строка о комментарии для сводки"""
+    link = str(data.get('link', ''))
+    task_id = html.escape(link.split('/')[-1]) if link else 'Неизвестно'
+    author = html.escape(str(data.get('author', 'Неизвестно')))
+    number = html.escape(str(data.get('number', 'N/A')))
+    return f"✅ [{number}] <a href='{html.escape(link)}'>{task_id}</a> — {author}"
+
+def format_rates(window_name):
+    """Скорости работы за окно из временного ряда статистики"""
+    report = stats_series.window_report(WINDOWS[window_name])
+    message = f"📈 <b>За {window_name}</b>\n"
+    message += f"<b>Комментариев в час:</b> {report['commented_per_hour']:.1f} (всего {report['commented']})\n"
+    message += f"<b>Пропущено / игнорировано:</b> {report['skipped']} / {report['ignored']} "
+    message += f"({report['skip_ratio'] * 100:.0f}% пропусков)\n"
+    message += f"<b>Время в ожидании 5 мин:</b> {report['cooldown_share'] * 100:.0f}%\n"
+    if report['queue_last'] is not None:
+        trend = report['queue_last'] - report['queue_first']
+        message += f"<b>Очередь:</b> {report['queue_first']} → {report['queue_last']} ({trend:+d}, макс {report['queue_max']})\n"
+    return message
+
+def format_stats(window_name="1h"):
+    """Форматирует статистику для отправки в Telegram (из кэша, пока состояние не менялось)"""
+    return render_cache.render(("stats", window_name), state.version, lambda: _render_stats(window_name))
+
+def _render_stats(window_name):
     stats = state.stats
     settings = state.settings
     
@@ -126,6 +337,7 @@ def format_stats():
     message += f"<b>В очереди:</b> {stats['queueLength']}\n"
     message += f"<b>Ожидание 5 мин:</b> {'да' if stats['waitingForCooldown'] else 'нет'}\n"
     message += f"<b>Всего сообщений обработано:</b> {stats['messageCounter']}\n\n"
+    message += format_rates(window_name) + "\n"
     
     message += f"⚙️ <b>Текущие настройки</b>\n"
     message += f"<b>Уровень логов:</b> {settings['logLevel']} (0-выкл, 1-осн, 2-отл)\n"
@@ -135,15 +347,51 @@ def format_stats():
     return message
 
 def format_status():
-    """Форматирует статус работы"""
+    """Форматирует статус работы (из кэша, пока состояние не менялось)"""
+    return render_cache.render("status", state.version, _render_status)
+
+def _render_status():
     status = f"🔄 <b>Статус работы</b>\n\n"
     status += f"<b>Расширение:</b> {'⏸️ На паузе' if state.extension_paused else '▶️ Активно'}\n"
-    status += f"<b>Подключение:</b> {'✅ есть' if state.connected_clients else '❌ нет'}\n"
-    if state.connected_clients:
-        status += f"<b>Клиентов подключено:</b> {len(state.connected_clients)}\n"
+    status += f"<b>Подключение:</b> {'✅ есть' if registry else '❌ нет'}\n"
+    if registry:
+        status += f"<b>Клиентов подключено:</b> {len(registry)}\n"
     
     status += f"<b>Ожидание 5 мин:</b> {'да' if state.stats['waitingForCooldown'] else 'нет'}\n"
+    if scheduler is not None:
+        status += (f"<b>Общий кулдаун:</b> ждут слота {len(scheduler)}, "
+                   f"выдано {scheduler.stats['granted']}, снято чужими {scheduler.stats['foreign']}\n")
     status += f"<b>В очереди сообщений:</b> {state.stats['queueLength']}\n"
+    status += f"<b>Очередь Telegram:</b> {notifier.queue_depth}\n"
+    if len(subscribers) > 1:
+        status += f"<b>Подписчиков:</b> {len(subscribers)}\n"
+    
+    if comment_keys.hits:
+        status += f"<b>Повторов комментариев:</b> {comment_keys.hits}\n"
+    if log_pipeline.dropped:
+        status += f"<b>Логов отброшено:</b> {log_pipeline.dropped}\n"
+    if log_control.dropped:
+        status += f"<b>Записей лога сервера отброшено:</b> {log_control.dropped}\n"
+    
+    unconfirmed = commands.stats["timeout"] + commands.stats["nack"]
+    if unconfirmed:
+        status += f"<b>Команд не применено:</b> {unconfirmed} (повторов: {commands.stats['retried']})\n"
+    
+    if router.malformed_total:
+        status += f"<b>Некорректных сообщений:</b> {router.malformed_total}\n"
+    
+    if registry:
+        status += "\n<b>Клиенты:</b>\n"
+        now = time.time()
+        for session in registry.connected:
+            status += (f"<code>{session.short_id}</code>{' @' + session.group if session.group else ''} "
+                       f"{'⏸️' if session.paused else '▶️'} ✅{session.stats['commented']} "
+                       f"очередь {session.stats['queueLength']}, отправок {session.pending_sends}, "
+                       f"{now - session.last_seen:.0f}с назад"
+                       f"{f' на {session.websocket.instance}' if hasattr(session.websocket, 'instance') else ''}"
+                       f"{f', rtt {session.rtt * 1000:.0f}мс' if session.rtt is not None else ''}"
+                       f"{f', команды {session.command_rtt * 1000:.0f}мс' if session.command_rtt is not None else ''}"
+                       f"{'' if session.acks else ', без подтверждений'}\n")
     
     if state.last_comment:
         last_time = datetime.fromtimestamp(state.last_comment['timestamp'] / 1000).strftime('%Y-%m-%d %H:%M:%S')
@@ -152,476 +400,1208 @@ def format_status():
     
     return status
 
-# ==================== ФУНКЦИИ ДЛЯ РАБОТЫ С WEBSOCKET ====================
-async def send_command_to_clients(command):
-    """Отправляет команду всем подключенным клиентам"""
-    if not state.connected_clients:
-        logger.warning("⚠️ Нет подключенных клиентов для отправки команды")
-        return
+def format_event(event):
+    """Одна строка о событии из журнала"""
+    when = datetime.fromtimestamp(event['ts'] / 1000).strftime('%m-%d %H:%M:%S')
+    if event['type'] == 'comment':
+        task_id = event['link'].split('/')[-1] if event['link'] else 'Неизвестно'
+        return (f"{when} ✅ [{event['number']}] <a href='{event['link'] or ''}'>{task_id}</a> — "
+                f"{event['author'] or 'Неизвестно'} {event['email'] or ''}")
+    payload = json.loads(event['payload'])
+    if event['type'] == 'log':
+        return f"{when} 📝 [{payload.get('level', 1)}] {payload.get('message', '')}"
+    if event['type'] == 'status_update':
+        return f"{when} 🔄 {'пауза' if payload.get('paused') else 'активно'}"
+    if event['type'] == 'stats':
+        return f"{when} 📊 commented={payload.get('data', {}).get('commented', 0)}"
+    return f"{when} {event['type']}"
+
+def format_events(title, events):
+    if not events:
+        return f"{title}\n\nНичего не найдено."
+    return f"{title}\n\n" + "\n".join(format_event(event) for event in events)
+
+BARS = "▁▂▃▄▅▆▇█"
+
+def format_bars(values):
+    """Гистограмма одной строкой символов разной высоты"""
+    peak = max(values) or 1
+    return "".join(BARS[min(len(BARS) - 1, value * len(BARS) // (peak + 1))] if value else " " for value in values)
+
+def format_top(title, items):
+    if not items:
+        return ""
+    return f"\n<b>{title}:</b>\n" + "\n".join(f"  {name} — {count}" for name, count in items) + "\n"
+
+def format_report(period, report):
+    text = f"📈 <b>Отчет за {period}</b>\n\n<b>Комментариев:</b> {report['total']}\n"
+    if not report['total']:
+        return text
+    first = datetime.fromtimestamp(report['first'] / 1000).strftime('%Y-%m-%d %H:%M')
+    last = datetime.fromtimestamp(report['last'] / 1000).strftime('%Y-%m-%d %H:%M')
+    text += f"<b>С</b> {first} <b>по</b> {last}\n"
+    text += format_top("Авторы", report['authors'])
+    text += format_top("Почта", report['emails'])
+    text += format_top("Номера", [(f"[{number}]", count) for number, count in report['numbers']])
     
-    disconnected = set()
-    for client in state.connected_clients:
-        try:
-            await client.send(json.dumps(command))
-            logger.info(f"📤 Отправлена команда клиенту: {command['type']}")
-        except Exception as e:
-            logger.error(f"❌ Ошибка отправки команды: {e}")
-            disconnected.add(client)
-    
-    state.connected_clients -= disconnected
-
-def send_command_sync(command):
-    """Синхронная обертка для отправки команд (для вызова из потоков)"""
-    if not state.connected_clients:
-        logger.warning("⚠️ Нет подключенных клиентов для отправки команды")
-        return False
+    peak_hour = max(range(24), key=report['hours'].__getitem__)
+    text += f"\n<b>По часам</b> (0-23, пик в {peak_hour}:00):\n<code>{format_bars(report['hours'])}</code>\n"
+    text += "<b>По дням:</b> " + ", ".join(f"{day} {count}" for day, count in zip(WEEKDAYS, report['weekdays'])) + "\n"
     
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    intervals = report['intervals']
+    if intervals['count']:
+        text += (f"\n<b>Интервалы</b> ({intervals['count']}): медиана {intervals['median'] / 60:.1f} мин, "
+                 f"90% до {intervals['p90'] / 60:.1f} мин\n"
+                 f"<b>Быстрее паузы {COOLDOWN // 60} мин:</b> {intervals['faster']}\n"
+                 f"<b>Сразу после паузы:</b> {intervals['near']}\n")
+    text += f"\n<i>Посчитано за {report['elapsed_ms']:.0f}мс ({ANALYTICS_BACKEND})</i>"
+    return text
+
+# ==================== ФУНКЦИИ ДЛЯ РАБОТЫ С WEBSOCKET ====================
+COMMAND_SETTINGS = {
+    "setLogLevel": ("logLevel", "level"),
+    "setProbability": ("commentProbability", "value"),
+    "setAutoPause": ("autoPauseAfterComment", "value"),
+}
+
+def remember_command(session, command, answer=None):
+    """Запоминает, что применил клиент: паузу и настройки"""
+    if command['type'] in ('pause', 'resume'):
+        session.paused = command['type'] == 'pause'
+    elif command['type'] in COMMAND_SETTINGS:
+        setting, field = COMMAND_SETTINGS[command['type']]
+        session.settings[setting] = command[field]
+    if answer and answer.get('state'):
+        # В ack клиент сообщает, что у него в итоге установлено
+        session.applied = answer['state']
+        session.paused = bool(answer['state'].get('paused', session.paused))
+    state.changed()
+
+async def _send_to_client(session, payload, timeout):
+    """Отправляет готовый payload одному клиенту с таймаутом"""
+    session.pending_sends += 1
     try:
-        loop.run_until_complete(send_command_to_clients(command))
+        if recorder:
+            recorder.record(OUT, session.websocket, payload)
+        await asyncio.wait_for(session.websocket.send(payload), timeout)
         return True
     except Exception as e:
-        logger.error(f"❌ Ошибка отправки команды: {e}")
+        logger.error("❌ Ошибка отправки клиенту %s: %r", session.short_id, e, extra={"client": session.client_id})
         return False
     finally:
-        loop.close()
+        session.pending_sends -= 1
+
+# Команды клиентам с id запроса: ждем ack/nack, без ответа - повторяем
+commands = CommandTracker(_send_to_client, on_rtt=command_rtt.observe)
+
+def send_slot_decision(client_id, candidate_id, decision):
+    """Решение планировщика по кандидату - вкладке, которая его прислала"""
+    session = registry.by_id.get(client_id)
+    logger.info("🎟️ Кандидат %s клиента %s: %s", candidate_id, session.short_id if session else client_id, decision,
+                extra={"client": client_id, "type": "slot"})
+    state.changed()
+    if session is not None and session.online:
+        payload = dumps({"type": "slot", "candidateId": candidate_id, "granted": decision == GRANTED, "reason": decision})
+        asyncio.ensure_future(_send_to_client(session, payload, COMMAND_SEND_TIMEOUT))
+
+# Общий кулдаун комментариев для всех вкладок, если включен COMMENT_SCHEDULER
+scheduler = CommentScheduler(send_slot_decision, cooldown=config.comment_cooldown) if config.comment_scheduler else None
+if scheduler is not None:
+    metrics.counter("hub_comment_slots_total", "Решения по кандидатам на комментарий", ["decision"],
+                    callback=lambda: {(k,): v for k, v in scheduler.stats.items()})
+    metrics.gauge("hub_comment_candidates_waiting", "Кандидаты, ждущие слота", callback=lambda: len(scheduler))
+
+async def send_command_to_clients(command, timeout=COMMAND_SEND_TIMEOUT, target=None):
+    """Параллельно выполняет команду у клиентов по адресу, возвращает {client_id: успех}.
+
+    Успех - клиент подтвердил, что применил команду (или, если он не умеет
+    подтверждать, команда записана в его сокет).
+    """
+    sessions = registry.resolve(target)
+    if not sessions:
+        logger.warning("⚠️ Нет подключенных клиентов для отправки команды (адрес: %s)", target or 'all')
+        return {}
+    
+    started = time.perf_counter()
+    results = await asyncio.gather(*(commands.execute(session, command, timeout) for session in sessions))
+    fanout_duration.observe(time.perf_counter() - started, command['type'])
+    latency = elapsed_ms(started)
+    
+    report = {}
+    for session, (result, answer) in zip(sessions, results):
+        ok = result in (ACKED, SENT)
+        report[session.client_id] = ok
+        if ok:
+            remember_command(session, command, answer)
+            logger.debug("Команда %s выполнена клиентом %s (%s)", command['type'], session.short_id, result,
+                         extra={"client": session.client_id, "command": command['type']})
+        elif result != FAILED:
+            logger.warning("⚠️ Клиент %s не применил команду %s: %s%s", session.short_id, command['type'], result,
+                           f" ({answer['error']})" if answer and answer.get('error') else "",
+                           extra={"client": session.client_id, "command": command['type']})
+        elif session.websocket is not None:
+            # Зависший или отвалившийся клиент не должен тормозить следующие команды
+            websocket = session.websocket
+            registry.disconnect(session)
+            state.changed()
+            asyncio.ensure_future(websocket.close())
+    
+    logger.info("📤 Команда %s выполнена %d/%d клиентами", command['type'], sum(report.values()), len(sessions),
+                extra={"command": command['type'], "target": target, "latency_ms": latency})
+    return report
+
+async def send_command(command, target=None):
+    """Отправка команды из обработчика в цикле; True, если хоть один клиент ее получил"""
+    results = await send_command_to_clients(command, target=target)
+    return any(results.values())
+
+async def _reply(websocket, payload):
+    if recorder:
+        recorder.record(OUT, websocket, payload)
+    try:
+        await asyncio.wait_for(websocket.send(payload), COMMAND_SEND_TIMEOUT)
+    except Exception as e:
+        logger.debug("Ответ клиенту не отправлен: %r", e)
+
+def reply(conn, message):
+    """Ответ клиенту из обработчика сообщения, не дожидаясь отправки"""
+    asyncio.ensure_future(_reply(conn.websocket, dumps(message)))
+
+# ==================== УВЕДОМЛЕНИЯ И СВОДКИ ====================
+DIGEST_LABELS = {"comment": "комментариев", "debug": "отладка"}
+
+def send_digest(chat_id, chunks):
+    """Отправляет сводку; клавиатура только под последней частью"""
+    for i, chunk in enumerate(chunks):
+        if i == len(chunks) - 1:
+            notifier.send_message(chat_id, chunk, reply_markup=keyboard_for(chat_id))
+        else:
+            notifier.send_message(chat_id, chunk)
+
+# Сводка владельца хранит общие настройки; у каждого подписчика сводка своя
+digest = Digest(lambda chunks: send_digest(config.chat_id, chunks), DIGEST_LABELS)
+digests = {config.chat_id: digest}
+
+def chat_digest(chat_id):
+    chat = digests.get(chat_id)
+    if chat is None:
+        chat = digests[chat_id] = Digest(
+            lambda chunks: send_digest(chat_id, chunks), DIGEST_LABELS, digest.window, digest.max_events
+        )
+        chat.enabled = digest.enabled
+    return chat
+
+def broadcast(kind, text, comment=None):
+    """Рассылает событие чатам, чьи фильтры его пропускают; отправки идут параллельно"""
+    for chat_id in subscribers.match(kind, comment):
+        notifier.send_message(chat_id, text, reply_markup=keyboard_for(chat_id))
+
+def forward_log(client, level, message, count):
+    """Пересылает выгруженную запись лога расширения в Telegram"""
+    suffix = f" ×{count}" if count > 1 else ""
+    client, message = html.escape(str(client)), html.escape(str(message))
+    notify_event(
+        "debug",
+        f"🔍 <b>Отладка</b> <code>{client}</code>{suffix}:\n<code>{message}</code>",
+        f"🔍 <code>{message}</code>{suffix}"
+    )
+
+log_pipeline = LogPipeline(forward_log)
+
+def notify_connection(kind, text):
+    broadcast("connection", f"{text}\nКлиентов: {len(registry)}")
+
+# Подключения и обрывы объявляются с задержкой, чтобы шторм переподключений дал одно сообщение
+flaps = FlapDebouncer(notify_connection, config.flap_grace)
+
+def notify_event(kind, text, short_text=None, comment=None):
+    """Отправляет событие подписчикам сразу или копит его в их сводки, если они включены"""
+    for chat_id in subscribers.match(kind, comment):
+        if not chat_digest(chat_id).add(kind, short_text or text):
+            notifier.send_message(chat_id, text, reply_markup=keyboard_for(chat_id))
 
 # ==================== ОБРАБОТЧИКИ КОМАНД TELEGRAM ====================
-@bot.message_handler(commands=['start'])
-def start_command(message):
-    if message.chat.id != YOUR_CHAT_ID:
-        bot.reply_to(message, "Извините, этот бот только для личного использования.")
+def command_target(args, position):
+    """Адрес команды из аргументов: None - все клиенты"""
+    if len(args) < position:
+        return None
+    target = args[position - 1]
+    return None if target.lower() == 'all' else target
+
+def format_target(target):
+    return f" ({target})" if target else ""
+
+@message_handler(commands=['start'])
+async def start_command(message):
+    if not subscribers.is_authorized(message.chat.id):
+        await api.reply_to(message, "Извините, этот бот только для личного использования.")
+        return
+    if subscribers.subscribe(message.chat.id):
+        state.changed()
+    if message.chat.id != config.chat_id:
+        await api.send_message(
+            message.chat.id,
+            "👋 <b>Message Finder Bot</b>\n\n"
+            "Чат подписан на события расширения.\n\n"
+            "/filter - фильтры событий\n"
+            "/stop - отписаться"
+        )
         return
     
-    msg = bot.send_message(
+    msg = await send_screen(
         message.chat.id,
         "👋 <b>Message Finder Bot</b>\n\n"
         "Я бот для управления расширением Message Finder.\n"
         "Постоянная клавиатура всегда под сообщениями.\n\n"
         "Команды:\n"
-        "/stats - статистика\n"
-        "/pause - пауза\n"
-        "/resume - возобновить\n"
+        "/stats [15m|1h|6h|24h|7d] - статистика\n"
+        "/pause [клиент|@группа] - пауза\n"
+        "/resume [клиент|@группа] - возобновить\n"
         "/status - статус\n"
         "/log [0|1|2] - уровень логов\n"
         "/prob [0-100] - вероятность\n"
         "/autopause [on|off] - автопауза\n"
-        "/help - помощь",
-        reply_markup=get_main_keyboard()
+        "/digest [on|off|сек] [N] - сводки\n"
+        "/history [N] - последние комментарии\n"
+        "/find [email|автор|номер] - поиск\n"
+        "/last [N] - последние события\n"
+        "/report [24h|7d|30d|365d|all] [chart] - отчет\n"
+        "/filter - фильтры событий\n"
+        "/stop - отписаться от событий\n"
+        "/help - помощь"
     )
     
     # Сохраняем ID сообщения для будущих обновлений клавиатуры
     state.main_message_id = msg.message_id
+    state.changed()
 
-@bot.message_handler(commands=['stats'])
-def stats_command(message):
-    if message.chat.id != YOUR_CHAT_ID:
+@message_handler(commands=['stats'])
+async def stats_command(message):
+    if message.chat.id != config.chat_id:
         return
-    bot.send_message(message.chat.id, format_stats(), reply_markup=get_main_keyboard())
+    args = message.text.split()
+    window_name = args[1] if len(args) > 1 else "1h"
+    if window_name not in WINDOWS:
+        await api.reply_to(message, f"Использование: /stats [{'|'.join(WINDOWS)}]", reply_markup=get_main_keyboard())
+        return
+    await send_screen(message.chat.id, format_stats(window_name))
 
-@bot.message_handler(commands=['pause'])
-def pause_command(message):
-    if message.chat.id != YOUR_CHAT_ID:
+@message_handler(commands=['pause'])
+async def pause_command(message):
+    if message.chat.id != config.chat_id:
         return
     
-    logger.info("⏸️ Получена команда паузы")
-    if send_command_sync({"type": "pause"}):
-        state.extension_paused = True
-        bot.send_message(message.chat.id, "⏸️ Расширение поставлено на паузу.", reply_markup=get_main_keyboard())
+    target = command_target(message.text.split(), 2)
+    logger.info(f"⏸️ Получена команда паузы (адрес: {target or 'all'})")
+    if await send_command({"type": "pause"}, target=target):
+        if target is None:
+            state.extension_paused = True
+            state.changed()
+        await api.send_message(message.chat.id, f"⏸️ Расширение поставлено на паузу{format_target(target)}.", reply_markup=get_main_keyboard())
         # Обновляем клавиатуру в главном сообщении
         if hasattr(state, 'main_message_id'):
-            update_main_keyboard(message.chat.id, state.main_message_id)
+            await update_main_keyboard(message.chat.id, state.main_message_id)
     else:
-        bot.send_message(message.chat.id, "❌ Нет подключенного расширения.", reply_markup=get_main_keyboard())
+        await api.send_message(message.chat.id, "❌ Нет подключенного расширения.", reply_markup=get_main_keyboard())
 
-@bot.message_handler(commands=['resume'])
-def resume_command(message):
-    if message.chat.id != YOUR_CHAT_ID:
+@message_handler(commands=['resume'])
+async def resume_command(message):
+    if message.chat.id != config.chat_id:
         return
     
-    logger.info("▶️ Получена команда возобновления")
-    if send_command_sync({"type": "resume"}):
-        state.extension_paused = False
-        bot.send_message(message.chat.id, "▶️ Работа расширения возобновлена.", reply_markup=get_main_keyboard())
+    target = command_target(message.text.split(), 2)
+    logger.info(f"▶️ Получена команда возобновления (адрес: {target or 'all'})")
+    if await send_command({"type": "resume"}, target=target):
+        if target is None:
+            state.extension_paused = False
+            state.changed()
+        await api.send_message(message.chat.id, f"▶️ Работа расширения возобновлена{format_target(target)}.", reply_markup=get_main_keyboard())
         # Обновляем клавиатуру в главном сообщении
         if hasattr(state, 'main_message_id'):
-            update_main_keyboard(message.chat.id, state.main_message_id)
+            await update_main_keyboard(message.chat.id, state.main_message_id)
     else:
-        bot.send_message(message.chat.id, "❌ Нет подключенного расширения.", reply_markup=get_main_keyboard())
+        await api.send_message(message.chat.id, "❌ Нет подключенного расширения.", reply_markup=get_main_keyboard())
 
-@bot.message_handler(commands=['status'])
-def status_command(message):
-    if message.chat.id != YOUR_CHAT_ID:
+@message_handler(commands=['status'])
+async def status_command(message):
+    if message.chat.id != config.chat_id:
         return
-    bot.send_message(message.chat.id, format_status(), reply_markup=get_main_keyboard())
+    await send_screen(message.chat.id, format_status())
 
-@bot.message_handler(commands=['log'])
-def log_command(message):
-    if message.chat.id != YOUR_CHAT_ID:
+@message_handler(commands=['log'])
+async def log_command(message):
+    if message.chat.id != config.chat_id:
         return
     
     try:
         args = message.text.split()
-        if len(args) != 2:
-            bot.reply_to(message, "Использование: /log [0|1|2]", reply_markup=get_main_keyboard())
+        if len(args) not in (2, 3):
+            await api.reply_to(message, "Использование: /log [0|1|2] [клиент|@группа]", reply_markup=get_main_keyboard())
             return
         
         level = int(args[1])
+        target = command_target(args, 3)
         if level in [0, 1, 2]:
-            state.settings['logLevel'] = level
-            send_command_sync({"type": "setLogLevel", "level": level})
-            bot.reply_to(message, f"✅ Уровень логирования установлен: {level}", reply_markup=get_main_keyboard())
+            if target is None:
+                state.set_setting('logLevel', level)
+            await send_command({"type": "setLogLevel", "level": level}, target=target)
+            await api.reply_to(message, f"✅ Уровень логирования установлен{format_target(target)}: {level}", reply_markup=get_main_keyboard())
         else:
-            bot.reply_to(message, "Использование: /log [0|1|2]", reply_markup=get_main_keyboard())
+            await api.reply_to(message, "Использование: /log [0|1|2]", reply_markup=get_main_keyboard())
     except ValueError:
-        bot.reply_to(message, "Использование: /log [0|1|2]", reply_markup=get_main_keyboard())
+        await api.reply_to(message, "Использование: /log [0|1|2]", reply_markup=get_main_keyboard())
 
-@bot.message_handler(commands=['prob'])
-def prob_command(message):
-    if message.chat.id != YOUR_CHAT_ID:
+@message_handler(commands=['prob'])
+async def prob_command(message):
+    if message.chat.id != config.chat_id:
         return
     
     try:
         args = message.text.split()
-        if len(args) != 2:
-            bot.reply_to(message, "Использование: /prob [0-100]", reply_markup=get_main_keyboard())
+        if len(args) not in (2, 3):
+            await api.reply_to(message, "Использование: /prob [0-100] [клиент|@группа]", reply_markup=get_main_keyboard())
             return
         
         prob = int(args[1])
+        target = command_target(args, 3)
         if 0 <= prob <= 100:
-            state.settings['commentProbability'] = prob
-            send_command_sync({"type": "setProbability", "value": prob})
-            bot.reply_to(message, f"✅ Вероятность комментирования установлена: {prob}%", reply_markup=get_main_keyboard())
+            if target is None:
+                state.set_setting('commentProbability', prob)
+            await send_command({"type": "setProbability", "value": prob}, target=target)
+            await api.reply_to(message, f"✅ Вероятность комментирования установлена{format_target(target)}: {prob}%", reply_markup=get_main_keyboard())
         else:
-            bot.reply_to(message, "Использование: /prob [0-100]", reply_markup=get_main_keyboard())
+            await api.reply_to(message, "Использование: /prob [0-100]", reply_markup=get_main_keyboard())
     except ValueError:
-        bot.reply_to(message, "Использование: /prob [0-100]", reply_markup=get_main_keyboard())
+        await api.reply_to(message, "Использование: /prob [0-100]", reply_markup=get_main_keyboard())
 
-@bot.message_handler(commands=['autopause'])
-def autopause_command(message):
-    if message.chat.id != YOUR_CHAT_ID:
+@message_handler(commands=['autopause'])
+async def autopause_command(message):
+    if message.chat.id != config.chat_id:
         return
     
     try:
         args = message.text.split()
-        if len(args) != 2:
-            bot.reply_to(message, "Использование: /autopause [on|off]", reply_markup=get_main_keyboard())
+        if len(args) not in (2, 3):
+            await api.reply_to(message, "Использование: /autopause [on|off] [клиент|@группа]", reply_markup=get_main_keyboard())
             return
         
         arg = args[1].lower()
+        target = command_target(args, 3)
         if arg in ['on', 'off']:
             value = (arg == 'on')
-            state.settings['autoPauseAfterComment'] = value
-            send_command_sync({"type": "setAutoPause", "value": value})
-            bot.reply_to(message, f"✅ Автопауза после комментария: {'вкл' if value else 'выкл'}", reply_markup=get_main_keyboard())
+            if target is None:
+                state.set_setting('autoPauseAfterComment', value)
+            await send_command({"type": "setAutoPause", "value": value}, target=target)
+            await api.reply_to(message, f"✅ Автопауза после комментария{format_target(target)}: {'вкл' if value else 'выкл'}", reply_markup=get_main_keyboard())
         else:
-            bot.reply_to(message, "Использование: /autopause [on|off]", reply_markup=get_main_keyboard())
+            await api.reply_to(message, "Использование: /autopause [on|off]", reply_markup=get_main_keyboard())
     except:
-        bot.reply_to(message, "Использование: /autopause [on|off]", reply_markup=get_main_keyboard())
+        await api.reply_to(message, "Использование: /autopause [on|off]", reply_markup=get_main_keyboard())
+
+@message_handler(commands=['digest'])
+async def digest_command(message):
+    if message.chat.id != config.chat_id:
+        return
+    
+    usage = "Использование: /digest [on|off|сек] [N]\nНапример: /digest 10 30 - окно 10с, не больше 30 событий"
+    args = message.text.split()[1:]
+    if not args:
+        await api.reply_to(
+            message,
+            f"📦 Сводки: {'вкл' if digest.enabled else 'выкл'}, окно {digest.window}с, до {digest.max_events} событий\n\n{usage}",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    try:
+        if args[0].lower() in ['on', 'off']:
+            enabled, window = args[0].lower() == 'on', None
+        else:
+            enabled, window = True, int(args[0])
+        max_events = int(args[1]) if len(args) > 1 else None
+    except ValueError:
+        await api.reply_to(message, usage, reply_markup=get_main_keyboard())
+        return
+    
+    if (window is not None and not 1 <= window <= 600) or (max_events is not None and max_events < 1):
+        await api.reply_to(message, usage, reply_markup=get_main_keyboard())
+        return
+    
+    for chat in digests.values():
+        chat.configure(enabled, window, max_events)
+    state.changed()
+    await api.reply_to(
+        message,
+        f"✅ Сводки: {'вкл' if enabled else 'выкл'}"
+        + (f", окно {window}с" if window else "")
+        + (f", до {max_events} событий" if max_events else ""),
+        reply_markup=get_main_keyboard()
+    )
+
+def parse_limit(message, default=10, maximum=50):
+    """Достает необязательное N из команды вида /cmd N"""
+    args = message.text.split()
+    if len(args) < 2:
+        return default
+    return max(1, min(maximum, int(args[1])))
+
+@message_handler(commands=['history'])
+async def history_command(message):
+    if message.chat.id != config.chat_id:
+        return
+    
+    try:
+        limit = parse_limit(message)
+    except ValueError:
+        await api.reply_to(message, "Использование: /history [N]", reply_markup=get_main_keyboard())
+        return
+    events = await asyncio.to_thread(event_store.last, limit, 'comment')
+    await api.send_message(
+        message.chat.id,
+        format_events(f"🗂 <b>Последние комментарии ({len(events)})</b>", events),
+        reply_markup=get_main_keyboard(),
+        disable_web_page_preview=True
+    )
+
+@message_handler(commands=['last'])
+async def last_command(message):
+    if message.chat.id != config.chat_id:
+        return
+    
+    try:
+        limit = parse_limit(message)
+    except ValueError:
+        await api.reply_to(message, "Использование: /last [N]", reply_markup=get_main_keyboard())
+        return
+    events = await asyncio.to_thread(event_store.last, limit)
+    await api.send_message(
+        message.chat.id,
+        format_events(f"🗂 <b>Последние события ({len(events)})</b>", events),
+        reply_markup=get_main_keyboard(),
+        disable_web_page_preview=True
+    )
+
+@message_handler(commands=['find'])
+async def find_command(message):
+    if message.chat.id != config.chat_id:
+        return
+    
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        await api.reply_to(message, "Использование: /find [email|автор|номер]", reply_markup=get_main_keyboard())
+        return
+    
+    if '@' in query:
+        events = await asyncio.to_thread(event_store.find_email, query)
+    elif query.strip('[]').isdigit():
+        events = await asyncio.to_thread(event_store.find_number, int(query.strip('[]')))
+    else:
+        events = await asyncio.to_thread(event_store.find_author, query)
+    await api.send_message(
+        message.chat.id,
+        format_events(f"🔎 <b>Поиск:</b> {query}", events),
+        reply_markup=get_main_keyboard(),
+        disable_web_page_preview=True
+    )
 
-@bot.message_handler(commands=['help'])
-def help_command(message):
-    if message.chat.id != YOUR_CHAT_ID:
+@message_handler(commands=['report'])
+async def report_command(message):
+    if message.chat.id != config.chat_id:
+        return
+    
+    args = message.text.lower().split()[1:]
+    periods = [arg for arg in args if arg in REPORT_PERIODS]
+    if len(periods) > 1 or any(arg not in REPORT_PERIODS and arg != 'chart' for arg in args):
+        await api.reply_to(message, f"Использование: /report [{'|'.join(REPORT_PERIODS)}] [chart]", reply_markup=get_main_keyboard())
+        return
+    period = periods[0] if periods else "7d"
+    
+    # Копия колонок снимается в цикле, считается отчет в пуле потоков
+    report = await asyncio.to_thread(build_report, analytics.snapshot(REPORT_PERIODS[period]))
+    await api.send_message(message.chat.id, format_report(period, report), reply_markup=get_main_keyboard())
+    if 'chart' in args and report['total']:
+        chart = await asyncio.to_thread(render_chart, report, f"Отчет за {period}")
+        if chart is None:
+            await api.send_message(message.chat.id, "📉 График недоступен: не установлен matplotlib.")
+        else:
+            await api.send_photo(message.chat.id, chart)
+
+@message_handler(commands=['loglevel'])
+async def loglevel_command(message):
+    if message.chat.id != config.chat_id:
+        return
+    
+    args = message.text.split()[1:]
+    usage = f"Использование: /loglevel [модуль] [{'|'.join(LEVELS)}]\nМодуль: root, server, telegram_sender, sessions, ..."
+    if len(args) > 2:
+        await api.reply_to(message, usage, reply_markup=get_main_keyboard())
+        return
+    if args:
+        name, level = (args[0], args[1]) if len(args) == 2 else ("root", args[0])
+        try:
+            log_control.set_level(name, level)
+        except ValueError as e:
+            await api.reply_to(message, f"❌ {e}\n\n{usage}", reply_markup=get_main_keyboard())
+            return
+        logger.warning("🪵 Уровень логов %s: %s", name, level.upper())
+    
+    levels = "\n".join(f"<code>{name}</code>: {level}" for name, level in log_control.levels().items())
+    await api.send_message(
+        message.chat.id,
+        f"🪵 <b>Уровни логов сервера</b>\n\n{levels}\n\nВ очереди записи: {log_control.pending}, отброшено: {log_control.dropped}",
+        reply_markup=get_main_keyboard()
+    )
+
+@message_handler(commands=['help'])
+async def help_command(message):
+    if message.chat.id != config.chat_id:
         return
     
     help_text = (
         "📚 <b>Доступные команды:</b>\n\n"
         "/start - начать работу\n"
-        "/stats - статистика\n"
-        "/pause - поставить на паузу\n"
-        "/resume - возобновить работу\n"
+        "/stats [15m|1h|6h|24h|7d] - статистика и скорости за окно\n"
+        "/pause [клиент|@группа] - поставить на паузу\n"
+        "/resume [клиент|@группа] - возобновить работу\n"
         "/status - статус работы\n"
         "/log [0|1|2] - уровень логов\n"
         "/prob [0-100] - вероятность комментирования\n"
         "/autopause [on|off] - автопауза после комментария\n"
+        "/digest [on|off|сек] [N] - объединять комментарии и отладку в сводки\n"
+        "/history [N] - последние N комментариев\n"
+        "/find [email|автор|номер] - поиск по журналу\n"
+        "/last [N] - последние N событий любого типа\n"
+        "/report [24h|7d|30d|365d|all] [chart] - отчет по истории комментариев, chart - с графиком\n"
+        "/loglevel [модуль] [DEBUG|INFO|WARNING|ERROR] - уровни логов сервера\n"
+        "/filter [поле] [значения] - фильтры событий этого чата\n"
+        "/stop - отписаться от событий (/start - подписаться снова)\n"
         "/help - эта справка\n\n"
+        "Команды управления принимают необязательный адрес: короткий id клиента из /status, "
+        "@группа или all (по умолчанию).\n"
         "Постоянная клавиатура всегда под сообщениями."
     )
-    bot.send_message(message.chat.id, help_text, reply_markup=get_main_keyboard())
+    await api.send_message(message.chat.id, help_text, reply_markup=get_main_keyboard())
+
+FILTER_ALIASES = {"author": "authors", "domain": "domains", "number": "numbers", "link": "links", "type": "types"}
+FILTER_USAGE = (
+    "Использование:\n"
+    "/filter - текущие фильтры\n"
+    "/filter author Иван Петров, Анна - авторы (через запятую)\n"
+    "/filter domain example.com - домены почты\n"
+    "/filter number 1-5 10 - номера в скобках\n"
+    "/filter link QUEUE-* QUEUE-12 - задачи\n"
+    f"/filter type {' '.join(EVENT_TYPES)} - типы событий\n"
+    "/filter author - снять фильтр по полю, /filter clear - снять все"
+)
+
+def format_filters(chat_id):
+    filters = subscribers.filters(chat_id)
+    if not filters:
+        return "🔔 Фильтров нет: приходят все события."
+    lines = ["🔔 <b>Фильтры событий</b>"]
+    for field, title in FILTER_FIELDS.items():
+        if field in filters:
+            if field == "numbers":
+                values = [str(low) if low == high else f"{low}-{high}" for low, high in filters[field]]
+            else:
+                values = filters[field]
+            lines.append(f"<b>{title}:</b> {', '.join(values)}")
+    return "\n".join(lines)
+
+@message_handler(commands=['filter'])
+async def filter_command(message):
+    chat_id = message.chat.id
+    if chat_id not in subscribers:
+        if subscribers.is_authorized(chat_id):
+            await api.reply_to(message, "Чат не подписан на события: /start")
+        return
+    
+    args = message.text.split(maxsplit=2)
+    if len(args) == 1:
+        await api.send_message(chat_id, f"{format_filters(chat_id)}\n\n{FILTER_USAGE}", reply_markup=keyboard_for(chat_id))
+        return
+    
+    field = args[1].lower()
+    if field == 'clear':
+        subscribers.clear_filters(chat_id)
+    else:
+        field = FILTER_ALIASES.get(field, field)
+        rest = args[2] if len(args) > 2 else ""
+        values = [value.strip() for value in rest.split(',')] if ',' in rest else rest.split()
+        try:
+            subscribers.set_filter(chat_id, field, [value for value in values if value])
+        except ValueError as e:
+            await api.reply_to(message, f"❌ {e}\n\n{FILTER_USAGE}", reply_markup=keyboard_for(chat_id))
+            return
+    state.changed()
+    await api.send_message(chat_id, format_filters(chat_id), reply_markup=keyboard_for(chat_id))
+
+@message_handler(commands=['stop'])
+async def stop_command(message):
+    if subscribers.unsubscribe(message.chat.id):
+        state.changed()
+        await api.send_message(message.chat.id, "📭 Чат отписан от событий. /start - подписаться снова.")
 
 # ==================== ОБРАБОТЧИКИ INLINE-КНОПОК ====================
-@bot.callback_query_handler(func=lambda call: True)
-def callback_handler(call):
-    if call.message.chat.id != YOUR_CHAT_ID:
+@callback_query_handler(func=lambda call: True)
+async def callback_handler(call):
+    if call.message.chat.id != config.chat_id:
         return
     
-    # Получаем текущий текст сообщения
-    current_text = call.message.text
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
     
     if call.data == "stats":
-        new_text = format_stats()
-        if new_text != current_text:
-            bot.edit_message_text(
-                new_text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=get_main_keyboard()
-            )
+        if await edit_screen(chat_id, message_id, format_stats(), get_main_keyboard()):
+            await api.answer_callback_query(call.id)
         else:
-            bot.answer_callback_query(call.id, "📊 Статистика уже актуальна")
+            await api.answer_callback_query(call.id, "📊 Статистика уже актуальна")
     
     elif call.data == "toggle_pause":
-        if state.extension_paused:
-            # Сейчас на паузе -> возобновляем
-            if send_command_sync({"type": "resume"}):
-                state.extension_paused = False
-                bot.answer_callback_query(call.id, "▶️ Работа возобновлена")
-                
-                new_text = "▶️ Работа расширения возобновлена."
-                if new_text != current_text:
-                    bot.edit_message_text(
-                        new_text,
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=get_main_keyboard()
-                    )
-                
-                if hasattr(state, 'main_message_id'):
-                    update_main_keyboard(call.message.chat.id, state.main_message_id)
-            else:
-                bot.answer_callback_query(call.id, "❌ Нет подключения", show_alert=True)
+        # Сейчас на паузе -> возобновляем, иначе ставим на паузу
+        resume = state.extension_paused
+        if await send_command({"type": "resume" if resume else "pause"}):
+            state.extension_paused = not resume
+            state.changed()
+            await api.answer_callback_query(call.id, "▶️ Работа возобновлена" if resume else "⏸️ Пауза")
+            
+            new_text = "▶️ Работа расширения возобновлена." if resume else "⏸️ Расширение поставлено на паузу."
+            await edit_screen(chat_id, message_id, new_text, get_main_keyboard())
+            
+            if hasattr(state, 'main_message_id') and state.main_message_id != message_id:
+                await update_main_keyboard(chat_id, state.main_message_id)
         else:
-            # Сейчас активно -> ставим на паузу
-            if send_command_sync({"type": "pause"}):
-                state.extension_paused = True
-                bot.answer_callback_query(call.id, "⏸️ Пауза")
-                
-                new_text = "⏸️ Расширение поставлено на паузу."
-                if new_text != current_text:
-                    bot.edit_message_text(
-                        new_text,
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=get_main_keyboard()
-                    )
-                
-                if hasattr(state, 'main_message_id'):
-                    update_main_keyboard(call.message.chat.id, state.main_message_id)
-            else:
-                bot.answer_callback_query(call.id, "❌ Нет подключения", show_alert=True)
+            await api.answer_callback_query(call.id, "❌ Нет подключения", show_alert=True)
     
     elif call.data == "status":
-        new_text = format_status()
-        if new_text != current_text:
-            bot.edit_message_text(
-                new_text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=get_main_keyboard()
-            )
+        if await edit_screen(chat_id, message_id, format_status(), get_main_keyboard()):
+            await api.answer_callback_query(call.id)
         else:
-            bot.answer_callback_query(call.id, "🔄 Статус не изменился")
+            await api.answer_callback_query(call.id, "🔄 Статус не изменился")
     
     elif call.data == "settings":
-        keyboard = InlineKeyboardMarkup(row_width=1)
-        keyboard.add(
-            InlineKeyboardButton(f"📊 Уровень логов: {state.settings['logLevel']}", callback_data="cycle_log"),
-            InlineKeyboardButton(f"🎲 Вероятность: {state.settings['commentProbability']}%", callback_data="cycle_prob"),
-            InlineKeyboardButton(f"⏸️ Автопауза: {'вкл' if state.settings['autoPauseAfterComment'] else 'выкл'}", callback_data="toggle_autopause"),
-            InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")
-        )
-        
-        new_text = "⚙️ <b>Настройки</b>\n\nИспользуйте кнопки для изменения.\nДля точной настройки используйте команды:\n/log, /prob, /autopause"
-        
-        if new_text != current_text:
-            bot.edit_message_text(
-                new_text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=keyboard
-            )
+        await edit_screen(chat_id, message_id, SETTINGS_TEXT, get_settings_keyboard())
+        await api.answer_callback_query(call.id)
     
     elif call.data == "cycle_log":
         new_level = (state.settings['logLevel'] + 1) % 3
-        state.settings['logLevel'] = new_level
-        send_command_sync({"type": "setLogLevel", "level": new_level})
-        
-        keyboard = InlineKeyboardMarkup(row_width=1)
-        keyboard.add(
-            InlineKeyboardButton(f"📊 Уровень логов: {new_level}", callback_data="cycle_log"),
-            InlineKeyboardButton(f"🎲 Вероятность: {state.settings['commentProbability']}%", callback_data="cycle_prob"),
-            InlineKeyboardButton(f"⏸️ Автопауза: {'вкл' if state.settings['autoPauseAfterComment'] else 'выкл'}", callback_data="toggle_autopause"),
-            InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")
-        )
-        
-        bot.edit_message_reply_markup(
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=keyboard
-        )
-        bot.answer_callback_query(call.id, f"Уровень логов: {new_level}")
+        state.set_setting('logLevel', new_level)
+        await send_command({"type": "setLogLevel", "level": new_level})
+        await edit_keyboard(chat_id, message_id, get_settings_keyboard())
+        await api.answer_callback_query(call.id, f"Уровень логов: {new_level}")
     
     elif call.data == "cycle_prob":
         new_prob = (state.settings['commentProbability'] + 10) % 110
         if new_prob > 100:
             new_prob = 0
-        state.settings['commentProbability'] = new_prob
-        send_command_sync({"type": "setProbability", "value": new_prob})
-        
-        keyboard = InlineKeyboardMarkup(row_width=1)
-        keyboard.add(
-            InlineKeyboardButton(f"📊 Уровень логов: {state.settings['logLevel']}", callback_data="cycle_log"),
-            InlineKeyboardButton(f"🎲 Вероятность: {new_prob}%", callback_data="cycle_prob"),
-            InlineKeyboardButton(f"⏸️ Автопауза: {'вкл' if state.settings['autoPauseAfterComment'] else 'выкл'}", callback_data="toggle_autopause"),
-            InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")
-        )
-        
-        bot.edit_message_reply_markup(
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=keyboard
-        )
-        bot.answer_callback_query(call.id, f"Вероятность: {new_prob}%")
+        state.set_setting('commentProbability', new_prob)
+        await send_command({"type": "setProbability", "value": new_prob})
+        await edit_keyboard(chat_id, message_id, get_settings_keyboard())
+        await api.answer_callback_query(call.id, f"Вероятность: {new_prob}%")
     
     elif call.data == "toggle_autopause":
         new_value = not state.settings['autoPauseAfterComment']
-        state.settings['autoPauseAfterComment'] = new_value
-        send_command_sync({"type": "setAutoPause", "value": new_value})
-        
-        keyboard = InlineKeyboardMarkup(row_width=1)
-        keyboard.add(
-            InlineKeyboardButton(f"📊 Уровень логов: {state.settings['logLevel']}", callback_data="cycle_log"),
-            InlineKeyboardButton(f"🎲 Вероятность: {state.settings['commentProbability']}%", callback_data="cycle_prob"),
-            InlineKeyboardButton(f"⏸️ Автопауза: {'вкл' if new_value else 'выкл'}", callback_data="toggle_autopause"),
-            InlineKeyboardButton("◀️ Назад", callback_data="back_to_start")
-        )
-        
-        bot.edit_message_reply_markup(
-            call.message.chat.id,
-            call.message.message_id,
-            reply_markup=keyboard
-        )
-        bot.answer_callback_query(call.id, f"Автопауза: {'вкл' if new_value else 'выкл'}")
+        state.set_setting('autoPauseAfterComment', new_value)
+        await send_command({"type": "setAutoPause", "value": new_value})
+        await edit_keyboard(chat_id, message_id, get_settings_keyboard())
+        await api.answer_callback_query(call.id, f"Автопауза: {'вкл' if new_value else 'выкл'}")
     
     elif call.data == "back_to_start":
-        new_text = "👋 <b>Message Finder Bot</b>\n\nВыберите действие:"
-        if new_text != current_text:
-            bot.edit_message_text(
-                new_text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=get_main_keyboard()
-            )
+        if await edit_screen(chat_id, message_id, START_TEXT, get_main_keyboard()):
+            await api.answer_callback_query(call.id)
         else:
-            bot.answer_callback_query(call.id, "◀️ Уже в главном меню")
+            await api.answer_callback_query(call.id, "◀️ Уже в главном меню")
 
-# ==================== WEBSOCKET-СЕРВЕР ====================
-async def handle_websocket(websocket):
-    """Обработчик WebSocket-соединения от расширения"""
-    client_id = id(websocket)
-    logger.info(f"🔌 Новое WebSocket-соединение: {client_id}")
-    
+# ==================== ОБРАБОТЧИКИ СООБЩЕНИЙ РАСШИРЕНИЯ ====================
+router = MessageRouter()
+
+COMMENT_SCHEMA = {
+    "data": {
+        "id": int,
+        "link": str,
+        "number": optional((int, type(None))),
+        "author": optional(str),
+        "email": optional((str, type(None))),
+        "timestamp": (int, float),
+    }
+}
+
+@router.handler('hello', {"clientId": str, "group": optional((str, type(None))), "acks": optional(bool),
+                          "scheduler": optional(bool), "instance": optional(str)})
+def handle_hello(conn, data):
+    # Рукопожатие: постоянный id вкладки, необязательная группа и поддержка подтверждений команд
+    existing = registry.by_id.get(data['clientId'])
+    instance = data.get('instance')
+    if (existing is not None and existing is not conn.session and existing.online
+            and instance and existing.instance and existing.instance != instance):
+        # Тот же clientId у другой открытой страницы - копия вкладки, а не переподключение:
+        # иначе две вкладки затирали бы статистику друг друга
+        logger.warning("🪪 clientId %s уже занят другой вкладкой, просим новый", existing.short_id,
+                       extra={"client": existing.client_id, "type": "hello"})
+        reply(conn, {"type": "renewClientId", "clientId": data['clientId']})
+        return
+    previous = conn.session.client_id
+    conn.session = registry.identify(conn.session, data['clientId'], data.get('group') or None)
+    conn.session.acks = data.get('acks', False)
+    conn.session.instance = instance
+    state.changed()
+    push_settings(conn)
+    if scheduler is not None and data.get('scheduler'):
+        # Вкладка умеет спрашивать слот: дальше кулдаун считает сервер
+        reply(conn, {"type": "scheduler", "enabled": True, "cooldown": int(scheduler.cooldown * 1000),
+                     "maxWait": int(scheduler.max_wait * 1000)})
+    if previous != conn.session.client_id:
+        flaps.forget(previous)
+        flaps.connected(conn.session.client_id, conn.session.short_id)
+    logger.info("🤝 Клиент представился: %s (группа: %s)", conn.session.client_id, conn.session.group or '-',
+                extra={"client": conn.session.client_id, "type": "hello"})
+
+def push_settings(conn):
+    """Одним сообщением отдает клиенту настройки, заданные из Telegram"""
+    settings = {name: state.settings[name] for name in state.configured}
+    # Адресные команды этому клиенту важнее глобальных значений
+    settings.update(conn.session.settings)
+    if settings:
+        asyncio.ensure_future(commands.execute(conn.session, {"type": "applySettings", "settings": settings}, COMMAND_SEND_TIMEOUT))
+
+@router.handler('pong', {"ts": (int, float)})
+def handle_pong(conn, data):
+    # Ответ на прикладной ping: клиент жив и его цикл событий не завис
+    conn.session.rtt = max(0.0, time.time() - data['ts'])
+
+@router.handler('ack', {"id": str, "state": optional(dict)})
+def handle_ack(conn, data):
+    commands.answered(conn.session, ACKED, data)
+
+@router.handler('nack', {"id": str, "error": optional(str)})
+def handle_nack(conn, data):
+    commands.answered(conn.session, NACKED, data)
+
+@router.handler('comment', COMMENT_SCHEMA)
+def handle_comment(conn, data):
+    comment = data['data']
+    if comment_keys.check((comment['id'], comment['link'] or '')):
+        logger.info("♻️ Повтор комментария %s от %s пропущен", comment['id'], conn.session.short_id,
+                    extra={"client": conn.session.client_id, "type": "comment"})
+        return
+    state.last_comment = comment
+    state.changed()
+    if scheduler is not None:
+        scheduler.commented(comment['id'])
     try:
-        await websocket.send(json.dumps({"type": "connected", "message": "Соединение установлено"}))
-    except:
-        pass
+        analytics.add(comment['timestamp'], conn.session.client_id, comment.get('author'), comment.get('email'), comment.get('number'))
+    except (TypeError, ValueError, OverflowError) as e:
+        # Аналитика не должна стоить уведомления о комментарии
+        logger.error("❌ Комментарий %s не попал в аналитику: %r", comment['id'], e,
+                     extra={"client": conn.session.client_id, "type": "comment"})
+    notify_event("comment", format_comment(comment), format_comment_short(comment), comment)
+
+def record_stats(session, deltas):
+    state.changed()
+    stats_series.record(deltas, state.stats['waitingForCooldown'], state.stats['queueLength'])
+    logger.debug("📊 Статистика %s обновлена: commented=%s", session.short_id, session.stats['commented'],
+                 extra={"client": session.client_id, "type": "stats"})
+
+@router.handler('candidate', {"candidateId": str, "messageId": int})
+def handle_candidate(conn, data):
+    # Вкладка хочет прокомментировать сообщение и ждет слот общего кулдауна
+    if scheduler is None:
+        reply(conn, {"type": "scheduler", "enabled": False})
+        return
+    started = time.perf_counter()
+    scheduler.offer(conn.session.client_id, data['candidateId'], data['messageId'])
+    slot_decision_duration.observe(time.perf_counter() - started)
+
+@router.handler('slot_result', {"candidateId": str, "commented": bool})
+def handle_slot_result(conn, data):
+    # Без комментария (чужой успел первым, панель не открылась) слот возвращается
+    if scheduler is not None:
+        scheduler.released(conn.session.client_id, data['candidateId'], data['commented'])
+
+@router.handler('foreign', {"messageId": int})
+def handle_foreign(conn, data):
+    # Вкладка увидела чужой комментарий: кандидаты других вкладок на это сообщение снимаются
+    if scheduler is not None:
+        scheduler.foreign(data['messageId'])
+
+@router.handler('stats', {"data": dict, "seq": optional(int)})
+def handle_stats(conn, data):
+    # Полный снимок; без seq - старый протокол, подтверждение не нужно
+    session = conn.session
+    deltas = registry.update_stats(session, data['data'], data.get('seq'))
+    record_stats(session, deltas)
+    if 'seq' in data:
+        reply(conn, {"type": "stats_ack", "seq": data['seq']})
+
+@router.handler('stats_delta', {"seq": int, "delta": dict, "values": optional(dict)})
+def handle_stats_delta(conn, data):
+    # Приращения счетчиков после снимка; при пропуске номера просим полный снимок
+    session = conn.session
+    deltas = registry.apply_stats_delta(session, data['seq'], data['delta'], data.get('values'))
+    if deltas is None:
+        logger.warning("⚠️ Пропуск в статистике %s (seq %s, ждали %s), запрошен снимок",
+                       session.short_id, data['seq'], session.stats_seq,
+                       extra={"client": session.client_id, "type": "stats_delta"})
+        reply(conn, {"type": "resync", "seq": session.stats_seq})
+        return
+    if deltas:
+        record_stats(session, deltas)
+    reply(conn, {"type": "stats_ack", "seq": data['seq']})
+
+@router.handler('status_update', {"paused": optional(bool)})
+def handle_status_update(conn, data):
+    # Обновление статуса паузы от расширения
+    if 'paused' not in data:
+        return
+    conn.session.paused = data['paused']
+    state.extension_paused = data['paused']
+    state.changed()
+    logger.info("🔄 Статус паузы обновлен: %s", 'пауза' if state.extension_paused else 'активно',
+                extra={"client": conn.session.client_id, "type": "status_update"})
     
-    state.connected_clients.add(websocket)
-    logger.info(f"👥 Всего клиентов: {len(state.connected_clients)}")
+    # Отправляем статус в Telegram
+    broadcast("status", f"🔄 Статус расширения изменен: {'⏸️ На паузе' if state.extension_paused else '▶️ Активно'}")
     
-    bot.send_message(
-        YOUR_CHAT_ID,
-        f"✅ Расширение подключилось к серверу!\n"
-        f"Клиентов: {len(state.connected_clients)}",
-        reply_markup=get_main_keyboard()
+    # Обновляем клавиатуру в главном сообщении, если она там другая
+    keyboard = get_main_keyboard()
+    if hasattr(state, 'main_message_id') and render_cache.changed(config.chat_id, state.main_message_id, markup=keyboard):
+        render_cache.remember(config.chat_id, state.main_message_id, markup=keyboard)
+        notifier.call(
+            "edit_message_reply_markup",
+            config.chat_id,
+            state.main_message_id,
+            reply_markup=keyboard
+        )
+
+@router.handler('log', {"message": str, "level": optional(int)})
+def handle_log(conn, data):
+    level = data.get('level', 1)
+    if level < state.settings['logLevel']:
+        return
+    # Пишем в лог и пересылаем в Telegram не сразу, а через буфер с бюджетом
+    log_pipeline.add(conn.session.short_id, level, data['message'])
+
+# ==================== WEBSOCKET-СЕРВЕР ====================
+async def _greet(websocket):
+    payload = dumps({"type": "connected", "message": "Соединение установлено"})
+    if recorder:
+        recorder.record(OUT, websocket, payload)
+    try:
+        await websocket.send(payload)
+    except Exception:
+        pass
+
+def client_opened(websocket):
+    """Новое соединение расширения: локальное или пришедшее с экземпляра edge"""
+    conn = Connection(websocket, registry.connect(websocket))
+    if recorder:
+        recorder.record(OPEN, websocket)
+    state.changed()
+    logger.info("🔌 Новое WebSocket-соединение: %s, всего клиентов: %d", conn.session.client_id, len(registry),
+                extra={"client": conn.session.client_id})
+    asyncio.ensure_future(_greet(websocket))
+    flaps.connected(conn.session.client_id, conn.session.short_id)
+    return conn
+
+def client_frame(conn, message):
+    """Один кадр от расширения"""
+    if recorder:
+        recorder.record(IN, conn.websocket, message)
+    data = router.decode(message)
+    if data is None:
+        return
+    conn.session.touch()
+    started = time.perf_counter()
+    try:
+        handler = router.resolve(data)
+        if handler is not None:
+            # В журнал - только кадры, прошедшие схему; ошибка журнала не должна мешать обработке
+            try:
+                event_store.append(data, conn.session.client_id, message if isinstance(message, str) else None)
+            except Exception as e:
+                logger.error("❌ Кадр %s не записан в журнал: %r", data['type'], e,
+                             extra={"client": conn.session.client_id, "type": data['type']})
+            handler(conn, data)
+    except Exception as e:
+        logger.error("❌ Ошибка обработки сообщения %s: %r", data['type'], e,
+                     extra={"client": conn.session.client_id, "type": data['type']})
+    # Неизвестные типы в одну метку, чтобы клиент не раздувал число серий
+    handler_duration.observe(
+        time.perf_counter() - started,
+        data['type'] if data['type'] in router.handlers else "<unknown>"
     )
-    
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Кадр %s обработан", data['type'],
+                     extra={"client": conn.session.client_id, "type": data['type'], "latency_ms": elapsed_ms(started)})
+
+def client_closed(conn, websocket, reason):
+    session = conn.session
+    if recorder:
+        recorder.record(CLOSE, websocket)
+    if registry.by_socket.get(websocket) is session:
+        # Клиента еще не вытеснили по heartbeat или ошибке отправки - обрыв замечен здесь
+        disconnect_detection.observe(time.time() - session.last_seen, reason)
+    registry.disconnect(session, websocket)
+    state.changed()
+    # Закрылся старый сокет клиента, который уже переподключился на новом, - клиент на месте
+    if not session.online:
+        if scheduler is not None:
+            scheduler.forget(session.client_id)
+        flaps.disconnected(session.client_id)
+    logger.info("👥 Клиент %s отключен. Осталось: %d", session.short_id, len(registry), extra={"client": session.client_id})
+
+async def handle_websocket(websocket):
+    """Обработчик WebSocket-соединения от расширения"""
+    conn = client_opened(websocket)
+    reason = "error"
     try:
         async for message in websocket:
-            try:
-                data = json.loads(message)
-                
-                if data['type'] == 'comment':
-                    state.last_comment = data['data']
-                    bot.send_message(
-                        YOUR_CHAT_ID,
-                        format_comment(data['data']),
-                        reply_markup=get_main_keyboard()
-                    )
-                
-                elif data['type'] == 'stats':
-                    state.stats.update(data['data'])
-                    logger.info(f"📊 Статистика обновлена: commented={state.stats['commented']}")
-                
-                elif data['type'] == 'status_update':
-                    # Обновление статуса паузы от расширения
-                    if 'paused' in data:
-                        state.extension_paused = data['paused']
-                        logger.info(f"🔄 Статус паузы обновлен: {'пауза' if state.extension_paused else 'активно'}")
-                        
-                        # Отправляем статус в Telegram
-                        bot.send_message(
-                            YOUR_CHAT_ID,
-                            f"🔄 Статус расширения изменен: {'⏸️ На паузе' if state.extension_paused else '▶️ Активно'}",
-                            reply_markup=get_main_keyboard()
-                        )
-                        
-                        # Обновляем клавиатуру в главном сообщении
-                        if hasattr(state, 'main_message_id'):
-                            update_main_keyboard(YOUR_CHAT_ID, state.main_message_id)
-                
-                elif data['type'] == 'log':
-                    level = data.get('level', 1)
-                    if level >= state.settings['logLevel']:
-                        logger.info(f"📝 [ЛОГ {level}] {data['message']}")
-                        
-                        if level >= 2:
-                            bot.send_message(
-                                YOUR_CHAT_ID,
-                                f"🔍 <b>Отладка:</b>\n<code>{data['message']}</code>",
-                                reply_markup=get_main_keyboard()
-                            )
-                            
-            except json.JSONDecodeError:
-                logger.error(f"❌ Ошибка парсинга JSON")
-            except KeyError as e:
-                logger.error(f"❌ Отсутствует ключ в сообщении: {e}")
-    
+            client_frame(conn, message)
+        reason = "close"
+    except websockets.exceptions.ConnectionClosedOK:
+        reason = "close"
+        logger.info("🔌 Соединение закрыто: %s", conn.session.client_id)
     except websockets.exceptions.ConnectionClosed as e:
-        logger.info(f"🔌 Соединение закрыто: {client_id}")
+        logger.info("🔌 Соединение оборвано: %s (%s)", conn.session.client_id, str(e))
     except Exception as e:
-        logger.error(f"❌ Ошибка в WebSocket: {e}")
+        logger.error("❌ Ошибка в WebSocket: %r", e)
     finally:
-        state.connected_clients.remove(websocket)
-        logger.info(f"👥 Клиент отключен. Осталось: {len(state.connected_clients)}")
-        
-        bot.send_message(
-            YOUR_CHAT_ID,
-            f"❌ Расширение отключилось от сервера.\n"
-            f"Осталось клиентов: {len(state.connected_clients)}",
-            reply_markup=get_main_keyboard()
-        )
+        client_closed(conn, websocket, reason)
+
+def evict(session, silent):
+    """Вытесняет клиента, переставшего отвечать на прикладной ping"""
+    websocket = session.websocket
+    logger.warning("💀 Клиент %s молчит %.0fс, соединение закрывается", session.short_id, silent,
+                   extra={"client": session.client_id})
+    disconnect_detection.observe(silent, "heartbeat")
+    registry.disconnect(session)
+    state.changed()
+    if not session.online:
+        flaps.disconnected(session.client_id)
+    asyncio.ensure_future(websocket.close())
+
+async def heartbeat_loop():
+    """Прикладной ping всем клиентам; отвечавшие раньше, но замолчавшие - вытесняются"""
+    while True:
+        await asyncio.sleep(config.heartbeat_interval)
+        now = time.time()
+        payload = dumps({"type": "ping", "ts": now})
+        for session in registry.connected:
+            silent = now - session.last_seen
+            # Старые клиенты не отвечают pong: для них остается ping протокола
+            if session.rtt is not None and silent > config.heartbeat_timeout:
+                evict(session, silent)
+            else:
+                asyncio.ensure_future(_send_to_client(session, payload, COMMAND_SEND_TIMEOUT))
 
-async def start_websocket_server():
+async def start_websocket_server(handler=handle_websocket):
     """Запуск WebSocket-сервера"""
     server = await websockets.serve(
-        handle_websocket,
-        WEBSOCKET_HOST,
-        WEBSOCKET_PORT
+        handler,
+        config.websocket_host,
+        config.websocket_port,
+        ping_interval=config.ws_ping_interval,
+        ping_timeout=config.ws_ping_timeout,
+        close_timeout=WS_CLOSE_TIMEOUT,
+        # permessage-deflate с урезанным окном: снимки сжимаются, а память на соединение остается малой
+        compression=None,
+        extensions=[ServerPerMessageDeflateFactory(
+            server_max_window_bits=11,
+            client_max_window_bits=11,
+            compress_settings={"memLevel": 4},
+        )],
     )
-    logger.info(f"WebSocket-сервер запущен на {WEBSOCKET_HOST}:{WEBSOCKET_PORT}")
+    logger.info(f"WebSocket-сервер запущен на {config.websocket_host}:{config.websocket_port}")
     return server
 
-# ==================== ЗАПУСК БОТА В ОТДЕЛЬНОМ ПОТОКЕ ====================
+# ==================== ЗАПУСК БОТА ====================
 def run_bot():
     """Запускает Telegram бота в отдельном потоке"""
-    logger.info("Telegram бот запущен")
-    bot.infinity_polling()
+    logger.info("Telegram бот запущен (polling в отдельном потоке)")
+    api.bot.infinity_polling()
+
+async def process_update(data):
+    """Апдейт из webhook: разбор и обработчик из таблицы прямо в цикле событий"""
+    from telebot.types import Update
+    
+    update = Update.de_json(data)
+    started = time.perf_counter()
+    await handlers.dispatch(update)
+    kind = "callback" if update.callback_query is not None else "message"
+    webhook_duration.observe(time.perf_counter() - started, kind)
+
+async def start_webhook():
+    """Приемник апдейтов вместо polling: без потока и без ожидания следующего getUpdates"""
+    server = WebhookServer(process_update, config.webhook_host, config.webhook_port, config.webhook_path, config.webhook_secret,
+                           concurrency=config.webhook_concurrency)
+    await server.start()
+    metrics.counter("hub_webhook_updates_total", "Запросы к webhook Telegram по итогу", ["result"],
+                    callback=lambda: {(k,): v for k, v in server.stats.items()})
+    metrics.gauge("hub_webhook_in_flight", "Апдейты webhook в обработке и в ожидании", callback=lambda: server.in_flight)
+    if config.webhook_url:
+        await api.set_webhook(url=config.webhook_url, secret_token=config.webhook_secret, max_connections=config.webhook_concurrency,
+                              allowed_updates=["message", "callback_query"])
+        logger.info(f"🪝 Webhook зарегистрирован: {config.webhook_url}")
+    return server
+
+async def start_bot():
+    """Подключает обработчики и запускает прием апдейтов в выбранном режиме"""
+    if config.bot_updates == 'webhook':
+        await start_webhook()
+        return
+    try:
+        # После режима webhook Telegram отвечает на getUpdates ошибкой 409, пока webhook не снят
+        await api.delete_webhook()
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось снять webhook: {e!r}")
+    if config.bot_runtime == 'async':
+        handlers.install_async(api)
+        asyncio.ensure_future(api.infinity_polling())
+        logger.info("Telegram бот запущен (polling в цикле событий)")
+    else:
+        # Апдейты приходят в поток polling'а, а обрабатываются в цикле сервера
+        handlers.install_threaded(api.bot, state.loop)
+        bot_thread = threading.Thread(target=run_bot, daemon=True)
+        bot_thread.start()
 
 # ==================== ОСНОВНАЯ ФУНКЦИЯ ====================
+async def load_comment_keys():
+    """Восстанавливает ключи объявленных комментариев из журнала после перезапуска"""
+    now = time.time()
+    try:
+        rows = await asyncio.to_thread(
+            event_store.between, int((now - comment_keys.ttl) * 1000), int(now * 1000), 'comment', comment_keys.capacity
+        )
+    except Exception as e:
+        logger.error(f"❌ Не удалось прочитать комментарии из журнала: {e!r}")
+        return
+    comment_keys.load(((row['msg_id'], row['link'] or ''), row['ts'] / 1000) for row in rows)
+    logger.info(f"♻️ Ключей комментариев восстановлено: {len(comment_keys)}")
+
+async def load_analytics():
+    """Перестраивает колонки аналитики по журналу; до запуска серверов, пока новых комментариев нет"""
+    try:
+        await asyncio.to_thread(lambda: analytics.rebuild(event_store.comments()))
+    except Exception as e:
+        logger.error(f"❌ Не удалось перестроить аналитику из журнала: {e!r}")
+
+# ==================== СНИМОК СОСТОЯНИЯ ====================
+def collect_snapshot():
+    return {
+        "settings": state.settings,
+        "configured": sorted(state.configured),
+        "extension_paused": state.extension_paused,
+        "last_comment": state.last_comment,
+        "main_message_id": getattr(state, 'main_message_id', None),
+        "digest": {"enabled": digest.enabled, "window": digest.window, "max_events": digest.max_events},
+        "sessions": registry.export(),
+        "subscribers": subscribers.export(),
+    }
+
+def restore_snapshot(snapshot):
+    """Возвращает состояние из снимка; вызывается до запуска серверов"""
+    state.settings.update(snapshot.get('settings') or {})
+    state.configured = set(snapshot.get('configured') or ()) & set(state.settings)
+    state.extension_paused = snapshot.get('extension_paused', False)
+    state.last_comment = snapshot.get('last_comment')
+    if snapshot.get('main_message_id'):
+        state.main_message_id = snapshot['main_message_id']
+    digest_settings = snapshot.get('digest') or {}
+    digest.enabled = digest_settings.get('enabled', digest.enabled)
+    digest.window = digest_settings.get('window', digest.window)
+    digest.max_events = digest_settings.get('max_events', digest.max_events)
+    registry.restore(snapshot.get('sessions') or [])
+    if 'subscribers' in snapshot:
+        subscribers.restore(snapshot['subscribers'])
+    state.changed()
+    logger.info(f"💾 Состояние восстановлено: клиентов {len(registry.by_id)}, прокомментировано {state.stats['commented']}")
+
+snapshots = Snapshotter(config.state_snapshot_path, collect_snapshot, lambda: state.version)
+
+async def run_edge():
+    """Экземпляр edge: только соединения расширений, все остальное делает control"""
+    backplane = BrokerBackplane(config.hub_instance, config.backplane_url)
+    relay = EdgeRelay(backplane, config.backplane_control)
+    await backplane.start()
+    ws_server = await start_websocket_server(relay.handle)
+    try:
+        await ws_server.wait_closed()
+    finally:
+        await backplane.stop()
+
+async def start_control_backplane():
+    """Экземпляр control поднимает брокер шины и принимает через него клиентов edge.
+
+    Возвращает (broker, backplane, bridge): цикл событий держит задачи только
+    слабыми ссылками, поэтому main() хранит их до остановки сервера.
+    """
+    broker = Broker(config.backplane_url)
+    await broker.start()
+    backplane = BrokerBackplane(config.hub_instance, config.backplane_url)
+    bridge = ControlBridge(backplane, client_opened, client_frame, client_closed)
+    await backplane.start()
+    return broker, backplane, bridge
+
+async def stop_control_backplane(control):
+    broker, backplane, _ = control
+    await backplane.stop()
+    await broker.stop()
+
 async def main():
-    """Главная функция, запускающая WebSocket-сервер"""
-    # Запускаем бота в отдельном потоке
-    bot_thread = threading.Thread(target=run_bot, daemon=True)
-    bot_thread.start()
+    """Главная функция, запускающая WebSocket-сервер; настройки проверены в Config.load()"""
+    init_logging()
+    if config.hub_role == 'edge':
+        try:
+            await run_edge()
+        finally:
+            log_control.stop()
+        return
+    
+    # Обработчики Telegram и команды из других потоков исполняются в этом цикле
+    state.loop = asyncio.get_running_loop()
+    snapshot = snapshots.load()
+    if snapshot:
+        restore_snapshot(snapshot)
+    snapshots.start()
+    notifier.start()
+    event_store.start()
+    if recorder:
+        recorder.start()
+    await load_comment_keys()
+    if not config.headless:
+        # Колонки нужны только /report
+        await load_analytics()
+    if config.metrics_port:
+        await MetricsServer(metrics, config.websocket_host, config.metrics_port).start()
+        asyncio.ensure_future(monitor_loop_lag(loop_lag, loop_lag_histogram))
+    asyncio.ensure_future(heartbeat_loop())
+    control = await start_control_backplane() if config.hub_role == 'control' else None
+    
+    if not config.headless:
+        await start_bot()
     
     # Запускаем WebSocket-сервер
     ws_server = await start_websocket_server()
+    # SIGTERM (systemd, bench/load.py) останавливает сервер так же, как Ctrl+C:
+    # запись кадров, журнал событий и снимок состояния дописываются в finally
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, ws_server.close)
+    except NotImplementedError:
+        pass  # Windows
     
     # Держим сервер запущенным
-    await ws_server.wait_closed()
+    try:
+        await ws_server.wait_closed()
+    finally:
+        if control:
+            await stop_control_backplane(control)
+        snapshots.save_now()
+        event_store.close()
+        if recorder:
+            recorder.close()
+        log_control.stop()
 
 if __name__ == "__main__":
-    print(f"🚀 Запуск websocket_server.py с портом {WEBSOCKET_PORT}")
+    mode = f"без Telegram, уведомления: {config.notifier}" if config.headless else config.hub_role
+    print(f"🚀 Запуск websocket_server.py ({mode}) с портом {config.websocket_port} (JSON: {JSON_BACKEND})")
     asyncio.run(main())